@@ -1,35 +1,210 @@
 #!/opt/conda/bin/python
 """
 analytics.py: Run Analytical Queries
+- Results stream from named server-side cursors in fetchmany batches
+- Written to stdout (default) or csv/jsonl/parquet files with --format
+- With --concurrent, all queries run at once on pooled connections with a
+  per-query statement_timeout; Ctrl-C cancels them, output stays in order
+- Results are cached locally per ETL version, read from etl_control, so
+  repeat runs between loads run only that one query (--no-cache to bypass)
 """
+import argparse
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
+import psycopg2.extensions
+import instrument
 import loadconfigs as l
-from sql_queries import analytical_queries
+from connection import get_pool
+from result_cache import CachingSink, ResultCache, read_etl_version
+from result_sinks import SINKS, open_sink
+from sql_queries import analytical_queries, analytical_query_names
 
-def analytics(cur, conn):
+
+def stream_query(conn, name, query, fmt, output_dir, batch_size, out=None, timeout=0,
+                 cache=None):
+    # Named cursors and SET LOCAL only work in a transaction, so one is
+    # opened even on an autocommit pool (pool_autocommit)
+    autocommit = conn.autocommit
+    conn.autocommit = False
+    try:
+        # Timeout (ms) applies to this query's transaction only
+        if timeout:
+            conn.cursor().execute('SET LOCAL statement_timeout TO %s', (timeout,))
+
+        # Named cursor keeps the result set on the server, fetched batch by batch
+        cur = conn.cursor(name='analytics_{}'.format(name))
+        cur.itersize = batch_size
+        try:
+            instrument.execute(cur, query, 'analytics', name)
+            rows = cur.fetchmany(batch_size)
+            columns = [col[0] for col in cur.description]
+            type_codes = [col[1] for col in cur.description]
+            sink, path = open_sink(fmt, output_dir, name, columns, type_codes, out)
+            if cache is not None and cache.enabled:
+                sink = CachingSink(sink, l.CACHE_MAX_ROWS)
+            count = 0
+            try:
+                while rows:
+                    sink.write(rows)
+                    count += len(rows)
+                    rows = cur.fetchmany(batch_size)
+            finally:
+                sink.close()
+        finally:
+            cur.close()
+        conn.commit()
+    finally:
+        # Ends a failed query's transaction, a no-op after the commit
+        conn.rollback()
+        conn.autocommit = autocommit
+    if isinstance(sink, CachingSink) and sink.rows is not None:
+        cache.put(query, columns, type_codes, sink.rows)
+    return count, path
+
+
+def replay_cached(cached, name, fmt, output_dir, batch_size, out=None):
+    rows = cached['rows']
+    sink, path = open_sink(fmt, output_dir, name, cached['columns'],
+                           cached['type_codes'], out)
+    try:
+        for start in range(0, len(rows), batch_size):
+            sink.write(rows[start:start+batch_size])
+    finally:
+        sink.close()
+    return len(rows), path
+
+
+def run_query(pool, cache, name, query, fmt, output_dir, batch_size, out=None,
+              timeout=0, active=None):
+    # Serve from the cache when the warehouse hasn't changed since it was filled
+    cached = cache.get(query) if cache is not None else None
+    if cached is not None:
+        count, path = replay_cached(cached, name, fmt, output_dir, batch_size, out)
+        return count, path, True
+
+    with pool.connection() as conn:
+        # Register the connection so Ctrl-C can cancel it
+        if active is not None:
+            with active['lock']:
+                active['conns'].add(conn)
+        try:
+            count, path = stream_query(conn, name, query, fmt, output_dir,
+                                       batch_size, out, timeout, cache)
+        finally:
+            if active is not None:
+                with active['lock']:
+                    active['conns'].discard(conn)
+    return count, path, False
+
+
+def analytics(pool, cache=None, fmt='stdout', output_dir=l.ANALYTICS_OUTPUT_DIR,
+              batch_size=l.ANALYTICS_BATCH_SIZE, timeout=l.ANALYTICS_QUERY_TIMEOUT):
     print('\nRunning Analytics...')
-    for idx,query in enumerate(analytical_queries):    
+    for idx,query in enumerate(analytical_queries):
             print('\nRUNNING QUERY {}:\n{}'.format(idx+1,query))
-            cur.execute(query)
-            results = cur.fetchall()    
-            for row in results:
-                print(row)
-            conn.commit()
-            print('QUERY{} COMPLETED'.format(idx+1))
+            count, path, cached = run_query(pool, cache, analytical_query_names[idx],
+                                            query, fmt, output_dir, batch_size,
+                                            timeout=timeout)
+            if path:
+                print('{} rows written to {}'.format(count, path))
+            print('QUERY{} COMPLETED{}'.format(idx+1, ' (cached)' if cached else ''))
     print('ANALYTICS COMPLETE')
 
 
+def run_concurrent_query(pool, cache, active, name, query, fmt, output_dir,
+                         batch_size, timeout):
+    # Results are buffered so they can be printed in the original order
+    out = io.StringIO()
+    start = time.time()
+    count, path, cached = run_query(pool, cache, name, query, fmt, output_dir,
+                                    batch_size, out, timeout, active)
+    return out.getvalue(), count, path, cached, time.time() - start
+
+
+def analytics_concurrent(pool, cache=None, fmt='stdout', output_dir=l.ANALYTICS_OUTPUT_DIR,
+                         batch_size=l.ANALYTICS_BATCH_SIZE,
+                         timeout=l.ANALYTICS_QUERY_TIMEOUT,
+                         max_workers=l.ANALYTICS_MAX_WORKERS):
+    print('\nRunning Analytics (concurrent, up to {} connections)...'.format(max_workers))
+    active = {'lock': threading.Lock(), 'conns': set()}
+    start = time.time()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = [executor.submit(run_concurrent_query, pool, cache, active, name, query,
+                               fmt, output_dir, batch_size, timeout)
+               for name, query in zip(analytical_query_names, analytical_queries)]
+    failed = 0
+    try:
+        # Print each query once it and every query before it are done
+        for idx, future in enumerate(futures):
+            print('\nRUNNING QUERY {}:\n{}'.format(idx+1, analytical_queries[idx]))
+            try:
+                output, count, path, cached, elapsed = future.result()
+            except psycopg2.extensions.QueryCanceledError as e:
+                failed += 1
+                print('QUERY{} CANCELLED: {}'.format(idx+1, str(e).strip()))
+                continue
+            except Exception as e:
+                failed += 1
+                print('QUERY{} FAILED: {}'.format(idx+1, str(e).strip()))
+                continue
+            print(output, end='')
+            if path:
+                print('{} rows written to {}'.format(count, path))
+            print('QUERY{} COMPLETED in {:.2f}s{}'.format(
+                idx+1, elapsed, ' (cached)' if cached else ''))
+    except KeyboardInterrupt:
+        print('\nCancelling running queries...')
+        executor.shutdown(wait=False, cancel_futures=True)
+        with active['lock']:
+            for conn in active['conns']:
+                conn.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+    print('\nWall time: {:.2f}s'.format(time.time() - start))
+    if failed:
+        raise RuntimeError('{} analytical queries failed'.format(failed))
+    print('ANALYTICS COMPLETE')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run Analytical Queries')
+    parser.add_argument('--format', choices=sorted(SINKS), default='stdout',
+                        help='where to write results')
+    parser.add_argument('--output-dir', default=l.ANALYTICS_OUTPUT_DIR,
+                        help='directory for csv/jsonl/parquet results')
+    parser.add_argument('--batch-size', type=int, default=l.ANALYTICS_BATCH_SIZE,
+                        help='rows fetched per round trip')
+    parser.add_argument('--concurrent', action='store_true',
+                        help='run all queries at once on pooled connections')
+    parser.add_argument('--timeout', type=int, default=l.ANALYTICS_QUERY_TIMEOUT,
+                        help='per-query statement_timeout in ms (0 = none)')
+    parser.add_argument('--max-workers', type=int, default=l.ANALYTICS_MAX_WORKERS,
+                        help='max concurrent connections for --concurrent')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always run queries on the cluster')
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     try:
-        # Connect to cluster
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-            l.DWH_ENDPOINT, l.DWH_DB, l.DWH_DB_USER, l.DWH_DB_PASSWORD, l.DWH_PORT))
-        cur = conn.cursor()
+        # Sessions in the analytics WLM queue
+        pool = get_pool(l.ANALYTICS_QUERY_GROUP)
 
-        # Run Analytical Queries
-        analytics(cur, conn)
+        # Results cached for the current ETL version
+        cache = None if args.no_cache else ResultCache(version=read_etl_version(pool))
 
-        conn.close()
+        # Run Analytical Queries, on the cluster only on cache misses
+        if args.concurrent:
+            analytics_concurrent(pool, cache, args.format, args.output_dir,
+                                 args.batch_size, args.timeout, args.max_workers)
+        else:
+            analytics(pool, cache, args.format, args.output_dir,
+                      args.batch_size, args.timeout)
 
     except Exception as e:
         print(e)
@@ -0,0 +1,322 @@
+"""
+backends.py: Run the Redshift statements on a local PostgreSQL or DuckDB
+- translate() rewrites Redshift-only syntax (DISTKEY/SORTKEY/DISTSTYLE,
+  IDENTITY, GETDATE(), EXTRACT(weekday), REGEXP_REPLACE) for the dialect,
+  session settings with no local equivalent are skipped
+- LocalConnection/LocalCursor wrap a psycopg2-style connection so every
+  statement is translated on execute, and COPY ... FROM 's3://...' JSON
+  loads are routed to local_ingest.py over the local data tree
+- DuckDBConnection gives DuckDB psycopg2 behaviour: implicit transactions,
+  rowcount and COPY ... FROM STDIN (duckdb is imported only when used)
+- With backend = postgres|duckdb in [BACKEND], connection.get_pool() hands
+  out these connections, so create_tables.py, etl.py and analytics.py run
+  offline unchanged
+"""
+import csv
+import json
+import os
+import re
+import tempfile
+import threading
+import psycopg2.extensions
+import loadconfigs as l
+from connection import _psycopg2_connect
+from local_ingest import iter_files, load_paths
+from sources import local_data_path
+
+# Redshift-only syntax PostgreSQL rejects. Primary keys are dropped as
+# Redshift doesn't enforce them and the loads rely on that.
+PG_REWRITES = [
+    (r'\bIDENTITY\s*\(\s*0\s*,\s*1\s*\)', 'GENERATED BY DEFAULT AS IDENTITY (START WITH 0 MINVALUE 0)'),
+    (r',\s*PRIMARY KEY\s*\([^)]*\)', ''),
+    (r'\bPRIMARY KEY\b', ''),
+    (r'\bDISTSTYLE\s+\w+', ''),
+    (r'\b(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)', ''),
+    (r'\bDISTKEY\s*\([^)]*\)', ''),
+    (r'\b(DISTKEY|SORTKEY)\b', ''),
+    (r'\bENCODE\s+\w+', ''),
+    (r'EXTRACT\(weekday\b', 'EXTRACT(dow'),
+    (r'\bGETDATE\(\)', 'NOW()'),
+    # Redshift's REGEXP_REPLACE replaces every match, PostgreSQL's needs 'g'
+    (r"REGEXP_REPLACE\(([^()]*), ('[^']*'), ('[^']*')\)", r"REGEXP_REPLACE(\1, \2, \3, 'g')"),
+]
+
+# DuckDB has no IDENTITY columns (see _duckdb_identity) and its NOW() is a
+# TIMESTAMP WITH TIME ZONE; the PostgreSQL rewrites apply after these
+DUCKDB_REWRITES = [
+    (r'\bGETDATE\(\)', 'CAST(CURRENT_TIMESTAMP AS TIMESTAMP)'),
+]
+
+# Session settings only Redshift (query_group) or PostgreSQL (statement_timeout) has
+SKIPPED_SETTINGS = {'postgres': re.compile(r'\s*SET\s+(LOCAL\s+)?query_group\b', re.IGNORECASE),
+                    'duckdb': re.compile(r'\s*SET\s+(LOCAL\s+)?(query_group|statement_timeout)\b',
+                                         re.IGNORECASE)}
+
+COPY_PATTERN = re.compile(r"\s*COPY\s+(\w+)\s*(?:\([^)]*\))?\s+FROM\s+'([^']*)'(.*)$",
+                          re.IGNORECASE | re.DOTALL)
+STDIN_PATTERN = re.compile(r'\s*COPY\s+(\w+)\s*\(([^)]*)\)\s+FROM\s+STDIN', re.IGNORECASE)
+DML_PATTERN = re.compile(r'\s*(INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+IDENTITY_PATTERN = re.compile(r'(\w+)\s+(\w+)\s+IDENTITY\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)',
+                              re.IGNORECASE)
+UNESCAPES = {'t': '\t', 'n': '\n', 'r': '\r', '\\': '\\'}
+
+
+def _duckdb_identity(query):
+    # IDENTITY(start, step) -> a sequence created with the table
+    table = re.search(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', query, re.IGNORECASE)
+    if table is None:
+        return query
+    sequences = []
+
+    def column(match):
+        name, type_, start, step = match.groups()
+        sequence = '{}_{}_seq'.format(table.group(1), name)
+        sequences.append('CREATE SEQUENCE IF NOT EXISTS {} INCREMENT BY {} MINVALUE {} START {};'
+                         .format(sequence, step, start, start))
+        # NOT NULL as the IDENTITY column is on Redshift
+        return "{} {} DEFAULT nextval('{}') NOT NULL".format(name, type_, sequence)
+
+    query = IDENTITY_PATTERN.sub(column, query)
+    return '\n'.join(sequences + [query])
+
+
+def translate(query, dialect):
+    # The statement to run on dialect, None to skip it
+    if dialect == 'redshift':
+        return query
+    if SKIPPED_SETTINGS[dialect].match(query):
+        return None
+    if dialect == 'duckdb':
+        for pattern, replacement in DUCKDB_REWRITES:
+            query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+        query = _duckdb_identity(query)
+    for pattern, replacement in PG_REWRITES:
+        query = re.sub(pattern, replacement, query, flags=re.IGNORECASE)
+    return query
+
+
+def copy_local(cur, table, url, options):
+    # COPY table FROM 's3://...' JSON, loaded from the local data tree
+    if re.search(r'\b(CSV|PARQUET)\b', options, re.IGNORECASE):
+        raise ValueError('COPY {} FROM {}: only JSON sources load locally, '
+                         'prestaged CSV/Parquet parts need the cluster'.format(table, url))
+    if re.search(r'\bMANIFEST\b', options, re.IGNORECASE):
+        with open(local_data_path(url)) as f:
+            paths = [local_data_path(entry['url']) for entry in json.load(f)['entries']]
+    else:
+        path = local_data_path(url)
+        paths = [path] if os.path.isfile(path) else iter_files(path)
+    return load_paths(cur, table, paths).rows
+
+
+class LocalCursor:
+    def __init__(self, cursor, connection, dialect):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, 'connection', connection)
+        object.__setattr__(self, 'dialect', dialect)
+        object.__setattr__(self, '_local_rowcount', None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # e.g. itersize, set on the wrapped cursor
+        setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        if self._local_rowcount is not None:
+            return self._local_rowcount
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        if self._local_rowcount is not None:
+            return None
+        return self._cursor.description
+
+    def execute(self, query, params=None):
+        object.__setattr__(self, '_local_rowcount', None)
+        copy = COPY_PATTERN.match(query)
+        if copy:
+            rows = copy_local(self._cursor, *copy.groups())
+            object.__setattr__(self, '_local_rowcount', rows)
+            return
+        statement = translate(query, self.dialect)
+        if statement is None:
+            object.__setattr__(self, '_local_rowcount', -1)
+            return
+        self._cursor.execute(statement, params)
+
+
+class LocalConnection:
+    def __init__(self, conn, dialect):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, 'dialect', dialect)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        # e.g. autocommit, set on the wrapped connection
+        setattr(self._conn, name, value)
+
+    def cursor(self, name=None, **kwargs):
+        # DuckDB has no server-side cursors, results are fetched client side
+        if name and self.dialect == 'postgres':
+            cursor = self._conn.cursor(name=name, **kwargs)
+        else:
+            cursor = self._conn.cursor()
+        return LocalCursor(cursor, self, self.dialect)
+
+
+class DuckDBCursor:
+    itersize = 2000
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.rowcount = -1
+        self.result = None
+
+    def execute(self, query, params=None):
+        if params is not None:
+            query = query.replace('%s', '?').replace('%%', '%')
+        self.connection.begin()
+        self.description, self.rowcount, self.result = None, -1, None
+        if DML_PATTERN.match(query):
+            row = self.connection.db.execute(query, params).fetchone()
+            self.rowcount = row[0] if row else -1
+            return
+        # The connection holds a single pending result; a relation keeps this
+        # cursor's rows apart from other cursors in the same transaction
+        relation = self.connection.db.sql(query, params=params)
+        if relation is not None:
+            self.result = relation.execute()
+            # Type names stand in for the psycopg2 type OIDs
+            self.description = [(column[0], str(column[1])) + tuple(column[2:])
+                                for column in self.result.description]
+
+    def _rows(self):
+        if self.result is None:
+            raise psycopg2.ProgrammingError('no results to fetch')
+        return self.result
+
+    def fetchone(self):
+        return self._rows().fetchone()
+
+    def fetchmany(self, size=None):
+        return self._rows().fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._rows().fetchall()
+
+    def __iter__(self):
+        rows = self.fetchmany()
+        while rows:
+            yield from rows
+            rows = self.fetchmany()
+
+    def copy_expert(self, sql, file):
+        # COPY table (columns) FROM STDIN in PostgreSQL text format, loaded
+        # through a CSV file. Values are quoted, NULLs are empty.
+        match = STDIN_PATTERN.match(sql)
+        if match is None:
+            raise ValueError('Unsupported COPY: {}'.format(sql))
+        table, columns = match.groups()
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            rows = 0
+            for line in file.read().split('\n'):
+                if not line:
+                    continue
+                writer.writerow([None if field == '\\N' else
+                                 re.sub(r'\\(.)', lambda m: UNESCAPES.get(m.group(1), m.group(1)),
+                                        field)
+                                 for field in line.split('\t')])
+                rows += 1
+            path = f.name
+        try:
+            # csv writes None as "", read back as NULL; real empty strings
+            # don't occur, COPY sources already turn them into NULLs
+            self.execute("COPY {} ({}) FROM '{}' (FORMAT CSV, HEADER false, DELIMITER ',', "
+                         "QUOTE '\"', ESCAPE '\"', NULL '')".format(table, columns, path))
+        finally:
+            os.remove(path)
+        self.rowcount = rows
+
+    def close(self):
+        pass
+
+
+class DuckDBConnection:
+    # One database per path per process, each connection a cursor on it
+    _databases = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        try:
+            import duckdb
+        except ImportError:
+            raise RuntimeError('the duckdb backend requires duckdb (pip install duckdb)')
+        with self._lock:
+            if path not in self._databases:
+                self._databases[path] = duckdb.connect(path)
+            self.db = self._databases[path].cursor()
+        # Integer / integer truncates on Redshift, DuckDB returns a DOUBLE by default
+        self.db.execute('SET integer_division = true')
+        self.dsn = path
+        self.autocommit = False
+        self.closed = 0
+        self.in_transaction = False
+
+    def begin(self):
+        # psycopg2 opens a transaction on the first statement unless autocommit
+        if not self.autocommit and not self.in_transaction:
+            self.db.execute('BEGIN TRANSACTION')
+            self.in_transaction = True
+
+    def commit(self):
+        if self.in_transaction:
+            self.db.execute('COMMIT')
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self.db.execute('ROLLBACK')
+            self.in_transaction = False
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cancel(self):
+        self.db.interrupt()
+
+    def cursor(self):
+        return DuckDBCursor(self)
+
+    def close(self):
+        self.db.close()
+        self.closed = 1
+
+
+def connect_postgres(dsn):
+    return LocalConnection(_psycopg2_connect(dsn), 'postgres')
+
+
+def connect_duckdb(path):
+    return LocalConnection(DuckDBConnection(path), 'duckdb')
+
+
+def local_target(backend=l.BACKEND, target=None):
+    # (DSN or database file, connect function) for a ConnectionPool
+    if backend == 'postgres':
+        return target or l.LOCAL_DSN, connect_postgres
+    if backend == 'duckdb':
+        return target or l.DUCKDB_PATH, connect_duckdb
+    raise ValueError('Unknown local backend: {}'.format(backend))
@@ -0,0 +1,150 @@
+#!/opt/conda/bin/python
+"""
+benchmark.py: End-to-end ETL benchmark against a local PostgreSQL (or DuckDB) stand-in
+- Optionally generate synthetic data first (see generate_data.py)
+- Run the create_tables, etl and analytics statements from sql_queries.py,
+  with Redshift-only syntax rewritten by backends.py
+- Load staging from the local song_data/log_data tree instead of S3,
+  parsed in parallel by local_ingest.py
+- Time every statement, report rows and rows/sec, median over --runs
+- Save the report as JSON with --report to compare against later runs
+"""
+import argparse
+import datetime
+import json
+import statistics
+import subprocess
+import time
+import loadconfigs as l
+from backends import local_target
+from connection import ConnectionPool
+from generate_data import generate
+from local_ingest import load_staging
+import instrument
+from instrument import statement_name
+from sql_queries import drop_table_queries, create_table_queries, insert_table_queries, \
+    summary_table_queries, analytical_queries
+
+
+def named_statements(queries):
+    # Flatten statement lists, named as in sql_queries.py
+    for query in queries:
+        for statement in ([query] if isinstance(query, str) else query):
+            yield statement_name(statement), statement
+
+
+def timed(conn, stage, name, run):
+    cur = conn.cursor()
+    start = time.time()
+    rows = run(cur)
+    conn.commit()
+    return {'stage': stage, 'name': name, 'seconds': time.time() - start, 'rows': rows}
+
+
+def execute(cur, query, stage, name):
+    instrument.execute(cur, query, stage, name)
+    if cur.description is not None:
+        return len(cur.fetchall())
+    return max(cur.rowcount, 0)
+
+
+def run_pipeline(conn, data_dir, workers=l.LOCAL_INGEST_WORKERS):
+    results = []
+    stages = [('create', drop_table_queries + create_table_queries)]
+    for stage, queries in stages:
+        for name, query in named_statements(queries):
+            results.append(timed(conn, stage, name,
+                                 lambda cur, query=query, stage=stage, name=name:
+                                 execute(cur, query, stage, name)))
+
+    for table in ['staging_events', 'staging_songs']:
+        results.append(timed(conn, 'load', '{}_copy'.format(table),
+                             lambda cur, table=table: load_staging(cur, table, data_dir, workers).rows))
+
+    stages = [('insert', insert_table_queries), ('summary', summary_table_queries),
+              ('analytics', analytical_queries)]
+    for stage, queries in stages:
+        for name, query in named_statements(queries):
+            results.append(timed(conn, stage, name,
+                                 lambda cur, query=query, stage=stage, name=name:
+                                 execute(cur, query, stage, name)))
+    return results
+
+
+def summarize(runs):
+    # Median seconds per statement across runs
+    report = []
+    for idx, first in enumerate(runs[0]):
+        seconds = statistics.median(run[idx]['seconds'] for run in runs)
+        report.append({'stage': first['stage'], 'name': first['name'],
+                       'seconds': round(seconds, 4), 'rows': first['rows'],
+                       'rows_per_sec': round(first['rows'] / seconds, 1) if seconds else None})
+    return report
+
+
+def print_report(report):
+    print('\n{:<10} {:<40} {:>10} {:>12} {:>14}'.format(
+        'STAGE', 'STATEMENT', 'SECONDS', 'ROWS', 'ROWS/SEC'))
+    for row in report:
+        print('{:<10} {:<40} {:>10.4f} {:>12} {:>14}'.format(
+            row['stage'], row['name'], row['seconds'], row['rows'],
+            row['rows_per_sec'] if row['rows_per_sec'] is not None else '-'))
+    for stage in ['create', 'load', 'insert', 'summary', 'analytics']:
+        total = sum(row['seconds'] for row in report if row['stage'] == stage)
+        print('{} total: {:.4f}s'.format(stage, total))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the ETL on local PostgreSQL or DuckDB')
+    parser.add_argument('--backend', choices=['postgres', 'duckdb'], default='postgres')
+    parser.add_argument('--dsn', help='local PostgreSQL DSN or DuckDB file '
+                                      '(default: local_dsn/duckdb_path in dwh.cfg)')
+    parser.add_argument('--data-dir', default=l.LOCAL_DATA,
+                        help='local song_data/log_data tree')
+    parser.add_argument('--generate-songs', type=int,
+                        help='generate synthetic data with this many songs first')
+    parser.add_argument('--generate-events', type=int, default=8000,
+                        help='events to generate with --generate-songs')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=l.LOCAL_INGEST_WORKERS,
+                        help='staging parser processes (default: one per core)')
+    parser.add_argument('--report', help='write the report as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.generate_songs:
+        print('Generating data in {}...'.format(args.data_dir))
+        generate(args.data_dir, args.generate_songs, args.generate_events)
+
+    target, connect = local_target(args.backend, args.dsn)
+    pool = ConnectionPool(target, maxconn=1, connect=connect)
+    runs = []
+    with pool.connection() as conn:
+        for run in range(args.runs):
+            print('Benchmark run {} of {}...'.format(run + 1, args.runs))
+            runs.append(run_pipeline(conn, args.data_dir, args.workers))
+    pool.closeall()
+
+    report = summarize(runs)
+    print_report(report)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'commit': git_commit(), 'backend': args.backend,
+                       'timestamp': datetime.datetime.utcnow().isoformat(),
+                       'data_dir': args.data_dir, 'runs': args.runs,
+                       'results': report}, f, indent=2)
+        print('Report written to {}'.format(args.report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+bulk_loader.py: COPY ... FROM STDIN bulk loader for PostgreSQL targets
+- Rows from any iterator are encoded field by field into one reused buffer,
+  no string is built per row
+- The buffer is sent with copy_expert every batch_size rows (or max_buffer
+  characters), so memory stays flat for any input size
+- Already encoded COPY text (e.g. from local_ingest.py workers) can be
+  written as is with write_encoded()
+- Keeps rows, batches and seconds to report rows/sec
+"""
+import datetime
+import io
+import time
+import loadconfigs as l
+import instrument
+
+NULL = '\\N'
+ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def encode_value(value):
+    # One value in COPY text format
+    if value is None:
+        return NULL
+    if isinstance(value, str):
+        return value.translate(ESCAPES)
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value).translate(ESCAPES)
+
+
+def encode_rows(buffer, rows):
+    # Write rows to a text buffer in COPY text format, returns the row count
+    write = buffer.write
+    count = 0
+    for row in rows:
+        sep = ''
+        for value in row:
+            write(sep)
+            write(encode_value(value))
+            sep = '\t'
+        write('\n')
+        count += 1
+    return count
+
+
+class BulkLoader:
+    def __init__(self, cur, table, columns, batch_size=l.BULK_BATCH_SIZE,
+                 max_buffer=l.BULK_MAX_BUFFER, stage='load', name=None):
+        self.cur = cur
+        self.sql = 'COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns))
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.stage = stage
+        self.name = name or '{}_copy'.format(table)
+        self.buffer = io.StringIO()
+        self.pending = 0
+        self.rows = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.started = time.time()
+
+    def _check(self):
+        if self.pending >= self.batch_size or self.buffer.tell() >= self.max_buffer:
+            self.flush()
+
+    def write(self, row):
+        encode_rows(self.buffer, (row,))
+        self.pending += 1
+        self._check()
+
+    def write_encoded(self, text, rows):
+        self.buffer.write(text)
+        self.pending += rows
+        self._check()
+
+    def load(self, rows):
+        for row in rows:
+            self.write(row)
+        self.flush()
+        return self.rows
+
+    def flush(self):
+        if self.pending:
+            self.buffer.seek(0)
+            instrument.copy_expert(self.cur, self.sql, self.buffer, self.stage, self.name)
+            self.rows += self.pending
+            self.batches += 1
+            self.pending = 0
+            # Reuse the buffer for the next batch
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        self.seconds = time.time() - self.started
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def report(self):
+        return '{} rows in {} batch(es), {:.2f}s ({:.0f} rows/sec)'.format(
+            self.rows, self.batches, self.seconds, self.rows_per_sec)
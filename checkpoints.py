@@ -0,0 +1,74 @@
+"""
+checkpoints.py: Statement checkpoints for a resumable ETL run
+- The run id and every completed statement are recorded in etl_control
+- mark() is called before the statement's own commit, so a statement and its
+  checkpoint commit or roll back together
+- etl.py --resume skips statements the unfinished run already committed,
+  a finished run clears its checkpoints
+"""
+import re
+import threading
+import instrument
+import sql_queries
+from sql_queries import run_id_name, checkpoint_prefix, checkpoint_select, \
+    checkpoint_clear, control_select, control_delete, control_insert
+
+
+def checkpoint_name(query):
+    # The same names scheduler.py graphs use. A statement list is one
+    # transaction, named after its sql_queries.py variable, or else after its
+    # last statement.
+    if not isinstance(query, str):
+        for name, value in vars(sql_queries).items():
+            if value is query and not name.endswith('_queries'):
+                return name
+        query = query[-1]
+    return re.sub(r'\.\d+$', '', instrument.statement_name(query))
+
+
+class Checkpoints:
+    def __init__(self, run_id, done=()):
+        self.run_id = run_id
+        self.completed = set(done)
+        self.lock = threading.Lock()
+
+    @classmethod
+    def start(cls, cur, conn, resume=False):
+        instrument.execute(cur, control_select, 'control', params=(run_id_name,))
+        row = cur.fetchone()
+        if resume and row is not None:
+            run_id = row[0]
+            instrument.execute(cur, checkpoint_select, 'control', params=(run_id,))
+            done = [name[len(checkpoint_prefix):] for (name,) in cur.fetchall()]
+            conn.commit()
+            print('Resuming run {}: {} statement(s) already done'.format(run_id, len(done)))
+            return cls(run_id, done)
+        if resume:
+            print('No unfinished run to resume')
+
+        # New run: forget checkpoints of any earlier run
+        run_id = instrument.RUN_ID
+        instrument.execute(cur, checkpoint_clear, 'control')
+        instrument.execute(cur, control_delete, 'control', params=(run_id_name,))
+        instrument.execute(cur, control_insert, 'control', params=(run_id_name, run_id))
+        conn.commit()
+        print('Run {}'.format(run_id))
+        return cls(run_id)
+
+    def done(self, name):
+        with self.lock:
+            return name in self.completed
+
+    def mark(self, cur, name):
+        # Part of the caller's transaction, committed with the statement
+        instrument.execute(cur, control_delete, 'control',
+                           params=(checkpoint_prefix + name,))
+        instrument.execute(cur, control_insert, 'control',
+                           params=(checkpoint_prefix + name, self.run_id))
+        with self.lock:
+            self.completed.add(name)
+
+    def finish(self, cur, conn):
+        instrument.execute(cur, checkpoint_clear, 'control')
+        instrument.execute(cur, control_delete, 'control', params=(run_id_name,))
+        conn.commit()
@@ -5,17 +5,16 @@ cluster_connect.py: Sample Adhoc query execution script
 - Insert into Fact & Dim Tables
 - Count Rows Inserted
 """
-import psycopg2
 import loadconfigs as l
+from connection import get_pool
 
 
 # Connect to cluster
-conn_string="postgresql://{}:{}@{}:{}/{}".format(l.DWH_DB_USER, 
-             l.DWH_DB_PASSWORD, l.DWH_ENDPOINT, l.DWH_PORT, l.DWH_DB)
-conn = psycopg2.connect(conn_string)
+pool = get_pool(l.ANALYTICS_QUERY_GROUP)
+conn = pool.getconn()
 
 # Set auto commit on
-conn.set_session(autocommit=True)
+conn.autocommit = True
 
 # Open a cursor
 cur = conn.cursor()
@@ -89,4 +88,7 @@ results = cur.fetchall()
 
 # Display results
 for row in results:
-    print(row)
\ No newline at end of file
+    print(row)
+
+# Return connection to pool
+pool.putconn(conn)
@@ -0,0 +1,200 @@
+"""
+connection.py: Shared connection pool and session layer
+- Build the cluster DSN from dwh.cfg
+- Thread-safe pool that keeps connections open between uses
+- Health-check idle connections before handing them out
+- Set session options once per connection (autocommit, statement_timeout, query_group)
+- With backend = postgres|duckdb, connect to the local engine through the
+  dialect translator of backends.py instead of the cluster
+"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import loadconfigs as l
+
+
+def dsn():
+    return "host={} dbname={} user={} password={} port={}".format(
+        l.DWH_ENDPOINT, l.DWH_DB, l.DWH_DB_USER, l.DWH_DB_PASSWORD, l.DWH_PORT)
+
+
+def _psycopg2_connect(dsn):
+    # TCP keepalives stop idle pooled connections being dropped by the network
+    return psycopg2.connect(dsn, keepalives=1, keepalives_idle=60)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn, minconn=1, maxconn=8, autocommit=False,
+                 statement_timeout=0, query_group='', health_check_interval=60,
+                 connect=None):
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.autocommit = autocommit
+        self.statement_timeout = statement_timeout
+        self.query_group = query_group
+        self.health_check_interval = health_check_interval
+        self._connect = connect or _psycopg2_connect
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _open(self):
+        conn = self._connect(self.dsn)
+        conn.autocommit = self.autocommit
+
+        # Session options are set once, when the connection is opened
+        cur = conn.cursor()
+        if self.statement_timeout:
+            cur.execute('SET statement_timeout TO %s', (self.statement_timeout,))
+        if self.query_group:
+            cur.execute('SET query_group TO %s', (self.query_group,))
+        cur.close()
+        if not self.autocommit:
+            conn.commit()
+        return conn
+
+    def _healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if time.time() - last_used < self.health_check_interval:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            cur.fetchall()
+            cur.close()
+            if not conn.autocommit:
+                conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def prefill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append((conn, time.time()))
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise psycopg2.InterfaceError('connection pool is closed')
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout('no connection available after {}s'.format(timeout))
+                    self._cond.wait(remaining)
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                else:
+                    conn, last_used = None, None
+                    self._size += 1
+
+            # Open or health-check outside the lock
+            if conn is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            if self._healthy(conn, last_used):
+                return conn
+            self._discard(conn)
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed:
+            try:
+                # Hand back a clean session with the pool defaults
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit != self.autocommit:
+                    conn.autocommit = self.autocommit
+            except psycopg2.Error:
+                close = True
+        if close or conn.closed or self._closed:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(query_group=None):
+    # Process-wide pool per query_group (default pool_query_group), so each
+    # caller's sessions are routed to its own WLM queue, configured from the
+    # [POOL] section of dwh.cfg
+    if query_group is None:
+        query_group = l.POOL_QUERY_GROUP
+    with _pool_lock:
+        if query_group not in _pools:
+            target, connect = dsn(), None
+            if l.BACKEND != 'redshift':
+                from backends import local_target
+                target, connect = local_target(l.BACKEND)
+            pool = ConnectionPool(target,
+                                  minconn=l.POOL_MIN_SIZE,
+                                  maxconn=l.POOL_MAX_SIZE,
+                                  autocommit=l.POOL_AUTOCOMMIT,
+                                  statement_timeout=l.POOL_STATEMENT_TIMEOUT,
+                                  query_group=query_group,
+                                  health_check_interval=l.POOL_HEALTH_CHECK_INTERVAL,
+                                  connect=connect)
+            atexit.register(pool.closeall)
+            _pools[query_group] = pool
+        return _pools[query_group]
@@ -3,38 +3,55 @@
 create_tables.py: Drop & Create tables in Redshift
 - Drop all tables
 - Create Stagging, Fact & Dim Tables
+- Or, with --migrate, create missing tables and migrate existing ones to
+  sql_queries.py, keeping their data (see migrate.py)
 """
-import psycopg2
-import loadconfigs as l
+import argparse
+import instrument
+from connection import get_pool
+from migrate import migrate
 from sql_queries import create_table_queries, drop_table_queries
 
 
 def drop_tables(cur, conn):
     for query in drop_table_queries:
-        cur.execute(query)
+        instrument.execute(cur, query, 'drop')
         conn.commit()
 
 
 def create_tables(cur, conn):
     for query in create_table_queries:
-        cur.execute(query)
+        instrument.execute(cur, query, 'create')
         conn.commit()
-        
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Drop & create, or migrate, the tables')
+    parser.add_argument('--migrate', action='store_true',
+                        help='migrate existing tables in place instead of dropping them')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='with --migrate, print the migration without running it')
+    parser.add_argument('--allow-recreate', action='store_true',
+                        help='with --migrate, drop tables whose data can\'t be kept')
+    return parser.parse_args()
+
 
 def main():
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-        l.DWH_ENDPOINT, l.DWH_DB, l.DWH_DB_USER, l.DWH_DB_PASSWORD, l.DWH_PORT))
-    cur = conn.cursor()
+    args = parse_args()
+    with get_pool().connection() as conn:
+        cur = conn.cursor()
 
-    print('Droping Tables in Cluster...', end='')
-    drop_tables(cur, conn)
-    print('Dropped!')
+        if args.migrate:
+            migrate(conn, args.dry_run, args.allow_recreate)
+            return
 
-    print('Creating Tables in Cluster...', end='')
-    create_tables(cur, conn)
-    print('Created!')
+        print('Droping Tables in Cluster...', end='')
+        drop_tables(cur, conn)
+        print('Dropped!')
 
-    conn.close()
+        print('Creating Tables in Cluster...', end='')
+        create_tables(cur, conn)
+        print('Created!')
 
 
 if __name__ == "__main__":
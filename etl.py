@@ -1,61 +1,226 @@
 #!/opt/conda/bin/python
 """
 etl.py: Load data into Redshift tables and display counts
-- Load Staging Tables
-- Insert into Fact & Dim Tables
-- Count Rows Inserted
+- Load Staging Tables (sequentially, or in parallel with --parallel), from
+  the source JSON or, with --prestaged, from prestage.py part files
+- With --since/--until, COPY only the log_data days in range through a manifest
+- Insert into Fact & Dim Tables (sequentially, or as a dependency graph with --dag)
+- With --merge, merge into Fact & Dim Tables so the ETL can be re-run
+- Rebuild the play-count Summary Tables read by the analytical queries
+- Or, with --incremental, load only log partitions newer than the ts watermark,
+  which every other load advances to its newest staged event
+- With --resume, skip statements an unfinished run already committed
+- Report how many events match a song before and after match_key normalization
+- VACUUM/ANALYZE the tables over the maintenance thresholds (see maintenance.py)
+- Verify row counts and data quality (see verify.py)
+- Stamp a new ETL version, invalidating cached analytics results
 """
-import psycopg2
+import argparse
+import datetime
+import sys
 import loadconfigs as l
-from sql_queries import copy_table_queries, insert_table_queries, count_queries
+import instrument
+from checkpoints import Checkpoints, checkpoint_name
+from connection import get_pool
+from incremental import load_incremental, advance_watermark
+from maintenance import run_maintenance
+from result_cache import new_etl_version
+from scheduler import run_dag
+from verify import run_verify
+from sources import source_for, select_log_objects, write_manifest
+from sql_queries import insert_table_queries, \
+    copy_table_graph, insert_table_graph, merge_table_queries, merge_table_graph, \
+    etl_version_name, control_delete, control_insert, summary_table_queries, \
+    summary_table_graph, prestaged_copy_queries, prestaged_copy_graphs, \
+    staging_events_copy_manifest, staging_events_copy, staging_events_load, \
+    match_rate_report
 
 
-def load_staging_tables(cur, conn):
+def run_queries(cur, conn, queries, stage, checkpoints=None, names=None):
+    # names: checkpoint names, by default derived from the queries
+    for idx,query in enumerate(queries):
+        name = names[idx] if names else checkpoint_name(query)
+        if checkpoints is not None and checkpoints.done(name):
+            print('QUERY{} ALREADY DONE'.format(idx+1))
+            continue
+        # A list of statements is one transaction, with its checkpoint
+        for statement in ([query] if isinstance(query, str) else query):
+            instrument.execute(cur, statement, stage)
+        if checkpoints is not None:
+            checkpoints.mark(cur, name)
+        conn.commit()
+        print('QUERY{} COMPLETED'.format(idx+1))
+
+
+def load_staging_tables(cur, conn, graph=copy_table_graph, checkpoints=None):
+    # The graph in list order, checkpointed under its node names as with --parallel
     print('\nLoad Staging Tables...')
-    for idx,query in enumerate(copy_table_queries):    
-            cur.execute(query)
-            conn.commit()
-            print('QUERY{} COMPLETED'.format(idx+1))
+    run_queries(cur, conn, [node['query'] for node in graph], 'load', checkpoints,
+                [node['name'] for node in graph])
     print('LOADED')
 
 
-def insert_tables(cur, conn):
+def log_manifest(since=None, until=None, refresh=False):
+    # Manifest of the log_data days in range, from cached listings
+    if l.BACKEND == 'redshift' and not l.MANIFEST_DATA.startswith('s3://'):
+        raise ValueError('--since/--until on Redshift needs manifest_data in [S3] set to '
+                         'an s3:// prefix the cluster can read the manifest from')
+    objects = select_log_objects(source_for(l.LOG_DATA), since, until, refresh=refresh)
+    if not objects:
+        raise ValueError('No log_data objects between {} and {}'.format(
+            since or 'start', until or 'today'))
+    url = '{}/log_data_{}_{}.manifest'.format((l.MANIFEST_DATA or 'manifests').rstrip('/'),
+                                              since or 'start', until or 'end')
+    write_manifest(objects, url)
+    print('Manifest {}: {} log_data objects from {} to {}'.format(
+        url, len(objects), objects[0][0], objects[-1][0]))
+    return url
+
+
+def load_staging_tables_parallel(max_workers=l.ETL_MAX_WORKERS, graph=copy_table_graph,
+                                 checkpoints=None):
+    print('\nLoad Staging Tables (parallel, up to {} connections)...'.format(max_workers))
+    timings = run_dag(graph, get_pool(), max_workers, 'Staging Load', 'load', checkpoints)
+    print('LOADED')
+    return timings
+
+
+def insert_tables(cur, conn, queries=insert_table_queries, checkpoints=None):
     print('\nInsert into Fact & Dim Tables')
-    for idx,query in enumerate(insert_table_queries):
-        cur.execute(query)
-        conn.commit()
-        print('QUERY{} COMPLETED'.format(idx+1))
+    run_queries(cur, conn, queries, 'insert', checkpoints)
     print('INSERTS COMPLETED')
 
 
-def count_check(cur, conn):
-    print('\nCount Rows Inserted')
-    for idx,query in enumerate(count_queries):
-        cur.execute(query)
-        results = cur.fetchall()    
-        for row in results:
-            print(row[0],row[1])
-        conn.commit()
-    print('COUNTS ROWS COMPLETED')
+def insert_tables_dag(max_workers=l.ETL_MAX_WORKERS, graph=insert_table_graph,
+                      checkpoints=None):
+    print('\nInsert into Fact & Dim Tables (dependency graph, up to {} connections)'.format(max_workers))
+    timings = run_dag(graph, get_pool(), max_workers, 'Insert Stage', 'insert', checkpoints)
+    print('INSERTS COMPLETED')
+    return timings
+
+
+def build_summary_tables(cur, conn, checkpoints=None):
+    print('\nBuild Summary Tables')
+    run_queries(cur, conn, summary_table_queries, 'summary', checkpoints)
+    print('SUMMARIES COMPLETED')
+
+
+def match_rate(cur, conn):
+    # NextSong events matching a song by exact title/artist vs match_key
+    instrument.execute(cur, match_rate_report, 'count')
+    events, exact, normalized = cur.fetchone()
+    conn.commit()
+    print('\nMatch Rate')
+    for label, matched in [('Exact title/artist', exact), ('Normalized match_key', normalized)]:
+        print('{}: {} of {} NextSong events ({:.1%})'.format(
+            label, matched, events, matched / events if events else 0))
+    return events, exact, normalized
+
+
+def stamp_etl_version(cur, conn):
+    # Recorded in etl_control, where analytics.py's result cache reads it
+    version = new_etl_version()
+    instrument.execute(cur, control_delete, 'control', params=(etl_version_name,))
+    instrument.execute(cur, control_insert, 'control', params=(etl_version_name, version))
+    conn.commit()
+    print('ETL VERSION {}'.format(version))
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load data into Redshift tables')
+    parser.add_argument('--parallel', action='store_true',
+                        help='run staging COPYs concurrently on separate connections')
+    parser.add_argument('--max-workers', type=int, default=l.ETL_MAX_WORKERS,
+                        help='max concurrent connections for --parallel/--dag')
+    parser.add_argument('--dag', action='store_true',
+                        help='run independent inserts concurrently on pooled connections')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge by key instead of plain inserts, safe to re-run')
+    parser.add_argument('--prestaged', choices=list(prestaged_copy_queries),
+                        help='load staging from prestage.py part files in this format')
+    parser.add_argument('--since', type=parse_date,
+                        help='load only log_data days on or after YYYY-MM-DD')
+    parser.add_argument('--until', type=parse_date,
+                        help='load only log_data days on or before YYYY-MM-DD')
+    parser.add_argument('--refresh-listing', action='store_true',
+                        help='re-list log_data instead of using cached listings')
+    parser.add_argument('--resume', action='store_true',
+                        help='skip statements the last unfinished run already committed')
+    parser.add_argument('--incremental', action='store_true',
+                        help='load only log_data partitions newer than the ts watermark')
+    parser.add_argument('--skip-maintenance', action='store_true',
+                        help="don't VACUUM/ANALYZE after the load")
+    return parser.parse_args()
 
 
 def main():
+    args = parse_args()
     try:
         # Connect to cluster
-        conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(
-            l.DWH_ENDPOINT, l.DWH_DB, l.DWH_DB_USER, l.DWH_DB_PASSWORD, l.DWH_PORT))
-        cur = conn.cursor()
-
-        # Load Staging Tables
-        load_staging_tables(cur, conn)
-        
-        # Insert into Fact & Dim Tables
-        insert_tables(cur, conn)
-        
-        # Count Rows Inserted
-        count_check(cur, conn)
-
-        conn.close()
+        with get_pool().connection() as conn:
+            cur = conn.cursor()
+
+            loaded = True
+            if args.incremental:
+                # Load new partitions & upsert/append into Fact & Dim Tables
+                loaded = load_incremental(cur, conn, args.refresh_listing)
+            else:
+                # Checkpoints of this run, or of the unfinished one with --resume
+                checkpoints = Checkpoints.start(cur, conn, args.resume)
+
+                # Load Staging Tables
+                graph = copy_table_graph
+                if args.prestaged:
+                    graph = prestaged_copy_graphs[args.prestaged]
+                elif args.since or args.until:
+                    copy_manifest = staging_events_copy_manifest.format(
+                        log_manifest(args.since, args.until, args.refresh_listing))
+                    events_load = [copy_manifest if query is staging_events_copy else query
+                                   for query in staging_events_load]
+                    graph = [dict(node, query=events_load)
+                             if node['name'] == 'staging_events_load' else node
+                             for node in copy_table_graph]
+                if args.parallel:
+                    load_staging_tables_parallel(args.max_workers, graph, checkpoints)
+                else:
+                    load_staging_tables(cur, conn, graph, checkpoints)
+                match_rate(cur, conn)
+
+                # Insert (or merge) into Fact & Dim Tables, then Summary Tables
+                if args.dag:
+                    graph = merge_table_graph if args.merge else insert_table_graph
+                    insert_tables_dag(args.max_workers, graph + summary_table_graph,
+                                      checkpoints)
+                else:
+                    insert_tables(cur, conn,
+                                  merge_table_queries if args.merge else insert_table_queries,
+                                  checkpoints)
+                    build_summary_tables(cur, conn, checkpoints)
+
+                # Later --incremental loads start after the events staged here
+                advance_watermark(cur)
+                checkpoints.finish(cur, conn)
+
+            # VACUUM/ANALYZE what the load left unsorted, deleted or stale
+            if not args.skip_maintenance:
+                run_maintenance(conn)
+
+            # Row counts and data quality checks, with verify_fail a failed
+            # check exits with status 1 and leaves the ETL version unstamped
+            try:
+                run_verify(cur, conn)
+            except RuntimeError as e:
+                print(e)
+                sys.exit(1)
+
+            # Stamp ETL version, unless nothing was loaded and cached
+            # results are still current
+            if loaded:
+                stamp_etl_version(cur, conn)
 
     except Exception as e:
         print(e)
@@ -0,0 +1,189 @@
+#!/opt/conda/bin/python
+"""
+generate_data.py: Synthetic song_data & log_data generator
+- song_data/A/B/C/TR*.json, one song per file, as in s3://udacity-dend/song_data
+- log_data/YYYY/MM/YYYY-MM-DD-events.json, one JSON event per line
+- Scale set by --songs and --events, files are written as they are generated
+  so memory stays flat from thousands to tens of millions of events
+- Seeded, so the same arguments always produce the same files
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import string
+import loadconfigs as l
+
+PAGES = ['NextSong'] * 16 + ['Home', 'Logout', 'Settings', 'Help']
+LEVELS = ['free', 'free', 'free', 'paid']
+LOCATIONS = ['Phoenix-Mesa-Scottsdale, AZ', 'San Francisco-Oakland-Hayward, CA',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'Atlanta-Sandy Springs-Roswell, GA', 'Lansing-East Lansing, MI']
+USER_AGENTS = ['"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/35.0.1916.153 Safari/537.36"',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.77.4 '
+               '(KHTML, like Gecko) Version/7.0.5 Safari/537.77.4"',
+               'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:31.0) Gecko/20100101 Firefox/31.0']
+FIRST_NAMES = ['Kaylee', 'Lily', 'Jacob', 'Chloe', 'Tegan', 'Aleena', 'Ryan', 'Mohammad']
+LAST_NAMES = ['Summers', 'Koch', 'Klein', 'Cuevas', 'Levine', 'Kirby', 'Smith', 'Rodriguez']
+WORDS = ['Love', 'Night', 'Heart', 'Blue', 'Dance', 'Fire', 'Dream', 'Home', 'Rain',
+         'Road', 'Light', 'Summer', 'Baby', 'Gold', 'Time', 'River', 'Star', 'Wild']
+
+
+def random_id(rng, prefix, length=16):
+    return prefix + ''.join(rng.choice(string.ascii_uppercase + string.digits)
+                            for _ in range(length))
+
+
+def random_title(rng, words=3):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, words)))
+
+
+def generate_artists(rng, count):
+    artists = []
+    for idx in range(count):
+        located = rng.random() < 0.4
+        artists.append({
+            'artist_id': random_id(rng, 'AR'),
+            'artist_name': '{} {}'.format(random_title(rng, 2), idx),
+            'artist_location': rng.choice(LOCATIONS) if located else '',
+            'artist_latitude': round(rng.uniform(-60, 60), 5) if located else None,
+            'artist_longitude': round(rng.uniform(-150, 150), 5) if located else None,
+        })
+    return artists
+
+
+def write_songs(rng, output_dir, count, artists):
+    # One file per song under song_data/A/B/C/, named after the track id
+    songs = []
+    for idx in range(count):
+        track_id = 'TR' + ''.join(rng.choice(string.ascii_uppercase) for _ in range(3)) \
+            + random_id(rng, '', 13)
+        artist = rng.choice(artists)
+        song = dict(artist)
+        song.update({
+            'num_songs': 1,
+            'song_id': random_id(rng, 'SO'),
+            'title': '{} {}'.format(random_title(rng), idx),
+            'duration': round(rng.uniform(90, 420), 5),
+            'year': rng.choice([0] + list(range(1960, 2019))),
+        })
+        path = os.path.join(output_dir, 'song_data', *track_id[2:5])
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, '{}.json'.format(track_id)), 'w') as f:
+            json.dump(song, f)
+        songs.append((song['title'], song['artist_name'], song['duration']))
+    return songs
+
+
+def generate_users(rng, count):
+    return [{'userId': str(idx + 1),
+             'firstName': rng.choice(FIRST_NAMES),
+             'lastName': rng.choice(LAST_NAMES),
+             'gender': rng.choice('MF'),
+             'level': rng.choice(LEVELS),
+             'location': rng.choice(LOCATIONS),
+             'userAgent': rng.choice(USER_AGENTS),
+             'registration': float(rng.randint(1535000000000, 1541000000000))}
+            for idx in range(count)]
+
+
+def write_events(rng, output_dir, count, days, start_date, users, songs, match_rate):
+    # Events spread evenly over the days, one file per day, ts ascending
+    if count < 1:
+        return 0
+    # Fewer events than days: one a day until they run out
+    per_day = max(1, count // days)
+    written = 0
+    session_id = 0
+    for day in range(days):
+        if written >= count:
+            break
+        date = start_date + datetime.timedelta(days=day)
+        path = os.path.join(output_dir, 'log_data', '{:04d}'.format(date.year),
+                            '{:02d}'.format(date.month))
+        os.makedirs(path, exist_ok=True)
+        n = per_day if day < days - 1 else count - written
+        day_start = int(datetime.datetime(date.year, date.month, date.day,
+                                          tzinfo=datetime.timezone.utc).timestamp() * 1000)
+        step = max(1, 86400000 // max(n, 1))
+        with open(os.path.join(path, '{}-events.json'.format(date.isoformat())), 'w') as f:
+            user, item = None, 0
+            for idx in range(n):
+                # New session every ~20 events
+                if user is None or rng.random() < 0.05:
+                    user, item = rng.choice(users), 0
+                    session_id += 1
+                    # Users occasionally switch between free and paid
+                    if rng.random() < 0.02:
+                        user['level'] = 'paid' if user['level'] == 'free' else 'free'
+                page = rng.choice(PAGES)
+                event = {'artist': None, 'auth': 'Logged In',
+                         'firstName': user['firstName'], 'gender': user['gender'],
+                         'itemInSession': item, 'lastName': user['lastName'],
+                         'length': None, 'level': user['level'],
+                         'location': user['location'], 'method': 'GET', 'page': page,
+                         'registration': user['registration'], 'sessionId': session_id,
+                         'song': None, 'status': 200,
+                         'ts': day_start + idx * step + rng.randint(0, step - 1),
+                         'userAgent': user['userAgent'], 'userId': user['userId']}
+                if page == 'NextSong':
+                    if rng.random() < match_rate:
+                        title, artist, duration = rng.choice(songs)
+                    else:
+                        title, artist, duration = (random_title(rng), random_title(rng, 2),
+                                                   round(rng.uniform(90, 420), 5))
+                    event.update({'artist': artist, 'song': title, 'length': duration,
+                                  'method': 'PUT'})
+                f.write(json.dumps(event))
+                f.write('\n')
+                item += 1
+        written += n
+    return written
+
+
+def generate(output_dir, songs, events, artists=None, users=None, days=30,
+             start_date=datetime.date(2018, 11, 1), match_rate=0.5, seed=42):
+    rng = random.Random(seed)
+    artists = generate_artists(rng, artists or max(1, songs * 2 // 3))
+    song_rows = write_songs(rng, output_dir, songs, artists)
+    users = generate_users(rng, users or max(10, min(100000, events // 80)))
+    written = write_events(rng, output_dir, events, days, start_date, users,
+                           song_rows, match_rate)
+    return len(song_rows), written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate synthetic song_data & log_data')
+    parser.add_argument('--output-dir', default=l.LOCAL_DATA)
+    parser.add_argument('--songs', type=int, default=15000)
+    parser.add_argument('--events', type=int, default=8000)
+    parser.add_argument('--artists', type=int, help='default: 2/3 of --songs')
+    parser.add_argument('--users', type=int, help='default: --events / 80')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--start-date', default='2018-11-01')
+    parser.add_argument('--match-rate', type=float, default=0.5,
+                        help='share of NextSong events that reference a generated song')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if args.events < 0 or args.songs < 0:
+        parser.error('--events and --songs must be 0 or more')
+    if args.days < 1:
+        parser.error('--days must be 1 or more')
+    return args
+
+
+def main():
+    args = parse_args()
+    start_date = datetime.datetime.strptime(args.start_date, '%Y-%m-%d').date()
+    print('Generating data in {}...'.format(args.output_dir))
+    songs, events = generate(args.output_dir, args.songs, args.events, args.artists,
+                             args.users, args.days, start_date, args.match_rate, args.seed)
+    print('Songs: {}'.format(songs))
+    print('Events: {}'.format(events))
+    print('GENERATED')
+
+
+if __name__ == "__main__":
+    main()
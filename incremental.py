@@ -0,0 +1,111 @@
+"""
+incremental.py: Incremental load driven by a ts watermark
+- Read the highest staging_events.ts loaded so far from etl_control
+- List only log_data/YYYY/MM/YYYY-MM-DD-events.json partitions at or after it,
+  through the cached listings of sources.py
+- COPY those partitions into a raw temp table, then into a truncated
+  staging_events with match_key
+- Upsert dm_users, append dm_time & ft_songplays, add the new plays to the
+  Summary Tables and advance the watermark, all in one transaction; with no
+  watermark yet the Summary Tables are rebuilt instead
+- Full, merge and --since/--until loads of etl.py advance the watermark too
+"""
+import datetime
+import instrument
+import loadconfigs as l
+from sources import source_for, select_log_objects
+from sql_queries import staging_events_copy_partition, staging_events_truncate, \
+    staging_events_raw_create, staging_events_raw_drop, staging_events_insert, \
+    incremental_insert_queries, incremental_append_queries, summary_table_queries, \
+    watermark_name, control_select, control_delete, \
+    control_insert, staging_events_max_ts
+
+# Watermark used before the first incremental load
+EPOCH = datetime.datetime(1900, 1, 1)
+
+
+def get_watermark(cur):
+    instrument.execute(cur, control_select, 'control', params=(watermark_name,))
+    row = cur.fetchone()
+    if row is None or row[0] is None:
+        return None
+    return datetime.datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S.%f')
+
+
+def set_watermark(cur, ts):
+    instrument.execute(cur, control_delete, 'control', params=(watermark_name,))
+    instrument.execute(cur, control_insert, 'control',
+                       params=(watermark_name, ts.strftime('%Y-%m-%d %H:%M:%S.%f')))
+
+
+def advance_watermark(cur):
+    # To the newest staged event, never backwards; left to the caller's
+    # transaction so it commits with the load
+    instrument.execute(cur, staging_events_max_ts, 'control')
+    new_watermark = cur.fetchone()[0]
+    watermark = get_watermark(cur)
+    if new_watermark is not None and (watermark is None or new_watermark > watermark):
+        set_watermark(cur, new_watermark)
+        return new_watermark
+    return watermark
+
+
+def list_log_partitions(since=None, s3=None, cache=None, refresh=False):
+    # Partitions on or after the watermark day, the watermark day itself
+    # may hold events later than the watermark
+    objects = select_log_objects(source_for(l.LOG_DATA, s3),
+                                 since.date() if since else None, cache=cache,
+                                 refresh=refresh, watermark=since.date() if since else None)
+    return [url for _, url, _, _ in objects]
+
+
+def load_incremental(cur, conn, refresh=False):
+    # True if rows were loaded, False if there was nothing new
+    print('\nIncremental Load...')
+    watermark = get_watermark(cur)
+    conn.commit()
+    print('Watermark: {}'.format(watermark or 'none, loading all partitions'))
+
+    partitions = list_log_partitions(watermark, refresh=refresh)
+    if not partitions:
+        print('No new partitions')
+        return False
+
+    # Stage only the new partitions, through the raw table of this session
+    instrument.execute(cur, staging_events_raw_drop, 'load')
+    instrument.execute(cur, staging_events_raw_create, 'load')
+    conn.commit()
+    for idx, url in enumerate(partitions):
+        instrument.execute(cur, staging_events_copy_partition.format(url), 'load',
+                           'staging_events_copy_partition')
+        conn.commit()
+        print('PARTITION{} LOADED: {}'.format(idx+1, url))
+    instrument.execute(cur, staging_events_truncate, 'load')
+    instrument.execute(cur, staging_events_insert, 'load')
+    instrument.execute(cur, staging_events_raw_drop, 'load')
+    conn.commit()
+
+    instrument.execute(cur, staging_events_max_ts, 'load')
+    new_watermark = cur.fetchone()[0]
+    if new_watermark is None or (watermark and new_watermark <= watermark):
+        conn.commit()
+        print('No events newer than watermark')
+        return False
+
+    # Upserts, appends and the new watermark commit together. Without a
+    # watermark the Summary Tables may already hold loaded plays, so they
+    # are rebuilt rather than added to
+    mark = (watermark or EPOCH).strftime('%Y-%m-%d %H:%M:%S.%f')
+    insert_queries = incremental_insert_queries if watermark \
+        else incremental_append_queries + summary_table_queries
+    for idx, queries in enumerate(insert_queries):
+        if isinstance(queries, str):
+            queries = [queries]
+        for query in queries:
+            instrument.execute(cur, query.format(watermark=mark), 'incremental',
+                               instrument.statement_name(query))
+        print('QUERY{} COMPLETED'.format(idx+1))
+    set_watermark(cur, new_watermark)
+    conn.commit()
+    print('INCREMENTAL LOAD COMPLETED, watermark now {}'.format(new_watermark))
+    return True
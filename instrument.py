@@ -0,0 +1,129 @@
+"""
+instrument.py: Per-statement instrumentation for every stage
+- execute() wraps cur.execute (copy_expert() cur.copy_expert) and records
+  stage, statement name, wall time, rows affected (cur.rowcount) and the
+  backend query id (pg_last_query_id() on Redshift)
+- One JSON line per statement is appended to the metrics file, tagged with
+  a run id shared by everything this process executes
+- See metrics_report.py to compare runs and flag regressions
+"""
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+import loadconfigs as l
+import sql_queries
+
+RUN_ID = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime()), uuid.uuid4().hex[:8])
+
+_lock = threading.Lock()
+_redshift = {}
+_names = None
+
+
+def _normalize(query):
+    return ' '.join(query.split())
+
+
+def _statement_names():
+    # Whitespace-normalised text of every statement in sql_queries.py -> name
+    names = {}
+    for name, value in vars(sql_queries).items():
+        if name.startswith('_') or name.endswith('_queries'):
+            continue
+        if isinstance(value, str):
+            names.setdefault(_normalize(value), name)
+        elif isinstance(value, list) and all(isinstance(v, str) for v in value):
+            for idx, statement in enumerate(value):
+                names.setdefault(_normalize(statement), '{}.{}'.format(name, idx + 1))
+    return names
+
+
+def statement_name(query):
+    global _names
+    if _names is None:
+        _names = _statement_names()
+    name = _names.get(_normalize(query))
+    if name:
+        return name
+    # Statements built at run time: fall back to verb and table
+    match = re.match(r'\s*(\w+)\s+(?:TEMP(?:ORARY)?\s+)?(?:(?:TABLE|INTO|FROM)\s+)?'
+                     r'(?:IF\s+(?:NOT\s+)?EXISTS\s+)?(\w+)', query, re.IGNORECASE)
+    if match:
+        return '{}_{}'.format(match.group(1).lower(), match.group(2).lower())
+    return 'statement'
+
+
+def is_redshift(conn):
+    # Cached per DSN: every connection to a DSN talks to the same backend
+    dsn = conn.dsn
+    if dsn not in _redshift:
+        cur = conn.cursor()
+        cur.execute('SELECT version()')
+        _redshift[dsn] = 'redshift' in cur.fetchone()[0].lower()
+        cur.close()
+    return _redshift[dsn]
+
+
+def last_query_id(conn):
+    if not l.METRICS_QUERY_ID or not is_redshift(conn):
+        return None
+    cur = conn.cursor()
+    cur.execute('SELECT pg_last_query_id()')
+    query_id = cur.fetchone()[0]
+    cur.close()
+    return query_id
+
+
+def record(entry, path=None):
+    path = path or l.METRICS_FILE
+    line = json.dumps(entry, default=str)
+    with _lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a') as f:
+            f.write(line + '\n')
+
+
+def _measure(cur, run, query, stage, name):
+    name = name or statement_name(query)
+    error = None
+    start = time.time()
+    try:
+        run()
+    except Exception as e:
+        error = str(e).strip()
+        raise
+    finally:
+        elapsed = time.time() - start
+        if l.METRICS_ENABLED:
+            query_id = None
+            if error is None:
+                try:
+                    query_id = last_query_id(cur.connection)
+                except Exception:
+                    query_id = None
+            record({'run_id': RUN_ID,
+                    'ts': datetime.datetime.utcnow().isoformat(),
+                    'script': os.path.basename(sys.argv[0]),
+                    'stage': stage,
+                    'name': name,
+                    'seconds': round(elapsed, 6),
+                    'rows': cur.rowcount if error is None else None,
+                    'query_id': query_id,
+                    'error': error})
+    return cur
+
+
+def execute(cur, query, stage, name=None, params=None):
+    return _measure(cur, lambda: cur.execute(query, params), query, stage, name)
+
+
+def copy_expert(cur, sql, file, stage, name=None):
+    # COPY ... FROM STDIN, file is anything with read(size)
+    return _measure(cur, lambda: cur.copy_expert(sql, file), sql, stage, name)
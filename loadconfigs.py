@@ -27,6 +27,63 @@ DWH_ENDPOINT            = config.get("DWH", "DWH_ENDPOINT")
 LOG_DATA                = config.get("S3", "LOG_DATA")
 LOG_JSONPATH            = config.get("S3", "LOG_JSONPATH")
 SONG_DATA               = config.get("S3", "SONG_DATA")
+PRESTAGE_DATA           = config.get("S3", "PRESTAGE_DATA", fallback='')
+MANIFEST_DATA           = config.get("S3", "MANIFEST_DATA", fallback='')
+
+BACKEND                 = config.get("BACKEND", "BACKEND", fallback='redshift')
+DUCKDB_PATH             = config.get("BACKEND", "DUCKDB_PATH", fallback='dwh.duckdb')
+
+ETL_MAX_WORKERS         = config.getint("ETL", "ETL_MAX_WORKERS", fallback=4)
+ETL_SURROGATE_KEYS      = config.getboolean("ETL", "ETL_SURROGATE_KEYS", fallback=False)
+
+POOL_MIN_SIZE           = config.getint("POOL", "POOL_MIN_SIZE", fallback=1)
+POOL_MAX_SIZE           = config.getint("POOL", "POOL_MAX_SIZE", fallback=8)
+POOL_AUTOCOMMIT         = config.getboolean("POOL", "POOL_AUTOCOMMIT", fallback=False)
+POOL_STATEMENT_TIMEOUT  = config.getint("POOL", "POOL_STATEMENT_TIMEOUT", fallback=0)
+POOL_QUERY_GROUP        = config.get("POOL", "POOL_QUERY_GROUP", fallback='')
+POOL_HEALTH_CHECK_INTERVAL = config.getint("POOL", "POOL_HEALTH_CHECK_INTERVAL", fallback=60)
+
+ANALYTICS_BATCH_SIZE    = config.getint("ANALYTICS", "ANALYTICS_BATCH_SIZE", fallback=10000)
+ANALYTICS_OUTPUT_DIR    = config.get("ANALYTICS", "ANALYTICS_OUTPUT_DIR", fallback='output')
+ANALYTICS_QUERY_TIMEOUT = config.getint("ANALYTICS", "ANALYTICS_QUERY_TIMEOUT", fallback=0)
+ANALYTICS_MAX_WORKERS   = config.getint("ANALYTICS", "ANALYTICS_MAX_WORKERS", fallback=4)
+ANALYTICS_QUERY_GROUP   = config.get("ANALYTICS", "ANALYTICS_QUERY_GROUP", fallback='analytics')
+
+CACHE_DIR               = config.get("CACHE", "CACHE_DIR", fallback='.cache/results')
+CACHE_MAX_BYTES         = config.getint("CACHE", "CACHE_MAX_BYTES", fallback=104857600)
+CACHE_MAX_ROWS          = config.getint("CACHE", "CACHE_MAX_ROWS", fallback=100000)
+CACHE_TTL               = config.getint("CACHE", "CACHE_TTL", fallback=0)
+
+METRICS_ENABLED         = config.getboolean("METRICS", "METRICS_ENABLED", fallback=True)
+METRICS_FILE            = config.get("METRICS", "METRICS_FILE", fallback='metrics/metrics.jsonl')
+METRICS_QUERY_ID        = config.getboolean("METRICS", "METRICS_QUERY_ID", fallback=True)
+PLANS_DIR               = config.get("METRICS", "PLANS_DIR", fallback='metrics/plans')
+
+LISTING_CACHE_FILE      = config.get("SOURCES", "LISTING_CACHE_FILE", fallback='.cache/listings.json')
+LISTING_CACHE_TTL       = config.getint("SOURCES", "LISTING_CACHE_TTL", fallback=300)
+LISTING_FINAL_GRACE     = config.getint("SOURCES", "LISTING_FINAL_GRACE", fallback=172800)
+
+BULK_BATCH_SIZE         = config.getint("BULK", "BULK_BATCH_SIZE", fallback=50000)
+BULK_MAX_BUFFER         = config.getint("BULK", "BULK_MAX_BUFFER", fallback=67108864)
+
+ADVISOR_ALL_MAX_ROWS    = config.getint("ADVISOR", "ADVISOR_ALL_MAX_ROWS", fallback=1000000)
+ADVISOR_MAX_SKEW        = config.getfloat("ADVISOR", "ADVISOR_MAX_SKEW", fallback=4.0)
+
+MAINTENANCE_DELETED_PCT = config.getfloat("MAINTENANCE", "MAINTENANCE_DELETED_PCT", fallback=10)
+MAINTENANCE_UNSORTED_PCT = config.getfloat("MAINTENANCE", "MAINTENANCE_UNSORTED_PCT", fallback=10)
+MAINTENANCE_STATS_OFF_PCT = config.getfloat("MAINTENANCE", "MAINTENANCE_STATS_OFF_PCT", fallback=10)
+MAINTENANCE_TIME_BUDGET = config.getint("MAINTENANCE", "MAINTENANCE_TIME_BUDGET", fallback=600)
+
+VERIFY_CATALOG_COUNTS   = config.getboolean("VERIFY", "VERIFY_CATALOG_COUNTS", fallback=False)
+VERIFY_MAX_BAD_ROWS     = config.getint("VERIFY", "VERIFY_MAX_BAD_ROWS", fallback=0)
+VERIFY_MIN_MATCH_RATE   = config.getfloat("VERIFY", "VERIFY_MIN_MATCH_RATE", fallback=0)
+VERIFY_FAIL             = config.getboolean("VERIFY", "VERIFY_FAIL", fallback=False)
+
+LOCAL_DSN               = config.get("LOCAL", "LOCAL_DSN",
+                                     fallback='host=localhost dbname=dwh user=postgres port=5432')
+LOCAL_DATA              = config.get("LOCAL", "LOCAL_DATA", fallback='data')
+LOCAL_INGEST_WORKERS    = config.getint("LOCAL", "LOCAL_INGEST_WORKERS", fallback=0)
+LOCAL_INGEST_FILES_PER_TASK = config.getint("LOCAL", "LOCAL_INGEST_FILES_PER_TASK", fallback=64)
 
 def setConfigs(section, param, value):
     config.set(section, param, value)    
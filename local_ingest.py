@@ -0,0 +1,274 @@
+#!/opt/conda/bin/python
+"""
+local_ingest.py: Load a local song_data/log_data tree into staging tables
+- Stand-in for COPY ... FROM 's3://...' on a local PostgreSQL
+- Files are parsed and encoded across a process pool, rows are streamed to
+  the table in COPY ... FROM STDIN batches by bulk_loader.py
+- Same mapping as the Redshift COPY in sql_queries.py: LOG_JSONPATH for
+  staging_events, JSON 'auto' for staging_songs, TIMEFORMAT 'epochmillisecs',
+  TRUNCATECOLUMNS, BLANKSASNULL and EMPTYASNULL
+- match_key is computed here, as the INSERT from the raw COPY table does;
+  the raw tables (staging_events_raw, staging_songs_raw) load without it
+"""
+import argparse
+import collections
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import loadconfigs as l
+import instrument
+from bulk_loader import BulkLoader, encode_rows
+from connection import ConnectionPool
+from schema import parse_table
+from sql_queries import staging_events_table_create, staging_songs_table_create
+
+# Contents of s3://udacity-dend/log_json_path.json, used when LOG_JSONPATH
+# isn't a local file
+LOG_JSONPATHS = ["$['artist']", "$['auth']", "$['firstName']", "$['gender']",
+                 "$['itemInSession']", "$['lastName']", "$['length']", "$['level']",
+                 "$['location']", "$['method']", "$['page']", "$['registration']",
+                 "$['sessionId']", "$['song']", "$['status']", "$['ts']",
+                 "$['userAgent']", "$['userId']"]
+
+# Table -> (DDL, directory under the data tree, True for LOG_JSONPATH mapping)
+STAGING_TABLES = {
+    'staging_events': (staging_events_table_create, 'log_data', True),
+    'staging_songs': (staging_songs_table_create, 'song_data', False),
+}
+
+# Raw COPY target -> the staging table it holds the columns of, but match_key
+RAW_TABLES = {'staging_events_raw': 'staging_events', 'staging_songs_raw': 'staging_songs'}
+
+# Columns staging_events/staging_songs.match_key is computed from
+MATCH_KEY_SOURCES = {'staging_events': ('song', 'artist'),
+                     'staging_songs': ('title', 'artist_name')}
+
+# Redshift widths when none is given, in bytes
+DEFAULT_WIDTHS = {'VARCHAR': 256, 'CHAR': 1}
+INTEGER_TYPES = {'SMALLINT', 'INTEGER', 'INT', 'BIGINT'}
+SPACE_PATTERN = re.compile(r'[ \t\n\v\f\r]+')
+
+
+def table_columns(create_sql):
+    # (name, type, width, scale) for each column of a CREATE TABLE statement
+    return [(column['name'], column['type'],
+             column['width'] or DEFAULT_WIDTHS.get(column['type']), column['scale'])
+            for column in parse_table(create_sql)['columns']]
+
+
+def jsonpath_keys(path=l.LOG_JSONPATH):
+    if os.path.isfile(path):
+        with open(path) as f:
+            jsonpaths = json.load(f)['jsonpaths']
+    else:
+        jsonpaths = LOG_JSONPATHS
+    keys = []
+    for jsonpath in jsonpaths:
+        match = re.match(r"\$(?:\['(.+)'\]|\.(\w+))$", jsonpath)
+        if not match:
+            raise ValueError('Unsupported JSONPath expression: {}'.format(jsonpath))
+        keys.append(match.group(1) or match.group(2))
+    return keys
+
+
+def table_spec(table):
+    # Picklable description of how JSON objects map onto the table's columns,
+    # match_key isn't in the JSON and is computed from its source columns
+    create_sql, _, use_jsonpaths = STAGING_TABLES[RAW_TABLES.get(table, table)]
+    columns = [column for column in table_columns(create_sql)
+               if table not in RAW_TABLES or column[0] != 'match_key']
+    names = [name for name, _, _, _ in columns]
+    loaded = [name for name in names if name != 'match_key']
+    if use_jsonpaths:
+        keys = jsonpath_keys()
+        if len(keys) != len(loaded):
+            raise ValueError('{} JSONPath expressions for {} columns of {}'.format(
+                len(keys), len(loaded), table))
+        keys = dict(zip(loaded, keys))
+    else:
+        # JSON 'auto' matches keys to the (lower case) column names
+        keys = {name: name.lower() for name in loaded}
+    match = None
+    if 'match_key' in names:
+        title, artist = MATCH_KEY_SOURCES[table]
+        match = (names.index('match_key'), names.index(title), names.index(artist))
+    return {'table': table, 'columns': columns, 'keys': [keys.get(name) for name in names],
+            'match_key': match}
+
+
+def normalize(value):
+    # LOWER(TRIM(REGEXP_REPLACE(value, '[[:space:]]+', ' '))) in sql_queries.py,
+    # [[:space:]] being ASCII whitespace only, unlike str.split()
+    return SPACE_PATTERN.sub(' ', value).strip(' ').lower()
+
+
+def match_key(title, artist):
+    if title is None or artist is None:
+        return None
+    return hashlib.md5('{}|{}'.format(normalize(title), normalize(artist))
+                       .encode('utf-8')).hexdigest()
+
+
+def truncate(value, width):
+    # TRUNCATECOLUMNS: cut to the column width in bytes, on a character boundary
+    data = value.encode('utf-8')
+    if len(data) <= width:
+        return value
+    return data[:width].decode('utf-8', errors='ignore')
+
+
+def convert_value(value, type_, width):
+    # JSON value -> column text, None for NULL
+    if value is None:
+        return None
+    if isinstance(value, str):
+        # BLANKSASNULL / EMPTYASNULL
+        if not value.strip():
+            return None
+        if type_ not in ('VARCHAR', 'CHAR'):
+            value = value.strip()
+    if type_ == 'TIMESTAMP':
+        if isinstance(value, str) and not re.match(r'^-?\d+(\.\d+)?$', value):
+            return value
+        # TIMEFORMAT 'epochmillisecs'
+        value = datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=float(value))
+        return value.isoformat(' ')
+    if type_ in INTEGER_TYPES:
+        if isinstance(value, float) and not value.is_integer():
+            raise ValueError('invalid integer: {!r}'.format(value))
+        return str(int(float(value)) if isinstance(value, float) else int(value))
+    if type_ in ('VARCHAR', 'CHAR'):
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, bool):
+            value = 'true' if value else 'false'
+        return truncate(str(value), width)
+    return str(value)
+
+
+def iter_objects(path):
+    # JSON objects one after the other, on one line or spread over several
+    with open(path) as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    idx, end = 0, len(text)
+    while True:
+        while idx < end and text[idx].isspace():
+            idx += 1
+        if idx >= end:
+            return
+        obj, idx = decoder.raw_decode(text, idx)
+        yield obj
+
+
+def iter_rows(spec, paths):
+    columns, keys, match = spec['columns'], spec['keys'], spec['match_key']
+    for path in paths:
+        for number, obj in enumerate(iter_objects(path), 1):
+            try:
+                row = [None if key is None else convert_value(obj.get(key), type_, width)
+                       for key, (_, type_, width, _) in zip(keys, columns)]
+            except (TypeError, ValueError) as e:
+                raise ValueError('{} object {}: {}'.format(path, number, e))
+            if match is not None:
+                row[match[0]] = match_key(row[match[1]], row[match[2]])
+            yield row
+
+
+def parse_files(spec, paths):
+    # Worker: COPY text for a batch of files and its row count
+    buffer = io.StringIO()
+    rows = encode_rows(buffer, iter_rows(spec, paths))
+    return buffer.getvalue(), rows
+
+
+def iter_files(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.json'):
+                yield os.path.join(dirpath, filename)
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_tree(spec, paths, workers, files_per_task):
+    # (text, rows) per batch of files, in file order. At most two batches per
+    # worker are in flight so memory stays flat however large the tree is.
+    tasks = batches(paths, files_per_task)
+    if workers == 1:
+        for paths in tasks:
+            yield parse_files(spec, paths)
+        return
+    with ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for paths in tasks:
+            pending.append(executor.submit(parse_files, spec, paths))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_paths(cur, table, paths, workers=l.LOCAL_INGEST_WORKERS,
+               files_per_task=l.LOCAL_INGEST_FILES_PER_TASK, stage='load'):
+    # Batches are flushed at the first file batch boundary past BULK_BATCH_SIZE
+    spec = table_spec(table)
+    loader = BulkLoader(cur, table, [name for name, _, _, _ in spec['columns']], stage=stage)
+    for text, rows in parse_tree(spec, paths, workers or os.cpu_count() or 1, files_per_task):
+        loader.write_encoded(text, rows)
+    loader.flush()
+    return loader
+
+
+def load_staging(cur, table, data_dir, workers=l.LOCAL_INGEST_WORKERS,
+                 files_per_task=l.LOCAL_INGEST_FILES_PER_TASK, stage='load'):
+    root = os.path.join(data_dir, STAGING_TABLES[table][1])
+    return load_paths(cur, table, iter_files(root), workers, files_per_task, stage)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load local song_data/log_data into staging')
+    parser.add_argument('--dsn', default=l.LOCAL_DSN, help='local PostgreSQL DSN')
+    parser.add_argument('--data-dir', default=l.LOCAL_DATA,
+                        help='local song_data/log_data tree')
+    parser.add_argument('--table', choices=list(STAGING_TABLES), action='append',
+                        help='table to load (default: all staging tables)')
+    parser.add_argument('--workers', type=int, default=l.LOCAL_INGEST_WORKERS,
+                        help='parser processes (default: one per core)')
+    parser.add_argument('--files-per-task', type=int, default=l.LOCAL_INGEST_FILES_PER_TASK)
+    parser.add_argument('--truncate', action='store_true',
+                        help='empty the tables before loading')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    pool = ConnectionPool(args.dsn, maxconn=1)
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        for table in args.table or list(STAGING_TABLES):
+            if args.truncate:
+                instrument.execute(cur, 'TRUNCATE {}'.format(table), 'load')
+            loader = load_staging(cur, table, args.data_dir, args.workers, args.files_per_task)
+            conn.commit()
+            print('{}: {}'.format(table, loader.report()))
+    pool.closeall()
+    print('LOADED')
+
+
+if __name__ == "__main__":
+    main()
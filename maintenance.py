@@ -0,0 +1,116 @@
+#!/opt/conda/bin/python
+"""
+maintenance.py: VACUUM and ANALYZE the tables that need it, after a load
+- Reads each table's deleted %, unsorted % and stats_off % from
+  svv_table_info (pg_stat_user_tables on a local PostgreSQL)
+- Runs VACUUM DELETE ONLY, VACUUM SORT ONLY (VACUUM FULL when both are due)
+  and ANALYZE only on tables over the [MAINTENANCE] thresholds in dwh.cfg
+- Worst tables first, no new statement starts once maintenance_time_budget
+  seconds have passed
+- Prints what ran, why and how long it took; etl.py runs it after the inserts
+"""
+import argparse
+import time
+import loadconfigs as l
+import instrument
+from connection import get_pool
+from schema import parse_table
+from sql_queries import create_table_queries, maintenance_table_stats, \
+    pg_maintenance_table_stats, vacuum_delete_only, vacuum_sort_only, vacuum_full, \
+    pg_vacuum, analyze_table
+
+# PostgreSQL has one VACUUM for dead rows and keeps no sort order
+PG_VACUUMS = {vacuum_delete_only: pg_vacuum, vacuum_sort_only: None, vacuum_full: pg_vacuum}
+
+
+def table_stats(cur, redshift):
+    # name -> (rows, deleted %, unsorted %, stats_off %) of the ETL's tables
+    tables = {parse_table(query)['name'] for query in create_table_queries}
+    query = maintenance_table_stats if redshift else pg_maintenance_table_stats
+    instrument.execute(cur, query, 'maintenance')
+    return {name: tuple(float(value) for value in values)
+            for name, *values in cur.fetchall() if name in tables}
+
+
+def plan(stats, deleted_pct=l.MAINTENANCE_DELETED_PCT, unsorted_pct=l.MAINTENANCE_UNSORTED_PCT,
+         stats_off_pct=l.MAINTENANCE_STATS_OFF_PCT, redshift=True):
+    # (table, statement, reason) to run, the table furthest over a threshold first
+    tasks = []
+    for name, (rows, deleted, unsorted, stats_off) in stats.items():
+        if not rows:
+            continue
+        vacuum, reasons = None, []
+        if deleted > deleted_pct:
+            vacuum = vacuum_delete_only
+            reasons.append('{:.1f}% deleted'.format(deleted))
+        if unsorted > unsorted_pct:
+            vacuum = vacuum_full if vacuum else vacuum_sort_only
+            reasons.append('{:.1f}% unsorted'.format(unsorted))
+        if vacuum and not redshift:
+            vacuum = PG_VACUUMS[vacuum]
+        steps = []
+        if vacuum:
+            steps.append((vacuum, ', '.join(reasons)))
+        if stats_off > stats_off_pct:
+            steps.append((analyze_table, '{:.1f}% stats off'.format(stats_off)))
+        excess = max(deleted - deleted_pct, unsorted - unsorted_pct, stats_off - stats_off_pct)
+        tasks.extend((excess, name, statement, reason) for statement, reason in steps)
+    tasks.sort(key=lambda task: -task[0])
+    return [(name, statement, reason) for _, name, statement, reason in tasks]
+
+
+def run_maintenance(conn, budget=l.MAINTENANCE_TIME_BUDGET, dry_run=False):
+    print('\nMaintenance (time budget {}s)...'.format(budget))
+    if l.BACKEND == 'duckdb':
+        print('Nothing to do on DuckDB')
+        return []
+    # VACUUM can't run inside a transaction block
+    autocommit = conn.autocommit
+    if not autocommit:
+        conn.commit()
+        conn.autocommit = True
+    try:
+        cur = conn.cursor()
+        redshift = instrument.is_redshift(conn)
+        tasks = plan(table_stats(cur, redshift), redshift=redshift)
+        start = time.time()
+        log = []
+        for name, statement, reason in tasks:
+            query = statement.format(name)
+            if dry_run:
+                print('WOULD RUN {} ({})'.format(query, reason))
+                continue
+            if time.time() - start >= budget:
+                print('SKIPPED {} ({}): time budget spent'.format(query, reason))
+                log.append((query, reason, None))
+                continue
+            began = time.time()
+            instrument.execute(cur, query, 'maintenance')
+            seconds = time.time() - began
+            print('{} ({}): {:.2f}s'.format(query, reason, seconds))
+            log.append((query, reason, seconds))
+        if not tasks:
+            print('All tables within thresholds')
+    finally:
+        conn.autocommit = autocommit
+    print('MAINTENANCE COMPLETED in {:.2f}s'.format(sum(seconds for _, _, seconds in log if seconds)))
+    return log
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='VACUUM/ANALYZE tables over thresholds')
+    parser.add_argument('--budget', type=int, default=l.MAINTENANCE_TIME_BUDGET,
+                        help='seconds after which no new statement starts')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print what would run without running it')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with get_pool().connection() as conn:
+        run_maintenance(conn, args.budget, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/opt/conda/bin/python
+"""
+metrics_report.py: Compare runs recorded in the metrics file
+- List runs with --list
+- Compare a run (default: latest) per statement against the median of the
+  runs before it (--window) for the same script
+- Flag statements slower by more than --threshold (and --min-seconds)
+- Exit non-zero on regressions with --fail
+"""
+import argparse
+import json
+import statistics
+import sys
+import loadconfigs as l
+
+
+def read_metrics(path):
+    # Runs in the order they first appear, each as a list of entries
+    runs = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                runs.setdefault(entry['run_id'], []).append(entry)
+    return runs
+
+
+def run_script(entries):
+    return entries[0].get('script')
+
+
+def statement_seconds(entries):
+    # Total seconds per (stage, name), statements may run more than once
+    seconds = {}
+    for entry in entries:
+        if entry.get('error') is None:
+            key = (entry['stage'], entry['name'])
+            seconds[key] = seconds.get(key, 0) + entry['seconds']
+    return seconds
+
+
+def compare(runs, run_id, window, threshold, min_seconds):
+    run_ids = list(runs)
+    current = runs[run_id]
+    previous = [r for r in run_ids[:run_ids.index(run_id)]
+                if run_script(runs[r]) == run_script(current)][-window:]
+    baseline = {}
+    for r in previous:
+        for key, seconds in statement_seconds(runs[r]).items():
+            baseline.setdefault(key, []).append(seconds)
+
+    report = []
+    for key, seconds in statement_seconds(current).items():
+        history = baseline.get(key)
+        base = statistics.median(history) if history else None
+        change = (seconds - base) / base if base else None
+        regression = (base is not None and seconds - base > min_seconds
+                      and change is not None and change > threshold)
+        report.append({'stage': key[0], 'name': key[1], 'seconds': seconds,
+                       'baseline': base, 'change': change, 'regression': regression})
+    return previous, report
+
+
+def print_runs(runs):
+    print('{:<26} {:<20} {:>10} {:>10} {:>8}'.format(
+        'RUN', 'SCRIPT', 'STATEMENTS', 'SECONDS', 'ERRORS'))
+    for run_id, entries in runs.items():
+        print('{:<26} {:<20} {:>10} {:>10.2f} {:>8}'.format(
+            run_id, run_script(entries) or '-', len(entries),
+            sum(e['seconds'] for e in entries),
+            sum(1 for e in entries if e.get('error'))))
+
+
+def print_report(run_id, previous, report):
+    print('Run {} against median of {} previous run(s)'.format(run_id, len(previous)))
+    print('{:<10} {:<40} {:>10} {:>10} {:>8}'.format(
+        'STAGE', 'STATEMENT', 'SECONDS', 'BASELINE', 'CHANGE'))
+    for row in report:
+        print('{:<10} {:<40} {:>10.3f} {:>10} {:>8}{}'.format(
+            row['stage'], row['name'], row['seconds'],
+            '{:.3f}'.format(row['baseline']) if row['baseline'] is not None else '-',
+            '{:+.0%}'.format(row['change']) if row['change'] is not None else '-',
+            '  REGRESSION' if row['regression'] else ''))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare runs in the metrics file')
+    parser.add_argument('--file', default=l.METRICS_FILE)
+    parser.add_argument('--list', action='store_true', help='list recorded runs')
+    parser.add_argument('--run', help='run id to check (default: latest)')
+    parser.add_argument('--window', type=int, default=5,
+                        help='previous runs in the baseline median')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='relative slowdown flagged as a regression')
+    parser.add_argument('--min-seconds', type=float, default=0.5,
+                        help='ignore slowdowns smaller than this')
+    parser.add_argument('--fail', action='store_true',
+                        help='exit with status 1 when regressions are found')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    runs = read_metrics(args.file)
+    if not runs:
+        print('No runs in {}'.format(args.file))
+        return
+    if args.list:
+        print_runs(runs)
+        return
+
+    run_id = args.run or list(runs)[-1]
+    previous, report = compare(runs, run_id, args.window, args.threshold, args.min_seconds)
+    print_report(run_id, previous, report)
+    regressions = [row for row in report if row['regression']]
+    print('{} regression(s)'.format(len(regressions)))
+    if regressions and args.fail:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/opt/conda/bin/python
+"""
+migrate.py: Bring the live tables in line with sql_queries.py without a reload
+- Compares each table of create_table_queries (parsed by schema.py) with
+  the catalog: pg_table_def/pg_class on Redshift, information_schema locally
+  (columns, types and NOT NULL only, the rest is Redshift-only)
+- Per table, the cheapest change that keeps the data:
+  - create: the table doesn't exist yet
+  - alter: ADD/DROP COLUMN, VARCHAR resize, ENCODE (Redshift), any type
+    or NOT NULL change (PostgreSQL/DuckDB)
+  - deep copy: DISTSTYLE/DISTKEY/SORTKEY, other type or NOT NULL changes,
+    new IDENTITY columns; the new layout is filled from the old table and
+    swapped in, in one transaction, IDENTITY values kept
+  - recreate: a new NOT NULL column the old rows can't fill; drops the
+    data, so only with --allow-recreate
+- --dry-run prints the plan without running it; also run by
+  create_tables.py --migrate
+"""
+import argparse
+import re
+import loadconfigs as l
+import instrument
+from connection import get_pool
+from schema import parse_table, column_type, render_table
+from sql_queries import create_table_queries, table_columns, table_diststyles, \
+    local_table_columns, add_column, drop_column, alter_column_type, alter_varchar_size, \
+    alter_column_encode, alter_column_not_null, deep_copy_insert, drop_table, rename_table
+
+# Catalog and sql_queries.py type names by family
+TYPE_FAMILIES = {'varchar': 'varchar', 'character varying': 'varchar', 'text': 'varchar',
+                 'char': 'char', 'character': 'char', 'bpchar': 'char',
+                 'smallint': 'smallint', 'int2': 'smallint',
+                 'integer': 'integer', 'int': 'integer', 'int4': 'integer',
+                 'bigint': 'bigint', 'int8': 'bigint',
+                 'decimal': 'numeric', 'numeric': 'numeric',
+                 'real': 'float4', 'float4': 'float4',
+                 'double precision': 'float8', 'double': 'float8', 'float': 'float8',
+                 'float8': 'float8',
+                 'boolean': 'boolean', 'bool': 'boolean', 'date': 'date',
+                 'timestamp': 'timestamp', 'timestamp without time zone': 'timestamp'}
+# Redshift's widths when none is given
+REDSHIFT_WIDTHS = {'varchar': (256, 0), 'char': (1, 0), 'numeric': (18, 0)}
+# DuckDB stores CHAR as VARCHAR
+DUCKDB_FAMILIES = {'char': 'varchar'}
+REDSHIFT_DISTSTYLES = {0: 'EVEN', 1: 'KEY', 8: 'ALL', 10: 'AUTO', 11: 'AUTO', 12: 'AUTO'}
+TYPE_PATTERN = re.compile(r'^([a-z ]+?)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?$')
+COPY_SUFFIX = '_migrate'
+
+
+def family(type_name, dialect):
+    name = TYPE_FAMILIES.get(type_name.lower(), type_name.lower())
+    return DUCKDB_FAMILIES.get(name, name) if dialect == 'duckdb' else name
+
+
+def desired_type(column, dialect):
+    # (family, width, scale), width None when the catalog can't tell
+    name = family(column['type'], dialect)
+    width, scale = column['width'], column['scale']
+    if width is None and dialect == 'redshift':
+        width, scale = REDSHIFT_WIDTHS.get(name, (None, 0))
+    if dialect == 'duckdb' and name == 'varchar':
+        width = None
+    return name, width, scale
+
+
+def type_name(type_):
+    name, width, scale = type_
+    if width is None:
+        return name
+    return '{}({},{})'.format(name, width, scale) if scale else '{}({})'.format(name, width)
+
+
+def live_tables(cur, dialect):
+    # name -> {'columns': {name: column}, 'diststyle', 'distkey', 'sortkey', 'interleaved'}
+    tables = {}
+    if dialect == 'redshift':
+        instrument.execute(cur, table_columns, 'migrate')
+        for table, name, type_, encoding, distkey, sortkey, not_null in cur.fetchall():
+            match = TYPE_PATTERN.match(type_.lower())
+            live = tables.setdefault(table, {'columns': {}, 'diststyle': None, 'distkey': None,
+                                             'sortkey': [], 'interleaved': False})
+            live['columns'][name] = {'type': (family(match.group(1), dialect),
+                                              int(match.group(2)) if match.group(2) else None,
+                                              int(match.group(3) or 0)),
+                                     'not_null': bool(not_null),
+                                     'encode': (encoding or 'none').lower()}
+            if distkey:
+                live['distkey'] = name
+            if sortkey:
+                live['sortkey'].append((abs(sortkey), name))
+                live['interleaved'] = sortkey < 0
+        instrument.execute(cur, table_diststyles, 'migrate')
+        for table, diststyle in cur.fetchall():
+            if table in tables:
+                tables[table]['diststyle'] = REDSHIFT_DISTSTYLES.get(diststyle, 'AUTO')
+        for live in tables.values():
+            live['sortkey'] = [name for _, name in sorted(live['sortkey'])]
+        return tables
+
+    instrument.execute(cur, local_table_columns, 'migrate')
+    for table, name, data_type, char_width, precision, scale, nullable in cur.fetchall():
+        match = TYPE_PATTERN.match(data_type.lower())
+        family_name = family(match.group(1) if match else data_type, dialect)
+        width = char_width if family_name in ('varchar', 'char') else \
+            precision if family_name == 'numeric' else None
+        live = tables.setdefault(table, {'columns': {}, 'diststyle': None, 'distkey': None,
+                                         'sortkey': [], 'interleaved': False})
+        live['columns'][name] = {'type': (family_name, width, (scale or 0) if width else 0),
+                                 'not_null': nullable == 'NO', 'encode': None}
+    return tables
+
+
+def same_type(desired, live):
+    # Widths only count where both sides know them
+    if desired[0] != live[0]:
+        return False
+    return desired[1] is None or live[1] is None or desired[1:] == live[1:]
+
+
+def diff_table(table, live, dialect):
+    # (action, changes, statements) turning live into table
+    redshift = dialect == 'redshift'
+    name, columns = table['name'], {column['name']: column for column in table['columns']}
+    changes, alters, deep_copy, recreate = [], [], False, False
+
+    for column in table['columns']:
+        current = live['columns'].get(column['name'])
+        type_ = desired_type(column, dialect)
+        sql_type = column_type(column)
+        if current is None:
+            changes.append('add column {} {}'.format(column['name'], sql_type))
+            if column['identity']:
+                deep_copy = True
+            elif column['not_null']:
+                recreate = True
+            elif redshift and column['name'] in [table['distkey']] + table['sortkey']:
+                deep_copy = True
+            else:
+                encode = ' ENCODE {}'.format(column['encode']) if redshift and column['encode'] else ''
+                alters.append(add_column.format(name, column['name'], sql_type + encode))
+            continue
+        if not same_type(type_, current['type']):
+            changes.append('{} type {} -> {}'.format(column['name'], type_name(current['type']),
+                                                     sql_type))
+            if not redshift:
+                alters.append(alter_column_type.format(name, column['name'], sql_type))
+            elif type_[0] == 'varchar' and current['type'][0] == 'varchar' \
+                    and type_[1] > current['type'][1]:
+                alters.append(alter_varchar_size.format(name, column['name'], sql_type))
+            else:
+                deep_copy = True
+        if column['not_null'] != current['not_null']:
+            changes.append('{} {}'.format(column['name'],
+                                          'NOT NULL' if column['not_null'] else 'nullable'))
+            if redshift:
+                deep_copy = True
+            else:
+                alters.append(alter_column_not_null.format(
+                    name, column['name'], 'SET' if column['not_null'] else 'DROP'))
+        if redshift and column['encode'] and \
+                column['encode'].lower().replace('raw', 'none') != current['encode']:
+            changes.append('{} encode {} -> {}'.format(column['name'], current['encode'],
+                                                       column['encode']))
+            alters.append(alter_column_encode.format(name, column['name'], column['encode']))
+
+    for column in live['columns']:
+        if column not in columns:
+            changes.append('drop column {}'.format(column))
+            if redshift and column in [live['distkey']] + live['sortkey']:
+                deep_copy = True
+            else:
+                alters.append(drop_column.format(name, column))
+
+    # Table layout; unspecified DISTSTYLE/SORTKEY are AUTO and left alone
+    if redshift:
+        diststyle = table['diststyle']
+        if diststyle and (diststyle != live['diststyle'] or
+                          diststyle == 'KEY' and table['distkey'] != live['distkey']):
+            changes.append('distribution {} -> {}'.format(
+                live['diststyle'] + ('({})'.format(live['distkey']) if live['distkey'] else ''),
+                diststyle + ('({})'.format(table['distkey']) if diststyle == 'KEY' else '')))
+            deep_copy = True
+        if table['sortkey'] and (table['sortkey'] != live['sortkey'] or
+                                 (table['sortstyle'] == 'INTERLEAVED') != live['interleaved']):
+            changes.append('sortkey ({}) -> ({})'.format(', '.join(live['sortkey']),
+                                                        ', '.join(table['sortkey'])))
+            deep_copy = True
+
+    if recreate:
+        return 'recreate', changes, [drop_table.format(name), None]
+    if deep_copy:
+        return 'deep copy', changes, deep_copy_statements(table, live, dialect)
+    return ('alter' if alters else 'unchanged'), changes, alters
+
+
+def deep_copy_statements(table, live, dialect):
+    name, copy = table['name'], table['name'] + COPY_SUFFIX
+    ddl = render_table(dict(table, name=copy))
+    if dialect == 'redshift':
+        # Explicit values are only accepted by GENERATED BY DEFAULT identities
+        ddl = re.sub(r'\bIDENTITY\(', 'GENERATED BY DEFAULT AS IDENTITY(', ddl)
+    columns, values = [], []
+    for column in table['columns']:
+        current = live['columns'].get(column['name'])
+        if current is None:
+            continue
+        columns.append(column['name'])
+        values.append(column['name'] if same_type(desired_type(column, dialect), current['type'])
+                      else 'CAST({} AS {})'.format(column['name'], column_type(column)))
+    return [drop_table.format(copy), ddl,
+            deep_copy_insert.format(copy, ', '.join(columns), ', '.join(values), name),
+            drop_table.format(name), rename_table.format(copy, name)]
+
+
+def plan_migration(cur, dialect):
+    # [(table, action, changes, statements)] in create_table_queries order
+    live = live_tables(cur, dialect)
+    steps = []
+    for query in create_table_queries:
+        table = parse_table(query)
+        if table['name'] not in live:
+            steps.append((table['name'], 'create', [], [query]))
+            continue
+        action, changes, statements = diff_table(table, live[table['name']], dialect)
+        # The CREATE of a recreate is the statement from sql_queries.py
+        statements = [statement or query for statement in statements]
+        steps.append((table['name'], action, changes, statements))
+    return steps
+
+
+def run_step(conn, cur, action, statements):
+    if action == 'alter':
+        # Redshift can't resize or re-encode a column inside a transaction block
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            for statement in statements:
+                instrument.execute(cur, statement, 'migrate')
+        finally:
+            conn.autocommit = autocommit
+        return
+    # create, deep copy and recreate commit as one transaction
+    try:
+        for statement in statements:
+            instrument.execute(cur, statement, 'migrate')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def dialect_of(conn):
+    if instrument.is_redshift(conn):
+        return 'redshift'
+    return l.BACKEND if l.BACKEND != 'redshift' else 'postgres'
+
+
+def migrate(conn, dry_run=False, allow_recreate=False):
+    print('\nMigrating Tables{}...'.format(' (dry run)' if dry_run else ''))
+    conn.commit()
+    cur = conn.cursor()
+    steps = plan_migration(cur, dialect_of(conn))
+    conn.commit()
+    for table, action, changes, statements in steps:
+        if action == 'unchanged':
+            print('{}: unchanged'.format(table))
+            continue
+        print('{}: {}{}'.format(table, action, ' ({})'.format('; '.join(changes)) if changes else ''))
+        if action == 'recreate' and not allow_recreate:
+            print('  SKIPPED: drops the data, run with --allow-recreate and reload')
+            continue
+        if dry_run:
+            for statement in statements:
+                print('  ' + ' '.join(statement.split()))
+            continue
+        run_step(conn, cur, action, statements)
+        print('  DONE')
+    print('MIGRATION {}'.format('PLANNED' if dry_run else 'COMPLETED'))
+    return steps
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Migrate the live tables to sql_queries.py')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the plan and statements without running them')
+    parser.add_argument('--allow-recreate', action='store_true',
+                        help='drop and recreate tables whose data can\'t be kept')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with get_pool().connection() as conn:
+        migrate(conn, args.dry_run, args.allow_recreate)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/opt/conda/bin/python
+"""
+plan_capture.py: Capture and compare the query plans of the warehouse SQL
+- Runs EXPLAIN on every INSERT/UPDATE/DELETE/SELECT in sql_queries.py that
+  touches the ETL's tables ('{watermark}' filled with a fixed date)
+- Keeps the plan steps (cost/rows/width stripped) and the estimated cost and
+  rows per statement, saved per commit in plans_dir ([METRICS] in dwh.cfg),
+  as <commit>-dirty while sql_queries.py has uncommitted changes
+- Compares against the latest earlier capture on the same backend (or
+  --against) and flags new redistribution (DS_BCAST_INNER, DS_DIST_BOTH, ...),
+  Nested Loop and Seq Scan steps, and estimated costs up by more than
+  --cost-threshold
+- --local explains on the local PostgreSQL, statements translated by
+  backends.py; exits non-zero on flagged statements with --fail
+"""
+import argparse
+import collections
+import datetime
+import glob
+import json
+import os
+import re
+import subprocess
+import sys
+import loadconfigs as l
+import instrument
+import sql_queries
+from backends import local_target
+from benchmark import git_commit
+from connection import ConnectionPool, dsn
+from schema import parse_table
+
+EXPLAINABLE = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+# Plan node: indentation, optional arrow, step text, then the estimates
+NODE_PATTERN = re.compile(r'^(\s*)(?:->\s*)?(.*?)\s*\(cost=[\d.]+\.\.([\d.]+) rows=(\d+) width=\d+\)')
+# Steps worth a look when a change introduces them
+RISKY_STEPS = [('redistribution', re.compile(r'\bDS_(BCAST_INNER|DIST_BOTH|DIST_INNER|DIST_OUTER|'
+                                             r'DIST_ALL_INNER)\b')),
+               ('nested loop', re.compile(r'\bNested Loop\b')),
+               ('seq scan', re.compile(r'\bSeq Scan\b'))]
+WATERMARK = '1900-01-01 00:00:00'
+
+
+def explainable_statements():
+    # (name, statement) of sql_queries.py in definition order, list members
+    # named <list>_<n> unless already seen under their own name
+    tables = {parse_table(query)['name'] for query in sql_queries.create_table_queries}
+    seen = set()
+    for name, value in vars(sql_queries).items():
+        if name.startswith('_'):
+            continue
+        statements = [(name, value)] if isinstance(value, str) else \
+            [('{}_{}'.format(name, idx + 1), item) for idx, item in enumerate(value)] \
+            if isinstance(value, list) and all(isinstance(item, str) for item in value) else []
+        for statement_name, statement in statements:
+            statement = statement.replace('{watermark}', WATERMARK)
+            if statement in seen or not EXPLAINABLE.match(statement) or '{' in statement:
+                continue
+            if not any(re.search(r'\b{}\b'.format(table), statement) for table in tables):
+                continue
+            seen.add(statement)
+            yield statement_name, statement
+
+
+def parse_plan(lines):
+    # Normalised steps, estimated cost and rows of the top node
+    steps, cost, rows = [], None, None
+    for line in lines:
+        node = NODE_PATTERN.match(line)
+        if node is None:
+            continue
+        indent, step, total, estimate = node.groups()
+        if cost is None:
+            cost, rows = float(total), int(estimate)
+        steps.append((len(indent), ' '.join(step.split())))
+    # Indentation as depth, so plans compare the same across output widths
+    depths = sorted({indent for indent, _ in steps})
+    return {'steps': ['  ' * depths.index(indent) + step for indent, step in steps],
+            'cost': cost, 'rows': rows, 'error': None}
+
+
+def capture(cur):
+    plans = {}
+    for name, statement in explainable_statements():
+        params = ('',) * statement.count('%s') or None
+        try:
+            instrument.execute(cur, 'EXPLAIN ' + statement, 'plan', name, params)
+            plans[name] = parse_plan(row[0] for row in cur.fetchall())
+        except Exception as e:
+            # e.g. statements on the temp tables of a merge
+            plans[name] = {'steps': [], 'cost': None, 'rows': None, 'error': str(e).strip()}
+    return plans
+
+
+def capture_name():
+    commit = git_commit() or 'working'
+    try:
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', 'sql_queries.py'],
+                                        stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        dirty = False
+    return commit + '-dirty' if dirty else commit
+
+
+def save_capture(capture_, plans_dir=l.PLANS_DIR):
+    os.makedirs(plans_dir, exist_ok=True)
+    path = os.path.join(plans_dir, '{}.json'.format(capture_['name']))
+    with open(path, 'w') as f:
+        json.dump(capture_, f, indent=2)
+    return path
+
+
+def load_captures(plans_dir=l.PLANS_DIR):
+    # Oldest first
+    captures = []
+    for path in glob.glob(os.path.join(plans_dir, '*.json')):
+        with open(path) as f:
+            captures.append(json.load(f))
+    return sorted(captures, key=lambda capture_: capture_['timestamp'])
+
+
+def risky(step):
+    return [label for label, pattern in RISKY_STEPS if pattern.search(step)]
+
+
+def compare(current, baseline, cost_threshold):
+    report = []
+    for name, plan in current['plans'].items():
+        base = baseline['plans'].get(name) if baseline else None
+        row = {'name': name, 'cost': plan['cost'], 'baseline': None, 'change': None,
+               'new_steps': [], 'flags': [], 'error': plan['error']}
+        if base is not None and base['error'] is None and plan['error'] is None:
+            row['baseline'] = base['cost']
+            if base['cost']:
+                row['change'] = (plan['cost'] - base['cost']) / base['cost']
+            new = collections.Counter(step.strip() for step in plan['steps']) - \
+                collections.Counter(step.strip() for step in base['steps'])
+            row['new_steps'] = sorted(new.elements())
+            for step in row['new_steps']:
+                row['flags'].extend('new {}: {}'.format(label, step) for label in risky(step))
+            if row['change'] is not None and row['change'] > cost_threshold:
+                row['flags'].append('cost {:+.0%}'.format(row['change']))
+        report.append(row)
+    return report
+
+
+def print_plans(capture_):
+    for name, plan in capture_['plans'].items():
+        if plan['error']:
+            print('\n{}: not explained ({})'.format(name, plan['error'].splitlines()[0]))
+            continue
+        print('\n{} (cost {}, rows {})'.format(name, plan['cost'], plan['rows']))
+        for step in plan['steps']:
+            labels = risky(step)
+            print('  {}{}'.format(step, '  <- ' + ', '.join(labels) if labels else ''))
+
+
+def print_report(current, baseline, report):
+    print('\nPlans {} against {}'.format(current['name'], baseline['name'] if baseline else '-'))
+    print('{:<40} {:>16} {:>16} {:>8}'.format('STATEMENT', 'COST', 'BASELINE', 'CHANGE'))
+    for row in report:
+        print('{:<40} {:>16} {:>16} {:>8}{}'.format(
+            row['name'],
+            '{:.2f}'.format(row['cost']) if row['cost'] is not None else '-',
+            '{:.2f}'.format(row['baseline']) if row['baseline'] is not None else '-',
+            '{:+.0%}'.format(row['change']) if row['change'] is not None else '-',
+            '  FLAGGED' if row['flags'] else ''))
+        for flag in row['flags']:
+            print('    {}'.format(flag))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Capture and compare EXPLAIN plans')
+    parser.add_argument('--dsn', help='database to explain on (default: the cluster)')
+    parser.add_argument('--local', action='store_true',
+                        help='explain on the local PostgreSQL ([LOCAL] local_dsn)')
+    parser.add_argument('--dir', default=l.PLANS_DIR, help='where captures are kept')
+    parser.add_argument('--list', action='store_true', help='list stored captures')
+    parser.add_argument('--against', help='capture to compare with (default: latest earlier one)')
+    parser.add_argument('--show', action='store_true', help='print every plan')
+    parser.add_argument('--cost-threshold', type=float, default=1.0,
+                        help='relative estimated cost increase flagged')
+    parser.add_argument('--fail', action='store_true',
+                        help='exit with status 1 when statements are flagged')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    captures = load_captures(args.dir)
+    if args.list:
+        for capture_ in captures:
+            print('{:<20} {:<10} {:<28} {:>4} plans'.format(
+                capture_['name'], capture_['backend'], capture_['timestamp'],
+                len(capture_['plans'])))
+        return
+
+    # Autocommit, so a statement that can't be explained doesn't abort the rest
+    if args.local:
+        target, connect = local_target('postgres', args.dsn)
+    elif l.BACKEND == 'redshift':
+        target, connect = args.dsn or dsn(), None
+    elif l.BACKEND == 'postgres':
+        target, connect = local_target(l.BACKEND, args.dsn)
+    else:
+        sys.exit('Plans need Redshift or PostgreSQL, backend is {}'.format(l.BACKEND))
+    pool = ConnectionPool(target, maxconn=1, autocommit=True, connect=connect)
+    with pool.connection() as conn:
+        backend = 'redshift' if instrument.is_redshift(conn) else 'postgres'
+        current = {'name': capture_name(), 'backend': backend,
+                   'timestamp': datetime.datetime.utcnow().isoformat(),
+                   'plans': capture(conn.cursor())}
+    pool.closeall()
+    print('Plans saved to {}'.format(save_capture(current, args.dir)))
+    if args.show:
+        print_plans(current)
+
+    earlier = [capture_ for capture_ in captures
+               if capture_['backend'] == backend and capture_['name'] != current['name']]
+    if args.against:
+        earlier = [capture_ for capture_ in captures if capture_['name'] == args.against]
+        if not earlier:
+            sys.exit('No capture named {} in {}'.format(args.against, args.dir))
+    baseline = earlier[-1] if earlier else None
+    report = compare(current, baseline, args.cost_threshold)
+    print_report(current, baseline, report)
+    flagged = [row for row in report if row['flags']]
+    print('{} statement(s) flagged'.format(len(flagged)))
+    if flagged and args.fail:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+#!/opt/conda/bin/python
+"""
+prestage.py: Convert the source JSON into COPY inputs sized to the cluster
+- Reads a local song_data/log_data tree with the same mapping as the Redshift
+  COPY (see local_ingest.py)
+- Writes N evenly sized gzip'd CSV or Parquet part files per staging table,
+  N = DWH_NUM_NODES x slices per DWH_NODE_TYPE, so every slice loads one
+- Writes the COPY manifest next to the parts, and uploads both under
+  PRESTAGE_DATA with --upload
+- Load them with etl.py --prestaged csv|parquet
+"""
+import argparse
+import csv
+import datetime
+import decimal
+import gzip
+import json
+import os
+import loadconfigs as l
+from sources import split_s3_url, s3_client
+from local_ingest import STAGING_TABLES, table_spec, iter_files, iter_rows
+
+# Slices per node for each node type
+NODE_SLICES = {'dc2.large': 2, 'dc2.8xlarge': 16, 'ds2.xlarge': 2, 'ds2.8xlarge': 16,
+               'ra3.xlplus': 2, 'ra3.4xlarge': 4, 'ra3.16xlarge': 16}
+
+FORMATS = {'csv': 'csv.gz', 'parquet': 'parquet'}
+
+
+def part_count(num_nodes=l.DWH_NUM_NODES, node_type=l.DWH_NODE_TYPE):
+    return int(num_nodes) * NODE_SLICES.get(node_type, 2)
+
+
+class CsvPart:
+    def __init__(self, path, columns):
+        self.file = gzip.open(path, 'wt', newline='')
+        self.writer = csv.writer(self.file)
+
+    def write(self, row):
+        # NULL is written as an empty field, loaded back with EMPTYASNULL
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetPart:
+    def __init__(self, path, columns, batch_size=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('parquet output requires pyarrow (pip install pyarrow)')
+        self.pa = pa
+        self.columns = columns
+        # COPY FORMAT AS PARQUET maps fields by position and needs exact types
+        self.schema = pa.schema([(name, self._arrow_type(type_, width, scale))
+                                 for name, type_, width, scale in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch_size = batch_size
+        self.rows = []
+
+    def _arrow_type(self, type_, width, scale):
+        pa = self.pa
+        if type_ in ('DECIMAL', 'NUMERIC'):
+            return pa.decimal128(width or 18, scale)
+        return {'SMALLINT': pa.int16(), 'INTEGER': pa.int32(), 'INT': pa.int32(),
+                'BIGINT': pa.int64(), 'FLOAT': pa.float64(), 'REAL': pa.float32(),
+                'BOOLEAN': pa.bool_(), 'TIMESTAMP': pa.timestamp('us')}.get(type_, pa.string())
+
+    def _value(self, value, type_, scale):
+        # local_ingest.py yields text, Parquet wants typed values
+        if value is None:
+            return None
+        if type_ in ('SMALLINT', 'INTEGER', 'INT', 'BIGINT'):
+            return int(value)
+        if type_ in ('FLOAT', 'REAL'):
+            return float(value)
+        if type_ in ('DECIMAL', 'NUMERIC'):
+            return decimal.Decimal(value).quantize(decimal.Decimal(1).scaleb(-scale),
+                                                   rounding=decimal.ROUND_HALF_UP)
+        if type_ == 'TIMESTAMP':
+            return datetime.datetime.fromisoformat(value)
+        if type_ == 'BOOLEAN':
+            return value.lower() in ('t', 'true', '1')
+        return value
+
+    def write(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            data = {name: [self._value(row[idx], type_, scale) for row in self.rows]
+                    for idx, (name, type_, _, scale) in enumerate(self.columns)}
+            self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+PARTS = {'csv': CsvPart, 'parquet': ParquetPart}
+
+
+def convert(table, data_dir, output_dir, fmt='csv', parts=None):
+    # Rows are dealt round-robin so every part gets the same number of rows
+    spec = table_spec(table)
+    parts = parts or part_count()
+    table_dir = os.path.join(output_dir, table)
+    os.makedirs(table_dir, exist_ok=True)
+    paths = [os.path.join(table_dir, 'part-{:05d}.{}'.format(idx, FORMATS[fmt]))
+             for idx in range(parts)]
+    writers = [PARTS[fmt](path, spec['columns']) for path in paths]
+    rows = 0
+    try:
+        source = iter_files(os.path.join(data_dir, STAGING_TABLES[table][1]))
+        for row in iter_rows(spec, source):
+            writers[rows % parts].write(row)
+            rows += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    return paths, rows
+
+
+def write_manifest(paths, output_dir, table, prefix=None):
+    # content_length is required for Parquet manifests and harmless for CSV
+    entries = []
+    for path in paths:
+        url = '{}/{}/{}'.format(prefix, table, os.path.basename(path)) if prefix \
+            else os.path.abspath(path)
+        entries.append({'url': url, 'mandatory': True,
+                        'meta': {'content_length': os.path.getsize(path)}})
+    manifest = os.path.join(output_dir, table, 'manifest')
+    with open(manifest, 'w') as f:
+        json.dump({'entries': entries}, f, indent=2)
+    return manifest
+
+
+def upload(paths, manifest, table, prefix, s3=None):
+    s3 = s3 or s3_client()
+    bucket, key_prefix = split_s3_url(prefix)
+    for path in paths + [manifest]:
+        key = '/'.join(part for part in [key_prefix, table, os.path.basename(path)] if part)
+        s3.upload_file(path, bucket, key)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert source JSON into COPY part files')
+    parser.add_argument('--data-dir', default=l.LOCAL_DATA,
+                        help='local song_data/log_data tree')
+    parser.add_argument('--output-dir', default='prestage')
+    parser.add_argument('--format', choices=list(PARTS), default='csv')
+    parser.add_argument('--parts', type=int,
+                        help='part files per table (default: nodes x slices per node)')
+    parser.add_argument('--table', choices=list(STAGING_TABLES), action='append',
+                        help='table to convert (default: all staging tables)')
+    parser.add_argument('--prefix', default=l.PRESTAGE_DATA,
+                        help='S3 prefix the manifest points at (default: PRESTAGE_DATA)')
+    parser.add_argument('--upload', action='store_true', help='upload parts and manifest')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.upload and not args.prefix:
+        raise SystemExit('--upload needs --prefix or PRESTAGE_DATA in dwh.cfg')
+    parts = args.parts or part_count()
+    for table in args.table or list(STAGING_TABLES):
+        paths, rows = convert(table, args.data_dir, args.output_dir, args.format, parts)
+        manifest = write_manifest(paths, args.output_dir, table, args.prefix.rstrip('/') or None)
+        print('{}: {} rows in {} {} parts, manifest {}'.format(
+            table, rows, len(paths), args.format, manifest))
+        if args.upload:
+            upload(paths, manifest, table, args.prefix.rstrip('/'))
+            print('{}: uploaded to {}/{}'.format(table, args.prefix.rstrip('/'), table))
+    print('PRESTAGED')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+result_cache.py: Local result cache for analytical queries
+- Keyed on a hash of the query text plus the ETL version stamp
+- etl.py records a new stamp in etl_control when it finishes, which
+  invalidates every entry on every machine; it is read once per session
+- Size-bounded LRU eviction, optional TTL
+- Results larger than the per-entry limit are streamed but not cached
+"""
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+import loadconfigs as l
+import instrument
+from sql_queries import etl_version_name, control_select
+
+
+def new_etl_version():
+    return '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S', time.gmtime()), uuid.uuid4().hex[:8])
+
+
+def read_etl_version(pool):
+    # From etl_control rather than a local file, so loads run elsewhere
+    # invalidate this machine's cache too
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        instrument.execute(cur, control_select, 'control', params=(etl_version_name,))
+        row = cur.fetchone()
+        conn.commit()
+    return row[0] if row else None
+
+
+class CachingSink:
+    # Passes batches through to the real sink, keeping a copy while small
+    def __init__(self, sink, max_rows):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.rows = []
+
+    def write(self, rows):
+        self.sink.write(rows)
+        if self.rows is not None:
+            self.rows.extend(rows)
+            if len(self.rows) > self.max_rows:
+                self.rows = None
+
+    def close(self):
+        self.sink.close()
+
+
+class ResultCache:
+    def __init__(self, cache_dir=l.CACHE_DIR, max_bytes=l.CACHE_MAX_BYTES,
+                 ttl=l.CACHE_TTL, version=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.version = version
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.index = self._read_index()
+
+    @property
+    def enabled(self):
+        # Without an ETL stamp there is no way to tell if results are stale
+        return self.version is not None
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_index(self):
+        tmp = '{}.tmp'.format(self.index_path)
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, '{}.pkl'.format(key))
+
+    def _remove(self, key):
+        self.index.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def key(self, query):
+        return hashlib.sha256('{}\0{}'.format(self.version, query).encode()).hexdigest()
+
+    def get(self, query):
+        if not self.enabled:
+            return None
+        key = self.key(query)
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+            if self.ttl and time.time() - entry['created'] > self.ttl:
+                self._remove(key)
+                self._write_index()
+                return None
+            try:
+                with open(self._path(key), 'rb') as f:
+                    result = pickle.load(f)
+            except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+                self._remove(key)
+                self._write_index()
+                return None
+            entry['accessed'] = time.time()
+            self._write_index()
+            return result
+
+    def put(self, query, columns, type_codes, rows):
+        if not self.enabled:
+            return
+        key = self.key(query)
+        data = pickle.dumps({'columns': columns, 'type_codes': type_codes, 'rows': rows},
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            with open(self._path(key), 'wb') as f:
+                f.write(data)
+            now = time.time()
+            self.index[key] = {'size': len(data), 'created': now, 'accessed': now}
+            self._evict()
+            self._write_index()
+
+    def _evict(self):
+        # Least recently used entries go first until the cache fits max_bytes,
+        # entries keyed on an older ETL version are never hit so they age out
+        total = sum(entry['size'] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda k: self.index[k]['accessed']):
+            if total <= self.max_bytes:
+                break
+            total -= self.index[key]['size']
+            self._remove(key)
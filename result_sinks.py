@@ -0,0 +1,120 @@
+"""
+result_sinks.py: Streaming sinks for query results
+- stdout: print each row, as analytics.py always has
+- csv: header row plus one line per row
+- jsonl: one JSON object per row
+- parquet: one row group per batch (requires pyarrow)
+Rows are written batch by batch so client memory stays flat.
+"""
+import csv
+import datetime
+import decimal
+import json
+import os
+import sys
+
+
+class StdoutSink:
+    extension = None
+
+    def __init__(self, path, columns, type_codes, out=None):
+        self.columns = columns
+        self.out = out or sys.stdout
+
+    def write(self, rows):
+        for row in rows:
+            print(row, file=self.out)
+
+    def close(self):
+        self.out.flush()
+
+
+class CsvSink:
+    extension = 'csv'
+
+    def __init__(self, path, columns, type_codes):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+def _json_default(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class JsonLinesSink:
+    extension = 'jsonl'
+
+    def __init__(self, path, columns, type_codes):
+        self.file = open(path, 'w')
+        self.columns = columns
+
+    def write(self, rows):
+        for row in rows:
+            self.file.write(json.dumps(dict(zip(self.columns, row)), default=_json_default))
+            self.file.write('\n')
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    extension = 'parquet'
+
+    def __init__(self, path, columns, type_codes):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError('parquet output requires pyarrow (pip install pyarrow)')
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(name, self._arrow_type(code))
+                                 for name, code in zip(columns, type_codes)])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def _arrow_type(self, type_code):
+        # PostgreSQL/Redshift type OIDs to Arrow types, text for the rest
+        pa = self.pa
+        return {16: pa.bool_(), 20: pa.int64(), 21: pa.int64(), 23: pa.int64(),
+                700: pa.float64(), 701: pa.float64(), 1700: pa.float64(),
+                1082: pa.date32(), 1114: pa.timestamp('us'),
+                1184: pa.timestamp('us', tz='UTC')}.get(type_code, pa.string())
+
+    def write(self, rows):
+        data = {}
+        for idx, field in enumerate(self.schema):
+            values = [row[idx] for row in rows]
+            if field.type == self.pa.float64():
+                values = [None if v is None else float(v) for v in values]
+            elif field.type == self.pa.string():
+                values = [None if v is None else str(v) for v in values]
+            data[field.name] = values
+        self.writer.write_table(self.pa.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+SINKS = {'stdout': StdoutSink, 'csv': CsvSink, 'jsonl': JsonLinesSink,
+         'parquet': ParquetSink}
+
+
+def open_sink(fmt, output_dir, name, columns, type_codes, out=None):
+    # out redirects the stdout sink, e.g. to buffer concurrent results
+    sink = SINKS[fmt]
+    if not sink.extension:
+        return sink(None, columns, type_codes, out), None
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, '{}.{}'.format(name, sink.extension))
+    return sink(path, columns, type_codes), path
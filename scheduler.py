@@ -0,0 +1,139 @@
+"""
+scheduler.py: Dependency-aware scheduler for query graphs
+- Derive dependencies from the tables each node reads and writes, and
+  refuse a graph with duplicate node names or a dependency cycle before
+  running anything
+- Run independent nodes concurrently on pooled connections
+- Skip nodes whose dependencies failed
+- With checkpoints (see checkpoints.py), skip nodes an earlier run committed
+  and checkpoint each node in its own transaction
+- Print per-node timings, wall time and critical path
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import instrument
+
+
+def build_dependencies(nodes):
+    # A node depends on every earlier node it conflicts with:
+    # earlier writes it reads/writes, or earlier reads it overwrites.
+    # Names key the dependencies and checkpoints, so they must be unique
+    names = [node['name'] for node in nodes]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError('Duplicate node names: {}'.format(', '.join(duplicates)))
+    deps = {}
+    for j, node in enumerate(nodes):
+        reads, writes = set(node['reads']), set(node['writes'])
+        deps[node['name']] = set()
+        for earlier in nodes[:j]:
+            if (set(earlier['writes']) & (reads | writes)
+                    or set(earlier['reads']) & writes):
+                deps[node['name']].add(earlier['name'])
+    return deps
+
+
+def execution_waves(nodes, deps):
+    # Node names in waves whose members can run side by side, each after
+    # the waves before it; ValueError if some nodes can never run
+    waves, done = [], set()
+    remaining = [node['name'] for node in nodes]
+    while remaining:
+        wave = [name for name in remaining if deps[name] <= done]
+        if not wave:
+            raise ValueError('Dependency cycle between: {}'.format(', '.join(remaining)))
+        waves.append(wave)
+        done.update(wave)
+        remaining = [name for name in remaining if name not in done]
+    return waves
+
+
+def critical_path(nodes, deps, timings):
+    # Longest chain of measured durations through the dependency graph
+    finish = {}
+    for node in nodes:
+        name = node['name']
+        if name not in timings:
+            continue
+        start = max([finish.get(d, 0) for d in deps[name]] or [0])
+        finish[name] = start + timings[name]
+    return max(finish.values() or [0])
+
+
+def run_node(node, pool, stage, checkpoints=None):
+    # Statements of one node (and its checkpoint) run in a single transaction
+    queries = node['query']
+    if isinstance(queries, str):
+        queries = [queries]
+    start = time.time()
+    with pool.connection() as conn:
+        try:
+            cur = conn.cursor()
+            for idx, query in enumerate(queries):
+                name = node['name'] if len(queries) == 1 else '{}.{}'.format(node['name'], idx + 1)
+                instrument.execute(cur, query, stage, name)
+            if checkpoints is not None:
+                checkpoints.mark(cur, node['name'])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return time.time() - start
+
+
+def run_dag(nodes, pool, max_workers=4, label='Stage', stage='dag', checkpoints=None):
+    deps = build_dependencies(nodes)
+    execution_waves(nodes, deps)
+    pending = [node for node in nodes]
+    running = {}
+    timings = {}
+    resumed = set()
+    errors = {}
+    skipped = []
+    start = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Submit every node whose dependencies have all completed
+            for node in list(pending):
+                name = node['name']
+                if checkpoints is not None and checkpoints.done(name):
+                    pending.remove(node)
+                    resumed.add(name)
+                    print('{} ALREADY DONE'.format(name))
+                elif deps[name] & (set(errors) | set(skipped)):
+                    pending.remove(node)
+                    skipped.append(name)
+                    print('{} SKIPPED (dependency failed)'.format(name))
+                elif deps[name] <= set(timings) | resumed:
+                    pending.remove(node)
+                    running[executor.submit(run_node, node, pool, stage, checkpoints)] = name
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                    print('{} COMPLETED'.format(name))
+                except Exception as e:
+                    errors[name] = e
+                    print('{} FAILED: {}'.format(name, e))
+
+    elapsed = time.time() - start
+
+    # Combined timing summary
+    print('\n{} Timings:'.format(label))
+    for node in nodes:
+        if node['name'] in timings:
+            print('{}: {:.2f}s'.format(node['name'], timings[node['name']]))
+    print('Wall time: {:.2f}s, critical path: {:.2f}s, sum of queries: {:.2f}s'.format(
+        elapsed, critical_path(nodes, deps, timings), sum(timings.values())))
+
+    if errors or skipped:
+        raise RuntimeError('{} failed for: {}'.format(label, ', '.join(
+            ['{} ({})'.format(name, errors[name]) for name in errors] +
+            ['{} (skipped)'.format(name) for name in skipped])))
+    return timings
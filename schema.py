@@ -0,0 +1,128 @@
+"""
+schema.py: Parse and render the Redshift CREATE TABLE statements
+- parse_table() turns a CREATE TABLE from sql_queries.py into a dict of
+  columns (type, width, scale, IDENTITY, NOT NULL, PRIMARY KEY, ENCODE) and
+  the table's DISTSTYLE, DISTKEY, SORTKEY and PRIMARY KEY; IDENTITY and
+  PRIMARY KEY columns count as NOT NULL, as the catalog reports them
+- render_table() writes such a dict back as DDL in the layout of sql_queries.py
+"""
+import re
+
+TABLE_PATTERN = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)\s*\(', re.IGNORECASE)
+COLUMN_PATTERN = re.compile(r'\s*(\w+)\s+(\w+)\s*(?:\(\s*(\d+)\s*(?:,\s*(\d+)\s*)?\))?(.*)$',
+                            re.IGNORECASE | re.DOTALL)
+
+
+def _names(text):
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def parse_column(text):
+    name, type_, width, scale, rest = COLUMN_PATTERN.match(text).groups()
+    identity = re.search(r'\bIDENTITY\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)', rest, re.IGNORECASE)
+    encode = re.search(r'\bENCODE\s+(\w+)', rest, re.IGNORECASE)
+    primary_key = bool(re.search(r'\bPRIMARY\s+KEY\b', rest, re.IGNORECASE))
+    return {'name': name,
+            'type': type_.upper(),
+            'width': int(width) if width else None,
+            'scale': int(scale) if scale else 0,
+            'identity': (int(identity.group(1)), int(identity.group(2))) if identity else None,
+            # IDENTITY and PRIMARY KEY columns are NOT NULL in the catalog too
+            'not_null': bool(identity or primary_key or
+                             re.search(r'\bNOT\s+NULL\b', rest, re.IGNORECASE)),
+            'primary_key': primary_key,
+            'encode': encode.group(1).upper() if encode else None,
+            'distkey': bool(re.search(r'\bDISTKEY\b', rest, re.IGNORECASE)),
+            'sortkey': bool(re.search(r'\bSORTKEY\b', rest, re.IGNORECASE))}
+
+
+def parse_table(create_sql):
+    match = TABLE_PATTERN.search(create_sql)
+    if match is None:
+        raise ValueError('Not a CREATE TABLE statement: {}'.format(' '.join(create_sql.split())[:80]))
+    # The column list ends at the parenthesis matching the opening one
+    body_start, depth = match.end(), 1
+    for body_end in range(body_start, len(create_sql)):
+        depth += {'(': 1, ')': -1}.get(create_sql[body_end], 0)
+        if depth == 0:
+            break
+    body, options = create_sql[body_start:body_end], create_sql[body_end + 1:]
+
+    table = {'name': match.group(1), 'columns': [], 'primary_key': [], 'diststyle': None,
+             'distkey': None, 'sortkey': [], 'sortstyle': None}
+    for text in re.split(r',(?![^(]*\))', body):
+        if not text.strip():
+            continue
+        constraint = re.match(r'\s*PRIMARY\s+KEY\s*\(([^)]*)\)', text, re.IGNORECASE)
+        if constraint:
+            table['primary_key'] = _names(constraint.group(1))
+            continue
+        if re.match(r'\s*(UNIQUE|FOREIGN|CONSTRAINT)\b', text, re.IGNORECASE):
+            continue
+        column = parse_column(text)
+        table['columns'].append(column)
+        if column['primary_key']:
+            table['primary_key'] = [column['name']]
+        if column['distkey']:
+            table['distkey'] = column['name']
+        if column['sortkey']:
+            table['sortkey'] = [column['name']]
+
+    for column in table['columns']:
+        if column['name'] in table['primary_key']:
+            column['not_null'] = True
+
+    # Table attributes after the column list
+    diststyle = re.search(r'\bDISTSTYLE\s+(\w+)', options, re.IGNORECASE)
+    distkey = re.search(r'\bDISTKEY\s*\(\s*(\w+)\s*\)', options, re.IGNORECASE)
+    sortkey = re.search(r'\b(?:(COMPOUND|INTERLEAVED)\s+)?SORTKEY\s*\(([^)]*)\)',
+                        options, re.IGNORECASE)
+    if distkey:
+        table['distkey'] = distkey.group(1)
+    if sortkey:
+        table['sortkey'] = _names(sortkey.group(2))
+        table['sortstyle'] = (sortkey.group(1) or 'COMPOUND').upper()
+    if diststyle:
+        table['diststyle'] = diststyle.group(1).upper()
+    elif table['distkey']:
+        table['diststyle'] = 'KEY'
+    return table
+
+
+def column_type(column):
+    if column['width'] is None:
+        return column['type']
+    if column['scale']:
+        return '{}({},{})'.format(column['type'], column['width'], column['scale'])
+    return '{}({})'.format(column['type'], column['width'])
+
+
+def render_column(column, table):
+    parts = [column['name'], column_type(column)]
+    if column['identity']:
+        parts.append('IDENTITY({},{})'.format(*column['identity']))
+    if column['not_null'] and not column['identity']:
+        parts.append('NOT NULL')
+    if table['primary_key'] == [column['name']]:
+        parts.append('PRIMARY KEY')
+    if column['encode']:
+        parts.append('ENCODE {}'.format(column['encode']))
+    if table['distkey'] == column['name'] and table['diststyle'] in (None, 'KEY'):
+        parts.append('DISTKEY')
+    if table['sortkey'] == [column['name']] and table['sortstyle'] != 'INTERLEAVED':
+        parts.append('SORTKEY')
+    return ' '.join(parts)
+
+
+def render_table(table):
+    lines = [render_column(column, table) for column in table['columns']]
+    if len(table['primary_key']) > 1:
+        lines.append('PRIMARY KEY ({})'.format(', '.join(table['primary_key'])))
+    options = []
+    if table['diststyle'] in ('ALL', 'EVEN', 'AUTO'):
+        options.append('DISTSTYLE {}'.format(table['diststyle']))
+    if len(table['sortkey']) > 1 or (table['sortkey'] and table['sortstyle'] == 'INTERLEAVED'):
+        options.append('{} SORTKEY ({})'.format(table['sortstyle'] or 'COMPOUND',
+                                                ', '.join(table['sortkey'])))
+    return '\n\tCREATE TABLE IF NOT EXISTS {} (\n\t\t{}\n\t){};\n'.format(
+        table['name'], ',\n\t\t'.join(lines), ''.join('\n\t' + option for option in options))
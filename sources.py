@@ -0,0 +1,207 @@
+"""
+sources.py: Source object listings for COPY, with a local listing cache
+- S3Source lists an s3:// prefix (any boto3-compatible client can be passed
+  in, e.g. a moto mock), LocalSource lists a local directory with the same
+  interface so selection can be tested without S3
+- Listings are cached per prefix with each object's ETag and size. A month
+  is final, and cached until refreshed, once a later month holds objects
+  and LISTING_FINAL_GRACE seconds have passed since it ended; other months,
+  and always the watermark's, for LISTING_CACHE_TTL seconds
+- With an offline backend, LOG_DATA/SONG_DATA are read from LOCAL_DATA
+- select_log_objects() prunes log_data/YYYY/MM/YYYY-MM-DD-events.json
+  objects to a date range, write_manifest() turns them into a COPY manifest
+"""
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import boto3
+import loadconfigs as l
+
+LOG_KEY_PATTERN = re.compile(r'(\d{4})-(\d{2})-(\d{2})-events\.json$')
+MONTH_KEY_PATTERN = re.compile(r'/(\d{4})/(\d{2})/$')
+
+
+def split_s3_url(url):
+    bucket, _, prefix = url.replace('s3://', '', 1).partition('/')
+    return bucket, prefix.rstrip('/')
+
+
+def s3_client():
+    return boto3.client('s3',
+                        region_name="us-west-2",
+                        aws_access_key_id=l.KEY,
+                        aws_secret_access_key=l.SECRET)
+
+
+class S3Source:
+    def __init__(self, url, s3=None):
+        self.root = url.rstrip('/')
+        self.bucket, self.prefix = split_s3_url(url)
+        self._s3 = s3
+
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = s3_client()
+        return self._s3
+
+    def list(self, prefix=''):
+        # (url, etag, size) of every object under root/prefix
+        objects = []
+        paginator = self.s3.get_paginator('list_objects_v2')
+        full_prefix = '/'.join(part for part in [self.prefix, prefix] if part)
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=full_prefix):
+            for obj in page.get('Contents', []):
+                objects.append(('s3://{}/{}'.format(self.bucket, obj['Key']),
+                                obj['ETag'].strip('"'), obj['Size']))
+        return objects
+
+
+class LocalSource:
+    def __init__(self, root):
+        self.root = root.rstrip('/')
+
+    def list(self, prefix=''):
+        # prefix is a directory (e.g. 'YYYY/MM/'). Local files have no ETag,
+        # size and mtime stand in for it
+        objects = []
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, prefix)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                etag = hashlib.md5('{}:{}'.format(stat.st_size, stat.st_mtime_ns)
+                                   .encode()).hexdigest()
+                objects.append((os.path.abspath(path), etag, stat.st_size))
+        return objects
+
+
+def local_data_path(url):
+    # LOG_DATA/SONG_DATA URLs -> the same objects under the local data tree,
+    # for the offline backends (see backends.py). Local paths are kept.
+    for prefix, directory in [(l.LOG_DATA, 'log_data'), (l.SONG_DATA, 'song_data')]:
+        prefix = prefix.rstrip('/')
+        if url == prefix or url.startswith(prefix + '/'):
+            return os.path.join(l.LOCAL_DATA, directory, url[len(prefix):].lstrip('/'))
+    if url.startswith('s3://'):
+        raise ValueError('No local copy of {}'.format(url))
+    return url
+
+
+def source_for(url, s3=None):
+    if l.BACKEND != 'redshift':
+        url = local_data_path(url)
+    return S3Source(url, s3) if url.startswith('s3://') else LocalSource(url)
+
+
+class ListingCache:
+    def __init__(self, path=l.LISTING_CACHE_FILE, ttl=l.LISTING_CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.listings = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.listings = {}
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = '{}.tmp'.format(self.path)
+        with open(tmp, 'w') as f:
+            json.dump(self.listings, f)
+        os.replace(tmp, self.path)
+
+    def list(self, source, prefix, final=False, refresh=False):
+        # final: the prefix no longer changes (e.g. a month followed by
+        # another). A listing is kept for good only if it was final both
+        # when listed and now
+        key = '{}/{}'.format(source.root, prefix)
+        with self.lock:
+            entry = self.listings.get(key)
+            if entry is not None and not refresh and \
+                    ((final and entry['final']) or time.time() - entry['listed'] <= self.ttl):
+                return [tuple(obj) for obj in entry['objects']]
+        objects = source.list(prefix)
+        with self.lock:
+            self.listings[key] = {'listed': time.time(), 'final': final,
+                                  'objects': [list(obj) for obj in objects]}
+            self._save()
+        return objects
+
+    def latest_month(self, source):
+        # Newest (year, month) listed with objects under source, if any
+        months = [(int(match.group(1)), int(match.group(2)))
+                  for key, entry in self.listings.items()
+                  if key.startswith(source.root + '/') and entry['objects']
+                  for match in [MONTH_KEY_PATTERN.search(key)] if match]
+        return max(months, default=None)
+
+
+def month_prefixes(since, until):
+    # YYYY/MM/ prefixes covering since..until
+    year, month = since.year, since.month
+    while (year, month) <= (until.year, until.month):
+        yield '{:04d}/{:02d}/'.format(year, month), (year, month)
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def month_end(month):
+    # First moment after (year, month)
+    year, month = month
+    return datetime.datetime(year + 1, 1, 1) if month == 12 \
+        else datetime.datetime(year, month + 1, 1)
+
+
+def select_log_objects(source, since=None, until=None, cache=None, refresh=False,
+                       watermark=None, grace=l.LISTING_FINAL_GRACE):
+    # (day, url, etag, size) of log objects with since <= day <= until, in
+    # day order. Without since the whole prefix is listed. Months are listed
+    # newest first, so a month is final once a later one holds objects and
+    # its late files had grace seconds to land; the month of the watermark
+    # day may still get files and never is
+    cache = cache or ListingCache()
+    now = datetime.datetime.utcnow()
+    if since is None:
+        listings = [cache.list(source, '', refresh=refresh)]
+    else:
+        open_month = (watermark.year, watermark.month) if watermark else None
+        listings = []
+        for prefix, month in reversed(list(month_prefixes(since, until or now.date()))):
+            latest = cache.latest_month(source)
+            final = latest is not None and latest > month and month != open_month and \
+                (now - month_end(month)).total_seconds() >= grace
+            listings.append(cache.list(source, prefix, final=final, refresh=refresh))
+    selected = []
+    for objects in listings:
+        for url, etag, size in objects:
+            match = LOG_KEY_PATTERN.search(url)
+            if match is None:
+                continue
+            day = datetime.date(*[int(part) for part in match.groups()])
+            if (since is None or day >= since) and (until is None or day <= until):
+                selected.append((day, url, etag, size))
+    return sorted(selected)
+
+
+def write_manifest(objects, url, s3=None):
+    # COPY manifest of (day, url, etag, size) objects, to S3 or a local path
+    manifest = json.dumps({'entries': [{'url': obj_url, 'mandatory': True,
+                                        'meta': {'content_length': size}}
+                                       for _, obj_url, _, size in objects]}, indent=2)
+    if url.startswith('s3://'):
+        bucket, key = split_s3_url(url)
+        (s3 or s3_client()).put_object(Bucket=bucket, Key=key, Body=manifest.encode())
+    else:
+        directory = os.path.dirname(url)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(url, 'w') as f:
+            f.write(manifest)
+    return url
@@ -18,6 +18,10 @@ user_table_drop = "DROP TABLE IF EXISTS dm_users"
 song_table_drop = "DROP TABLE IF EXISTS dm_songs"
 artist_table_drop = "DROP TABLE IF EXISTS dm_artists"
 time_table_drop = "DROP TABLE IF EXISTS dm_time"
+etl_control_table_drop = "DROP TABLE IF EXISTS etl_control"
+song_plays_summary_drop = "DROP TABLE IF EXISTS sm_song_plays"
+artist_plays_summary_drop = "DROP TABLE IF EXISTS sm_artist_plays"
+time_plays_summary_drop = "DROP TABLE IF EXISTS sm_time_plays"
 
 # CREATE TABLES
 staging_events_table_create = ("""
@@ -37,10 +41,12 @@ staging_events_table_create = ("""
 		sessionId INTEGER,
 		song VARCHAR,
 		status INTEGER,
-		ts TIMESTAMP SORTKEY,
+		ts TIMESTAMP,
 		userAgent VARCHAR,
-		userId INTEGER
-	);
+		userId INTEGER,
+		match_key CHAR(32) SORTKEY
+	)
+	DISTSTYLE EVEN;
 """)
 
 staging_songs_table_create = ("""
@@ -54,7 +60,8 @@ staging_songs_table_create = ("""
 		song_id VARCHAR,
 		title VARCHAR,
 		duration DECIMAL,
-		year INTEGER
+		year INTEGER,
+		match_key CHAR(32) DISTKEY SORTKEY
 	);
 """)
 
@@ -114,7 +121,53 @@ time_table_create = ("""
 	);
 """)
 
+etl_control_table_create = ("""
+	CREATE TABLE IF NOT EXISTS etl_control (
+		name VARCHAR(64) NOT NULL PRIMARY KEY,
+		value VARCHAR(256),
+		updated_at TIMESTAMP NOT NULL
+	);
+""")
+
+# SUMMARY TABLES
+# Pre-aggregated plays for the analytical queries
+song_plays_summary_create = ("""
+	CREATE TABLE IF NOT EXISTS sm_song_plays (
+		song_id VARCHAR NOT NULL PRIMARY KEY DISTKEY,
+		play_count BIGINT NOT NULL
+	);
+""")
+
+artist_plays_summary_create = ("""
+	CREATE TABLE IF NOT EXISTS sm_artist_plays (
+		artist_id VARCHAR NOT NULL PRIMARY KEY DISTKEY,
+		play_count BIGINT NOT NULL
+	);
+""")
+
+time_plays_summary_create = ("""
+	CREATE TABLE IF NOT EXISTS sm_time_plays (
+		weekday INTEGER NOT NULL,
+		hour INTEGER NOT NULL,
+		play_count BIGINT NOT NULL,
+		PRIMARY KEY (weekday, hour)
+	)
+	DISTSTYLE ALL
+	COMPOUND SORTKEY (weekday, hour);
+""")
+
 # COPY TO STAGING TABLES FROM S3
+# JSON sources fill every column but match_key. They are copied into a raw
+# temp table and inserted from there into the staging table with match_key
+# computed, in sort key order. Songs land on their key's slice; events stay
+# spread evenly, as match_key is NULL for every event but NextSong and a
+# DISTKEY on it would put all of those on one slice.
+staging_events_columns = ('artist, auth, firstName, gender, itemInSession, lastName, length, '
+                          'level, location, method, page, registration, sessionId, song, '
+                          'status, ts, userAgent, userId')
+staging_songs_columns = ('num_songs, artist_id, artist_latitude, artist_longitude, '
+                         'artist_location, artist_name, song_id, title, duration, year')
+
 staging_events_copy = ("""
 	COPY {} FROM '{}' 
 	IAM_ROLE '{}'
@@ -123,7 +176,8 @@ staging_events_copy = ("""
 	JSON '{}'
 	COMPUPDATE OFF
 	REGION 'us-west-2';
-""").format('staging_events', l.LOG_DATA, l.DWH_ROLE_ARN, l.LOG_JSONPATH)
+""").format('staging_events_raw ({})'.format(staging_events_columns), l.LOG_DATA, l.DWH_ROLE_ARN,
+           l.LOG_JSONPATH)
 
 staging_songs_copy = ("""
 	COPY {} FROM '{}' 
@@ -132,20 +186,126 @@ staging_songs_copy = ("""
 	JSON 'auto'
 	COMPUPDATE OFF
 	REGION 'us-west-2';
-""").format('staging_songs', l.SONG_DATA, l.DWH_ROLE_ARN)
+""").format('staging_songs_raw ({})'.format(staging_songs_columns), l.SONG_DATA, l.DWH_ROLE_ARN)
+
+# Single log_data partition, path filled in by incremental.py
+staging_events_copy_partition = ("""
+	COPY {} FROM '{}' 
+	IAM_ROLE '{}'
+	TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL
+	TIMEFORMAT AS 'epochmillisecs'
+	JSON '{}'
+	COMPUPDATE OFF
+	REGION 'us-west-2';
+""").format('staging_events_raw ({})'.format(staging_events_columns), '{}', l.DWH_ROLE_ARN,
+           l.LOG_JSONPATH)
+
+# log_data objects listed in a manifest, url filled in by etl.py --since/--until
+staging_events_copy_manifest = ("""
+	COPY {} FROM '{}' 
+	IAM_ROLE '{}'
+	TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL
+	TIMEFORMAT AS 'epochmillisecs'
+	JSON '{}'
+	MANIFEST
+	COMPUPDATE OFF
+	REGION 'us-west-2';
+""").format('staging_events_raw ({})'.format(staging_events_columns), '{}', l.DWH_ROLE_ARN,
+           l.LOG_JSONPATH)
+
+staging_events_truncate = "TRUNCATE staging_events"
+
+# TRUNCATE commits on Redshift, DELETE keeps the emptying in the COPY's
+# transaction so a failed or repeated COPY never leaves doubled rows
+staging_events_delete = "DELETE FROM staging_events"
+staging_songs_delete = "DELETE FROM staging_songs"
+
+# Raw COPY targets, the staging columns without match_key
+staging_events_raw_create = ("""
+	CREATE TEMP TABLE staging_events_raw
+	DISTSTYLE EVEN
+	AS SELECT {} FROM staging_events WHERE 1 = 0;
+""").format(staging_events_columns)
+
+staging_songs_raw_create = ("""
+	CREATE TEMP TABLE staging_songs_raw
+	DISTSTYLE EVEN
+	AS SELECT {} FROM staging_songs WHERE 1 = 0;
+""").format(staging_songs_columns)
+
+staging_events_raw_drop = "DROP TABLE IF EXISTS staging_events_raw"
+staging_songs_raw_drop = "DROP TABLE IF EXISTS staging_songs_raw"
+
+# Normalized title|artist hash shared by both staging tables: case and
+# whitespace differences still match, and the songplay join is a merge
+# join on one fixed-width column. NULL when either is NULL. local_ingest.py
+# computes the same key.
+staging_events_insert = ("""
+	INSERT INTO staging_events ({0}, match_key)
+	SELECT {0},
+		MD5(LOWER(TRIM(REGEXP_REPLACE(song, '[[:space:]]+', ' ')))
+		|| '|' || LOWER(TRIM(REGEXP_REPLACE(artist, '[[:space:]]+', ' '))))
+	FROM staging_events_raw;
+""").format(staging_events_columns)
+
+staging_songs_insert = ("""
+	INSERT INTO staging_songs ({0}, match_key)
+	SELECT {0},
+		MD5(LOWER(TRIM(REGEXP_REPLACE(title, '[[:space:]]+', ' ')))
+		|| '|' || LOWER(TRIM(REGEXP_REPLACE(artist_name, '[[:space:]]+', ' '))))
+	FROM staging_songs_raw;
+""").format(staging_songs_columns)
+
+# Pre-staged part files written by prestage.py, listed in a manifest. They
+# carry match_key already.
+staging_events_copy_csv = ("""
+	COPY {} FROM '{}/{}/manifest' 
+	IAM_ROLE '{}'
+	CSV GZIP MANIFEST
+	TIMEFORMAT 'auto'
+	TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL
+	COMPUPDATE OFF
+	REGION 'us-west-2';
+""").format('staging_events', l.PRESTAGE_DATA, 'staging_events', l.DWH_ROLE_ARN)
+
+staging_songs_copy_csv = ("""
+	COPY {} FROM '{}/{}/manifest' 
+	IAM_ROLE '{}'
+	CSV GZIP MANIFEST
+	TRUNCATECOLUMNS BLANKSASNULL EMPTYASNULL
+	COMPUPDATE OFF
+	REGION 'us-west-2';
+""").format('staging_songs', l.PRESTAGE_DATA, 'staging_songs', l.DWH_ROLE_ARN)
+
+staging_events_copy_parquet = ("""
+	COPY {} FROM '{}/{}/manifest' 
+	IAM_ROLE '{}'
+	FORMAT AS PARQUET MANIFEST;
+""").format('staging_events', l.PRESTAGE_DATA, 'staging_events', l.DWH_ROLE_ARN)
+
+staging_songs_copy_parquet = ("""
+	COPY {} FROM '{}/{}/manifest' 
+	IAM_ROLE '{}'
+	FORMAT AS PARQUET MANIFEST;
+""").format('staging_songs', l.PRESTAGE_DATA, 'staging_songs', l.DWH_ROLE_ARN)
 
 
 # FINAL TABLES
 user_table_insert = ("""
 	INSERT INTO dm_users (user_id, first_name, last_Name, gender, level)
-	SELECT DISTINCT (userId) AS user_id, 
-		firstName AS first_name, 
-		lastName AS last_name, 
-		gender AS gender, 
-		level AS level
-	FROM staging_events
-	WHERE userId IS NOT NULL
-	AND page = 'NextSong';
+	SELECT user_id, first_name, last_name, gender, level
+	FROM (
+		SELECT userId AS user_id,
+			firstName AS first_name,
+			lastName AS last_name,
+			gender AS gender,
+			level AS level,
+			ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS rn
+		FROM staging_events
+		WHERE userId IS NOT NULL
+		AND page = 'NextSong'
+	) latest
+	WHERE rn = 1;
 """)
 
 song_table_insert = ("""
@@ -198,74 +358,398 @@ songplay_table_insert = ("""
 		se.userAgent
 	FROM staging_events se
 	JOIN staging_songs ss
-	ON se.song = ss.title
-	AND se.artist = ss.artist_name
+	ON se.match_key = ss.match_key
 	WHERE se.userId IS NOT NULL
 	AND se.page = 'NextSong';
 """)
 
-# COUNT QUERIES
-staging_events_table_count  = (""" 
-	SELECT 'Staging_Events:', COUNT(*) FROM staging_events;
+# MERGE INTO FINAL TABLES
+# Stage into a temp table, delete matching keys, insert; each list runs as
+# one transaction so the ETL can be re-run without dropping tables.
+# '{watermark}' limits the merge to newer events, filled in by incremental.py
+user_table_merge_since = ["""
+	CREATE TEMP TABLE dm_users_stage AS
+	SELECT user_id, first_name, last_name, gender, level
+	FROM (
+		SELECT userId AS user_id,
+			firstName AS first_name,
+			lastName AS last_name,
+			gender AS gender,
+			level AS level,
+			ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) AS rn
+		FROM staging_events
+		WHERE userId IS NOT NULL
+		AND page = 'NextSong'
+		AND ts > '{watermark}'
+	) latest
+	WHERE rn = 1;
+""", """
+	DELETE FROM dm_users
+	USING dm_users_stage s
+	WHERE dm_users.user_id = s.user_id;
+""", """
+	INSERT INTO dm_users (user_id, first_name, last_name, gender, level)
+	SELECT user_id, first_name, last_name, gender, level
+	FROM dm_users_stage;
+""", """
+	DROP TABLE dm_users_stage;
+"""]
+user_table_merge = [query.format(watermark='1900-01-01 00:00:00')
+                    for query in user_table_merge_since]
+
+song_table_merge = ["""
+	CREATE TEMP TABLE dm_songs_stage AS
+	SELECT song_id, title, artist_id, year, duration
+	FROM (
+		SELECT song_id, title, artist_id, year, duration,
+			ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY title, artist_id) AS rn
+		FROM staging_songs
+		WHERE song_id IS NOT NULL
+	) latest
+	WHERE rn = 1;
+""", """
+	DELETE FROM dm_songs
+	USING dm_songs_stage s
+	WHERE dm_songs.song_id = s.song_id;
+""", """
+	INSERT INTO dm_songs (song_id, title, artist_id, year, duration)
+	SELECT song_id, title, artist_id, year, duration
+	FROM dm_songs_stage;
+""", """
+	DROP TABLE dm_songs_stage;
+"""]
+
+artist_table_merge = ["""
+	CREATE TEMP TABLE dm_artists_stage AS
+	SELECT artist_id, name, location, latitude, longitude
+	FROM (
+		SELECT artist_id,
+			artist_name AS name,
+			artist_location AS location,
+			artist_latitude AS latitude,
+			artist_longitude AS longitude,
+			ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_name) AS rn
+		FROM staging_songs
+		WHERE artist_id IS NOT NULL
+	) latest
+	WHERE rn = 1;
+""", """
+	DELETE FROM dm_artists
+	USING dm_artists_stage s
+	WHERE dm_artists.artist_id = s.artist_id;
+""", """
+	INSERT INTO dm_artists (artist_id, name, location, latitude, longitude)
+	SELECT artist_id, name, location, latitude, longitude
+	FROM dm_artists_stage;
+""", """
+	DROP TABLE dm_artists_stage;
+"""]
+
+time_table_merge = ("""
+	INSERT INTO dm_time (start_time, hour, day, week, month, year, weekday)
+	SELECT DISTINCT (se.ts),
+		EXTRACT(hour FROM se.ts),
+		EXTRACT(day FROM se.ts),
+		EXTRACT(week FROM se.ts),
+		EXTRACT(month FROM se.ts),
+		EXTRACT(year FROM se.ts),
+		EXTRACT(weekday FROM se.ts)
+	FROM staging_events se
+	LEFT JOIN dm_time dmt
+	ON se.ts = dmt.start_time
+	WHERE se.ts IS NOT NULL
+	AND se.userId IS NOT NULL
+	AND se.page = 'NextSong'
+	AND dmt.start_time IS NULL;
+""")
+
+songplay_table_merge = ["""
+	DELETE FROM ft_songplays
+	USING staging_events se
+	WHERE ft_songplays.start_time = se.ts
+	AND ft_songplays.user_id = se.userId
+	AND ft_songplays.session_id = se.sessionId;
+""", songplay_table_insert]
+
+# INCREMENTAL INSERTS
+# Only events newer than the watermark, '{watermark}' filled in by incremental.py.
+# Rows already loaded are skipped by key, so a stale watermark can't duplicate them
+time_table_append = ("""
+	INSERT INTO dm_time (start_time, hour, day, week, month, year, weekday)
+	SELECT DISTINCT (se.ts),
+		EXTRACT(hour FROM se.ts),
+		EXTRACT(day FROM se.ts),
+		EXTRACT(week FROM se.ts),
+		EXTRACT(month FROM se.ts),
+		EXTRACT(year FROM se.ts),
+		EXTRACT(weekday FROM se.ts)
+	FROM staging_events se
+	LEFT JOIN dm_time dmt
+	ON se.ts = dmt.start_time
+	WHERE se.ts > '{watermark}'
+	AND se.userId IS NOT NULL
+	AND se.page = 'NextSong'
+	AND dmt.start_time IS NULL;
+""")
+
+songplay_table_append = ("""
+	INSERT INTO ft_songplays (start_time, user_id, level, song_id, artist_id,
+							  session_id, location, user_agent)
+	SELECT DISTINCT (se.ts),
+		se.userId,
+		se.level,
+		ss.song_id,
+		ss.artist_id,
+		se.sessionId,
+		se.location,
+		se.userAgent
+	FROM staging_events se
+	JOIN staging_songs ss
+	ON se.match_key = ss.match_key
+	WHERE se.userId IS NOT NULL
+	AND se.page = 'NextSong'
+	AND se.ts > '{watermark}'
+	AND NOT EXISTS (
+		SELECT 1 FROM ft_songplays sp
+		WHERE sp.start_time = se.ts
+		AND sp.user_id = se.userId
+		AND sp.session_id = se.sessionId
+	);
+""")
+
+# SUMMARY REBUILD
+# Full re-aggregation, used after full and merge loads
+song_plays_summary_rebuild = ["""
+	DELETE FROM sm_song_plays;
+""", """
+	INSERT INTO sm_song_plays (song_id, play_count)
+	SELECT song_id, COUNT(*)
+	FROM ft_songplays
+	GROUP BY song_id;
+"""]
+
+artist_plays_summary_rebuild = ["""
+	DELETE FROM sm_artist_plays;
+""", """
+	INSERT INTO sm_artist_plays (artist_id, play_count)
+	SELECT artist_id, COUNT(*)
+	FROM ft_songplays
+	GROUP BY artist_id;
+"""]
+
+time_plays_summary_rebuild = ["""
+	DELETE FROM sm_time_plays;
+""", """
+	INSERT INTO sm_time_plays (weekday, hour, play_count)
+	SELECT weekday, hour, COUNT(*)
+	FROM dm_time
+	GROUP BY weekday, hour;
+"""]
+
+# SUMMARY REFRESH
+# Add plays newer than the watermark, run with the incremental appends.
+# '{watermark}' filled in by incremental.py
+song_plays_summary_refresh = ["""
+	CREATE TEMP TABLE sm_song_plays_delta AS
+	SELECT song_id, COUNT(*) AS play_count
+	FROM ft_songplays
+	WHERE start_time > '{watermark}'
+	GROUP BY song_id;
+""", """
+	UPDATE sm_song_plays
+	SET play_count = sm_song_plays.play_count + d.play_count
+	FROM sm_song_plays_delta d
+	WHERE sm_song_plays.song_id = d.song_id;
+""", """
+	INSERT INTO sm_song_plays (song_id, play_count)
+	SELECT d.song_id, d.play_count
+	FROM sm_song_plays_delta d
+	LEFT JOIN sm_song_plays s
+	ON d.song_id = s.song_id
+	WHERE s.song_id IS NULL;
+""", """
+	DROP TABLE sm_song_plays_delta;
+"""]
+
+artist_plays_summary_refresh = ["""
+	CREATE TEMP TABLE sm_artist_plays_delta AS
+	SELECT artist_id, COUNT(*) AS play_count
+	FROM ft_songplays
+	WHERE start_time > '{watermark}'
+	GROUP BY artist_id;
+""", """
+	UPDATE sm_artist_plays
+	SET play_count = sm_artist_plays.play_count + d.play_count
+	FROM sm_artist_plays_delta d
+	WHERE sm_artist_plays.artist_id = d.artist_id;
+""", """
+	INSERT INTO sm_artist_plays (artist_id, play_count)
+	SELECT d.artist_id, d.play_count
+	FROM sm_artist_plays_delta d
+	LEFT JOIN sm_artist_plays s
+	ON d.artist_id = s.artist_id
+	WHERE s.artist_id IS NULL;
+""", """
+	DROP TABLE sm_artist_plays_delta;
+"""]
+
+time_plays_summary_refresh = ["""
+	CREATE TEMP TABLE sm_time_plays_delta AS
+	SELECT weekday, hour, COUNT(*) AS play_count
+	FROM dm_time
+	WHERE start_time > '{watermark}'
+	GROUP BY weekday, hour;
+""", """
+	UPDATE sm_time_plays
+	SET play_count = sm_time_plays.play_count + d.play_count
+	FROM sm_time_plays_delta d
+	WHERE sm_time_plays.weekday = d.weekday
+	AND sm_time_plays.hour = d.hour;
+""", """
+	INSERT INTO sm_time_plays (weekday, hour, play_count)
+	SELECT d.weekday, d.hour, d.play_count
+	FROM sm_time_plays_delta d
+	LEFT JOIN sm_time_plays s
+	ON d.weekday = s.weekday
+	AND d.hour = s.hour
+	WHERE s.weekday IS NULL;
+""", """
+	DROP TABLE sm_time_plays_delta;
+"""]
+
+# ETL CONTROL VALUES
+watermark_name = 'events_ts_watermark'
+etl_version_name = 'etl_version'
+control_select = ("""
+	SELECT value FROM etl_control WHERE name = %s;
 """)
-staging_songs_table_count  = (""" 
-	SELECT 'Staging_Songs:', COUNT(*) FROM staging_songs;
+control_delete = ("""
+	DELETE FROM etl_control WHERE name = %s;
 """)
-songplay_table_count  = (""" 
-	SELECT 'Songplays:', COUNT(*) FROM ft_songplays;
+control_insert = ("""
+	INSERT INTO etl_control (name, value, updated_at) VALUES (%s, %s, GETDATE());
 """)
-user_table_count  = (""" 
-	SELECT 'Users:', COUNT(*) FROM dm_users;
+# Checkpoints of a resumable run: 'checkpoint:<statement>' = run id
+run_id_name = 'etl_run_id'
+checkpoint_prefix = 'checkpoint:'
+checkpoint_select = ("""
+	SELECT name FROM etl_control WHERE name LIKE 'checkpoint:%%' AND value = %s;
 """)
-song_table_count  = (""" 
-	SELECT 'Songs:', COUNT(*) FROM dm_songs;
+checkpoint_clear = ("""
+	DELETE FROM etl_control WHERE name LIKE 'checkpoint:%%';
 """)
-artist_table_count  = (""" 
-	SELECT 'Artists:', COUNT(*) FROM dm_artists;
+staging_events_max_ts = ("""
+	SELECT MAX(ts) FROM staging_events;
 """)
-time_table_count  = ("""
-	SELECT 'Time:', COUNT(*) FROM dm_time;
+
+# Share of NextSong events matching a song by exact title/artist equality
+# and by the normalized match_key
+match_rate_report = ("""
+	WITH exact AS (
+		SELECT DISTINCT title, artist_name FROM staging_songs
+	),
+	keys AS (
+		SELECT DISTINCT match_key FROM staging_songs
+	)
+	SELECT COUNT(*), COUNT(e.title), COUNT(k.match_key)
+	FROM staging_events se
+	LEFT JOIN exact e
+	ON se.song = e.title
+	AND se.artist = e.artist_name
+	LEFT JOIN keys k
+	ON se.match_key = k.match_key
+	WHERE se.page = 'NextSong';
+""")
+
+# VERIFICATION QUERIES (see verify.py)
+# Row counts of every table in one statement
+table_counts = ("""
+	SELECT 'staging_events', COUNT(*) FROM staging_events
+	UNION ALL SELECT 'staging_songs', COUNT(*) FROM staging_songs
+	UNION ALL SELECT 'ft_songplays', COUNT(*) FROM ft_songplays
+	UNION ALL SELECT 'dm_users', COUNT(*) FROM dm_users
+	UNION ALL SELECT 'dm_songs', COUNT(*) FROM dm_songs
+	UNION ALL SELECT 'dm_artists', COUNT(*) FROM dm_artists
+	UNION ALL SELECT 'dm_time', COUNT(*) FROM dm_time
+	UNION ALL SELECT 'sm_song_plays', COUNT(*) FROM sm_song_plays
+	UNION ALL SELECT 'sm_artist_plays', COUNT(*) FROM sm_artist_plays
+	UNION ALL SELECT 'sm_time_plays', COUNT(*) FROM sm_time_plays;
+""")
+
+# Or from catalog stats without scanning. stv_tbl_perm has a row per slice
+# and counts deleted rows until VACUUM; reltuples is ANALYZE's estimate.
+catalog_table_counts = ("""
+	SELECT TRIM(name), SUM(rows)
+	FROM stv_tbl_perm
+	WHERE temp = 0
+	AND TRIM(name) IN %s
+	GROUP BY TRIM(name);
+""")
+pg_catalog_table_counts = ("""
+	SELECT relname, reltuples::BIGINT
+	FROM pg_class
+	WHERE relkind = 'r'
+	AND pg_table_is_visible(oid)
+	AND relname IN %s;
+""")
+
+# Null keys, orphan fact keys and duplicate dimension keys (all should be
+# 0), and the NextSong events matching a song, in one statement
+quality_checks = ("""
+	SELECT
+		(SELECT COUNT(*) FROM ft_songplays
+		 WHERE start_time IS NULL OR user_id IS NULL OR song_id IS NULL
+		 OR artist_id IS NULL) AS null_keys,
+		(SELECT COUNT(*) FROM ft_songplays f LEFT JOIN dm_songs s ON f.song_id = s.song_id
+		 WHERE s.song_id IS NULL) AS orphan_song_ids,
+		(SELECT COUNT(*) FROM ft_songplays f LEFT JOIN dm_artists a ON f.artist_id = a.artist_id
+		 WHERE a.artist_id IS NULL) AS orphan_artist_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT user_id) FROM dm_users) AS duplicate_user_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT song_id) FROM dm_songs) AS duplicate_song_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT artist_id) FROM dm_artists) AS duplicate_artist_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT start_time) FROM dm_time) AS duplicate_start_times,
+		(SELECT COUNT(*) FROM staging_events WHERE page = 'NextSong') AS nextsong_events,
+		(SELECT COUNT(*) FROM staging_events
+		 WHERE page = 'NextSong'
+		 AND match_key IN (SELECT match_key FROM staging_songs)) AS matched_events;
 """)
 
 
 # ANALYTICAL QUERIES
+# Read from the sm_ summary tables built by etl.py
 # Top 10 Songs
 top_songs = ("""
     WITH topsid as (
-    	SELECT song_id, count(*)
-    	FROM ft_songplays
-    	GROUP BY song_id
-    	ORDER BY 2 DESC
+    	SELECT song_id, play_count
+    	FROM sm_song_plays
+    	ORDER BY play_count DESC
     	LIMIT 10
     )
-    SELECT '"'|| dms.title ||'" by '|| dma.name || ' played ' || ft.count || ' times.'
+    SELECT '"'|| dms.title ||'" by '|| dma.name || ' played ' || ft.play_count || ' times.'
     FROM  topsid as ft
     INNER JOIN dm_songs dms 
     ON ft.song_id = dms.song_id
     INNER JOIN dm_artists dma
     ON dms.artist_id = dma.artist_id
-    GROUP BY dms.title, dma.name, ft.count
-    ORDER BY ft.count DESC
+    GROUP BY dms.title, dma.name, ft.play_count
+    ORDER BY ft.play_count DESC
 """)
 
 
 # Top 10 Artists
 top_artists = ("""
     WITH topart as (
-    	SELECT artist_id, song_id, count(*)
-    	FROM ft_songplays
-    	GROUP BY artist_id, song_id
-    	ORDER BY 2 DESC
+    	SELECT artist_id, play_count
+    	FROM sm_artist_plays
+    	ORDER BY play_count DESC
     	LIMIT 10
     )
-    SELECT '"'||dma.name||'" was played '||ft.count||' times.'
+    SELECT '"'||dma.name||'" was played '||ft.play_count||' times.'
     FROM  topart as ft
     INNER JOIN dm_artists dma 
     ON ft.artist_id = dma.artist_id
-    INNER JOIN dm_songs dms 
-    ON ft.song_id = dms.song_id
-    GROUP BY dma.name, ft.count
-    ORDER BY ft.count DESC
+    GROUP BY dma.name, ft.play_count
+    ORDER BY ft.play_count DESC
 """)
 
 # Paid versus Free Ratio
@@ -284,42 +768,494 @@ paid_free_rt = ("""
     FROM p,f
 """)
 
-# Peek Usage day of week
+# Peek Usage day of week, EXTRACT(weekday) counts from Sunday = 0
 peek_usage_day = ("""
     SELECT 
     	CASE 
+    		WHEN dmt.weekday = 0 THEN 'Sunday'
     		WHEN dmt.weekday = 1 THEN 'Monday'
     		WHEN dmt.weekday = 2 THEN 'Tuesday' 
     		WHEN dmt.weekday = 3 THEN 'Wednesday' 
     		WHEN dmt.weekday = 4 THEN 'Thursday' 
     		WHEN dmt.weekday = 5 THEN 'Friday'
     		WHEN dmt.weekday = 6 THEN 'Saturday' 
-    		WHEN dmt.weekday = 7 THEN 'Sunday'
     	END,
-    	'Total songplays:', count(*) 
-    FROM dm_time dmt
+    	'Total songplays:', SUM(dmt.play_count) 
+    FROM sm_time_plays dmt
     GROUP BY dmt.weekday
-    ORDER BY 2 DESC
+    ORDER BY 3 DESC
     LIMIT 1
 """)
 
 
+# WORKLOAD REPLAY (see workload_replay.py)
+# Repeated queries would otherwise be answered from Redshift's result cache
+result_cache_off = ("""
+	SET enable_result_cache_for_session TO off;
+""")
+
+
+# TABLE DESIGN STATISTICS (see table_advisor.py)
+table_info_select = ("""
+	SELECT tbl_rows, skew_rows, unsorted, encoded
+	FROM svv_table_info
+	WHERE "schema" = current_schema()
+	AND "table" = %s;
+""")
+analyze_compression = "ANALYZE COMPRESSION {}"
+# APPROXIMATE COUNT(DISTINCT) and COUNT of every column, filled in per table
+column_cardinality = ("""
+	SELECT {}
+	FROM {};
+""")
+# Local PostgreSQL fallback, from the statistics ANALYZE collects
+pg_table_rows = ("""
+	SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(%s);
+""")
+pg_column_stats = ("""
+	SELECT attname, n_distinct, null_frac
+	FROM pg_stats
+	WHERE schemaname = current_schema()
+	AND tablename = %s;
+""")
+
+# MAINTENANCE (see maintenance.py)
+# rows, deleted %, unsorted % and stats_off % of every table
+maintenance_table_stats = ("""
+	SELECT "table", tbl_rows,
+		CASE WHEN tbl_rows > 0
+			THEN 100.0 * (tbl_rows - estimated_visible_rows) / tbl_rows ELSE 0 END,
+		COALESCE(unsorted, 0),
+		COALESCE(stats_off, 0)
+	FROM svv_table_info
+	WHERE "schema" = current_schema();
+""")
+# PostgreSQL equivalents: dead tuples and rows modified since the last
+# ANALYZE. Heap tables aren't kept sorted, unsorted is always 0.
+pg_maintenance_table_stats = ("""
+	SELECT relname, n_live_tup + n_dead_tup,
+		CASE WHEN n_live_tup + n_dead_tup > 0
+			THEN 100.0 * n_dead_tup / (n_live_tup + n_dead_tup) ELSE 0 END,
+		0,
+		CASE WHEN n_live_tup > 0
+			THEN 100.0 * n_mod_since_analyze / n_live_tup ELSE 0 END
+	FROM pg_stat_user_tables
+	WHERE schemaname = current_schema();
+""")
+vacuum_delete_only = "VACUUM DELETE ONLY {}"
+vacuum_sort_only = "VACUUM SORT ONLY {}"
+vacuum_full = "VACUUM FULL {}"
+pg_vacuum = "VACUUM {}"
+analyze_table = "ANALYZE {}"
+
+# MIGRATION (see migrate.py)
+# Live columns: type, encoding, DISTKEY, SORTKEY position (negative when
+# interleaved) and NOT NULL, in column order
+table_columns = ("""
+	SELECT tablename, "column", type, encoding, distkey, sortkey, notnull
+	FROM pg_table_def
+	WHERE schemaname = current_schema();
+""")
+# 0 EVEN, 1 KEY, 8 ALL, 10-12 AUTO
+table_diststyles = ("""
+	SELECT relname, reldiststyle
+	FROM pg_class
+	WHERE relnamespace = (SELECT oid FROM pg_namespace WHERE nspname = current_schema())
+	AND relkind = 'r';
+""")
+# Local PostgreSQL/DuckDB: no encodings, distribution or sort keys
+local_table_columns = ("""
+	SELECT table_name, column_name, data_type, character_maximum_length,
+		numeric_precision, numeric_scale, is_nullable
+	FROM information_schema.columns
+	WHERE table_schema = current_schema()
+	ORDER BY table_name, ordinal_position;
+""")
+add_column = "ALTER TABLE {} ADD COLUMN {} {}"
+drop_column = "ALTER TABLE {} DROP COLUMN {}"
+alter_column_type = "ALTER TABLE {0} ALTER COLUMN {1} TYPE {2} USING CAST({1} AS {2})"
+alter_varchar_size = "ALTER TABLE {} ALTER COLUMN {} TYPE {}"
+alter_column_encode = "ALTER TABLE {} ALTER COLUMN {} ENCODE {}"
+alter_column_not_null = "ALTER TABLE {} ALTER COLUMN {} {} NOT NULL"
+# Deep copy: create the new layout, copy, swap in one transaction
+deep_copy_insert = "INSERT INTO {} ({}) SELECT {} FROM {}"
+drop_table = "DROP TABLE IF EXISTS {}"
+rename_table = "ALTER TABLE {} RENAME TO {}"
+
+# SURROGATE KEY VARIANTS
+# With etl_surrogate_keys, songs and artists get compact integer keys during
+# the dimension load and the fact & summary tables store those instead of
+# the VARCHAR ids. The variants replace the statements of the same name
+# below, so every list, graph and script picks them up.
+songplay_table_create_sk = ("""
+    CREATE TABLE IF NOT EXISTS ft_songplays (
+		songplay_id INTEGER IDENTITY(0,1) PRIMARY KEY,
+		start_time TIMESTAMP NOT NULL,
+		user_id INTEGER NOT NULL,
+		level VARCHAR(10),
+		song_key INTEGER NOT NULL,
+		artist_key INTEGER NOT NULL DISTKEY SORTKEY,
+		session_id INTEGER,
+		location VARCHAR,
+		user_agent VARCHAR
+	);
+""")
+
+# Small dimensions are copied to every node so fact joins stay local
+song_table_create_sk = ("""
+    CREATE TABLE IF NOT EXISTS dm_songs (
+	    song_key INTEGER IDENTITY(0,1) PRIMARY KEY SORTKEY,
+	    song_id VARCHAR NOT NULL,
+	    title VARCHAR NOT NULL,
+	    artist_key INTEGER NOT NULL,
+	    year INTEGER NOT NULL,
+	    duration DECIMAL
+	)
+	DISTSTYLE ALL;
+""")
+
+artist_table_create_sk = ("""
+    CREATE TABLE IF NOT EXISTS dm_artists (
+	    artist_key INTEGER IDENTITY(0,1) PRIMARY KEY SORTKEY,
+	    artist_id VARCHAR NOT NULL,
+	    name VARCHAR NOT NULL,
+	    location VARCHAR,
+	    latitude DECIMAL(10,6),
+	    longitude DECIMAL(10,6)
+	)
+	DISTSTYLE ALL;
+""")
+
+song_plays_summary_create_sk = ("""
+	CREATE TABLE IF NOT EXISTS sm_song_plays (
+		song_key INTEGER NOT NULL PRIMARY KEY DISTKEY,
+		play_count BIGINT NOT NULL
+	);
+""")
+
+artist_plays_summary_create_sk = ("""
+	CREATE TABLE IF NOT EXISTS sm_artist_plays (
+		artist_key INTEGER NOT NULL PRIMARY KEY DISTKEY,
+		play_count BIGINT NOT NULL
+	);
+""")
+
+# One row per id, keys are assigned by IDENTITY
+artist_table_insert_sk = ("""
+	INSERT INTO dm_artists (artist_id, name, location, latitude, longitude)
+	SELECT artist_id, name, location, latitude, longitude
+	FROM (
+		SELECT artist_id,
+			artist_name AS name,
+			artist_location AS location,
+			artist_latitude AS latitude,
+			artist_longitude AS longitude,
+			ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_name) AS rn
+		FROM staging_songs
+		WHERE artist_id IS NOT NULL
+	) latest
+	WHERE rn = 1;
+""")
+
+song_table_insert_sk = ("""
+	INSERT INTO dm_songs (song_id, title, artist_key, year, duration)
+	SELECT ss.song_id, ss.title, dma.artist_key, ss.year, ss.duration
+	FROM (
+		SELECT song_id, title, artist_id, year, duration,
+			ROW_NUMBER() OVER (PARTITION BY song_id ORDER BY title, artist_id) AS rn
+		FROM staging_songs
+		WHERE song_id IS NOT NULL
+	) ss
+	JOIN dm_artists dma
+	ON ss.artist_id = dma.artist_id
+	WHERE ss.rn = 1;
+""")
+
+# Events are matched on the staging match_key, keys come from dm_songs
+songplay_table_insert_sk = ("""
+	INSERT INTO ft_songplays (start_time, user_id, level, song_key, artist_key,
+							  session_id, location, user_agent)
+	SELECT DISTINCT (se.ts),
+		se.userId,
+		se.level,
+		dms.song_key,
+		dms.artist_key,
+		se.sessionId,
+		se.location,
+		se.userAgent
+	FROM staging_events se
+	JOIN staging_songs ss
+	ON se.match_key = ss.match_key
+	JOIN dm_songs dms
+	ON ss.song_id = dms.song_id
+	WHERE se.userId IS NOT NULL
+	AND se.page = 'NextSong';
+""")
+
+# Merges update matching ids in place so existing keys never change
+artist_table_merge_sk = [artist_table_merge[0], """
+	UPDATE dm_artists
+	SET name = s.name, location = s.location,
+		latitude = s.latitude, longitude = s.longitude
+	FROM dm_artists_stage s
+	WHERE dm_artists.artist_id = s.artist_id;
+""", """
+	INSERT INTO dm_artists (artist_id, name, location, latitude, longitude)
+	SELECT s.artist_id, s.name, s.location, s.latitude, s.longitude
+	FROM dm_artists_stage s
+	LEFT JOIN dm_artists dma
+	ON s.artist_id = dma.artist_id
+	WHERE dma.artist_id IS NULL;
+""", artist_table_merge[3]]
+
+song_table_merge_sk = [song_table_merge[0], """
+	UPDATE dm_songs
+	SET title = s.title, artist_key = dma.artist_key,
+		year = s.year, duration = s.duration
+	FROM dm_songs_stage s
+	JOIN dm_artists dma
+	ON s.artist_id = dma.artist_id
+	WHERE dm_songs.song_id = s.song_id;
+""", """
+	INSERT INTO dm_songs (song_id, title, artist_key, year, duration)
+	SELECT s.song_id, s.title, dma.artist_key, s.year, s.duration
+	FROM dm_songs_stage s
+	JOIN dm_artists dma
+	ON s.artist_id = dma.artist_id
+	LEFT JOIN dm_songs dms
+	ON s.song_id = dms.song_id
+	WHERE dms.song_id IS NULL;
+""", song_table_merge[3]]
+
+songplay_table_merge_sk = [songplay_table_merge[0], songplay_table_insert_sk]
+
+songplay_table_append_sk = ("""
+	INSERT INTO ft_songplays (start_time, user_id, level, song_key, artist_key,
+							  session_id, location, user_agent)
+	SELECT DISTINCT (se.ts),
+		se.userId,
+		se.level,
+		dms.song_key,
+		dms.artist_key,
+		se.sessionId,
+		se.location,
+		se.userAgent
+	FROM staging_events se
+	JOIN staging_songs ss
+	ON se.match_key = ss.match_key
+	JOIN dm_songs dms
+	ON ss.song_id = dms.song_id
+	WHERE se.userId IS NOT NULL
+	AND se.page = 'NextSong'
+	AND se.ts > '{watermark}'
+	AND NOT EXISTS (
+		SELECT 1 FROM ft_songplays sp
+		WHERE sp.start_time = se.ts
+		AND sp.user_id = se.userId
+		AND sp.session_id = se.sessionId
+	);
+""")
+
+song_plays_summary_rebuild_sk = [song_plays_summary_rebuild[0], """
+	INSERT INTO sm_song_plays (song_key, play_count)
+	SELECT song_key, COUNT(*)
+	FROM ft_songplays
+	GROUP BY song_key;
+"""]
+
+artist_plays_summary_rebuild_sk = [artist_plays_summary_rebuild[0], """
+	INSERT INTO sm_artist_plays (artist_key, play_count)
+	SELECT artist_key, COUNT(*)
+	FROM ft_songplays
+	GROUP BY artist_key;
+"""]
+
+song_plays_summary_refresh_sk = [query.replace('song_id', 'song_key')
+                                 for query in song_plays_summary_refresh]
+artist_plays_summary_refresh_sk = [query.replace('artist_id', 'artist_key')
+                                   for query in artist_plays_summary_refresh]
+
+top_songs_sk = ("""
+    WITH topsid as (
+    	SELECT song_key, play_count
+    	FROM sm_song_plays
+    	ORDER BY play_count DESC
+    	LIMIT 10
+    )
+    SELECT '"'|| dms.title ||'" by '|| dma.name || ' played ' || ft.play_count || ' times.'
+    FROM  topsid as ft
+    INNER JOIN dm_songs dms 
+    ON ft.song_key = dms.song_key
+    INNER JOIN dm_artists dma
+    ON dms.artist_key = dma.artist_key
+    GROUP BY dms.title, dma.name, ft.play_count
+    ORDER BY ft.play_count DESC
+""")
+
+top_artists_sk = ("""
+    WITH topart as (
+    	SELECT artist_key, play_count
+    	FROM sm_artist_plays
+    	ORDER BY play_count DESC
+    	LIMIT 10
+    )
+    SELECT '"'||dma.name||'" was played '||ft.play_count||' times.'
+    FROM  topart as ft
+    INNER JOIN dm_artists dma 
+    ON ft.artist_key = dma.artist_key
+    GROUP BY dma.name, ft.play_count
+    ORDER BY ft.play_count DESC
+""")
+
+# The fact table holds integer keys; dm_songs/dm_artists still keep one row per id
+quality_checks_sk = ("""
+	SELECT
+		(SELECT COUNT(*) FROM ft_songplays
+		 WHERE start_time IS NULL OR user_id IS NULL OR song_key IS NULL
+		 OR artist_key IS NULL) AS null_keys,
+		(SELECT COUNT(*) FROM ft_songplays f LEFT JOIN dm_songs s ON f.song_key = s.song_key
+		 WHERE s.song_key IS NULL) AS orphan_song_ids,
+		(SELECT COUNT(*) FROM ft_songplays f LEFT JOIN dm_artists a ON f.artist_key = a.artist_key
+		 WHERE a.artist_key IS NULL) AS orphan_artist_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT user_id) FROM dm_users) AS duplicate_user_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT song_id) FROM dm_songs) AS duplicate_song_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT artist_id) FROM dm_artists) AS duplicate_artist_ids,
+		(SELECT COUNT(*) - COUNT(DISTINCT start_time) FROM dm_time) AS duplicate_start_times,
+		(SELECT COUNT(*) FROM staging_events WHERE page = 'NextSong') AS nextsong_events,
+		(SELECT COUNT(*) FROM staging_events
+		 WHERE page = 'NextSong'
+		 AND match_key IN (SELECT match_key FROM staging_songs)) AS matched_events;
+""")
+
+if l.ETL_SURROGATE_KEYS:
+    songplay_table_create = songplay_table_create_sk
+    song_table_create = song_table_create_sk
+    artist_table_create = artist_table_create_sk
+    song_plays_summary_create = song_plays_summary_create_sk
+    artist_plays_summary_create = artist_plays_summary_create_sk
+    artist_table_insert = artist_table_insert_sk
+    song_table_insert = song_table_insert_sk
+    songplay_table_insert = songplay_table_insert_sk
+    artist_table_merge = artist_table_merge_sk
+    song_table_merge = song_table_merge_sk
+    songplay_table_merge = songplay_table_merge_sk
+    songplay_table_append = songplay_table_append_sk
+    song_plays_summary_rebuild = song_plays_summary_rebuild_sk
+    artist_plays_summary_rebuild = artist_plays_summary_rebuild_sk
+    song_plays_summary_refresh = song_plays_summary_refresh_sk
+    artist_plays_summary_refresh = artist_plays_summary_refresh_sk
+    top_songs = top_songs_sk
+    top_artists = top_artists_sk
+    quality_checks = quality_checks_sk
+
+
 # QUERY LISTS
 drop_table_queries = [staging_events_table_drop, staging_songs_table_drop,
                       songplay_table_drop, user_table_drop, song_table_drop,
-                      artist_table_drop, time_table_drop]
+                      artist_table_drop, time_table_drop, etl_control_table_drop,
+                      song_plays_summary_drop, artist_plays_summary_drop,
+                      time_plays_summary_drop]
 
 create_table_queries = [staging_events_table_create, staging_songs_table_create,
                         songplay_table_create, user_table_create, song_table_create,
-                        artist_table_create, time_table_create]
+                        artist_table_create, time_table_create, etl_control_table_create,
+                        song_plays_summary_create, artist_plays_summary_create,
+                        time_plays_summary_create]
 
-copy_table_queries = [staging_events_copy, staging_songs_copy]
+# Each load empties its table in the same transaction as the COPY, safe to
+# retry, and fills match_key on the way in from the raw table
+staging_events_load = [staging_events_raw_drop, staging_events_raw_create, staging_events_copy,
+                       staging_events_delete, staging_events_insert, staging_events_raw_drop]
+staging_songs_load = [staging_songs_raw_drop, staging_songs_raw_create, staging_songs_copy,
+                      staging_songs_delete, staging_songs_insert, staging_songs_raw_drop]
+staging_events_load_csv = [staging_events_delete, staging_events_copy_csv]
+staging_songs_load_csv = [staging_songs_delete, staging_songs_copy_csv]
+staging_events_load_parquet = [staging_events_delete, staging_events_copy_parquet]
+staging_songs_load_parquet = [staging_songs_delete, staging_songs_copy_parquet]
 
-insert_table_queries = [user_table_insert, song_table_insert, artist_table_insert,
-                        time_table_insert, songplay_table_insert]
+copy_table_queries = [staging_events_load, staging_songs_load]
 
-count_queries = [staging_events_table_count, staging_songs_table_count,
-                 songplay_table_count, user_table_count, song_table_count,
-                 artist_table_count, time_table_count]
+# Pre-staged COPY variants by prestage.py format
+prestaged_copy_queries = {
+    'csv': [staging_events_load_csv, staging_songs_load_csv],
+    'parquet': [staging_events_load_parquet, staging_songs_load_parquet],
+}
+
+# Artists before songs: with surrogate keys songs look up the artist key
+insert_table_queries = [user_table_insert, artist_table_insert, song_table_insert,
+                        time_table_insert, songplay_table_insert]
 
 analytical_queries = [top_songs, top_artists, paid_free_rt, peek_usage_day]
+analytical_query_names = ['top_songs', 'top_artists', 'paid_free_rt', 'peek_usage_day']
+
+merge_table_queries = [user_table_merge, artist_table_merge, song_table_merge,
+                       time_table_merge, songplay_table_merge]
+
+summary_table_queries = [song_plays_summary_rebuild, artist_plays_summary_rebuild,
+                         time_plays_summary_rebuild]
+
+incremental_append_queries = [user_table_merge_since, time_table_append, songplay_table_append]
+
+incremental_insert_queries = incremental_append_queries + [
+    song_plays_summary_refresh, artist_plays_summary_refresh, time_plays_summary_refresh]
+
+
+# QUERY GRAPHS
+# Tables each statement reads and writes, used by scheduler.py to run
+# independent statements concurrently. List order is the sequential order.
+copy_table_graph = [
+    {'name': 'staging_events_load', 'query': staging_events_load,
+     'reads': [], 'writes': ['staging_events']},
+    {'name': 'staging_songs_load', 'query': staging_songs_load,
+     'reads': [], 'writes': ['staging_songs']},
+]
+
+# Surrogate keys are looked up in the dimensions
+if l.ETL_SURROGATE_KEYS:
+    _song_reads = ['staging_songs', 'dm_artists']
+    _songplay_reads = ['staging_events', 'staging_songs', 'dm_songs']
+else:
+    _song_reads = ['staging_songs']
+    _songplay_reads = ['staging_events', 'staging_songs']
+
+prestaged_copy_graphs = {
+    fmt: [{'name': node['name'] + '_' + fmt, 'query': query,
+           'reads': node['reads'], 'writes': node['writes']}
+          for node, query in zip(copy_table_graph, queries)]
+    for fmt, queries in prestaged_copy_queries.items()
+}
+
+insert_table_graph = [
+    {'name': 'user_table_insert', 'query': user_table_insert,
+     'reads': ['staging_events'], 'writes': ['dm_users']},
+    {'name': 'artist_table_insert', 'query': artist_table_insert,
+     'reads': ['staging_songs'], 'writes': ['dm_artists']},
+    {'name': 'song_table_insert', 'query': song_table_insert,
+     'reads': _song_reads, 'writes': ['dm_songs']},
+    {'name': 'time_table_insert', 'query': time_table_insert,
+     'reads': ['staging_events'], 'writes': ['dm_time']},
+    {'name': 'songplay_table_insert', 'query': songplay_table_insert,
+     'reads': _songplay_reads, 'writes': ['ft_songplays']},
+]
+
+merge_table_graph = [
+    {'name': 'user_table_merge', 'query': user_table_merge,
+     'reads': ['staging_events'], 'writes': ['dm_users']},
+    {'name': 'artist_table_merge', 'query': artist_table_merge,
+     'reads': ['staging_songs'], 'writes': ['dm_artists']},
+    {'name': 'song_table_merge', 'query': song_table_merge,
+     'reads': _song_reads, 'writes': ['dm_songs']},
+    {'name': 'time_table_merge', 'query': time_table_merge,
+     'reads': ['staging_events'], 'writes': ['dm_time']},
+    {'name': 'songplay_table_merge', 'query': songplay_table_merge,
+     'reads': _songplay_reads, 'writes': ['ft_songplays']},
+]
+
+summary_table_graph = [
+    {'name': 'song_plays_summary_rebuild', 'query': song_plays_summary_rebuild,
+     'reads': ['ft_songplays'], 'writes': ['sm_song_plays']},
+    {'name': 'artist_plays_summary_rebuild', 'query': artist_plays_summary_rebuild,
+     'reads': ['ft_songplays'], 'writes': ['sm_artist_plays']},
+    {'name': 'time_plays_summary_rebuild', 'query': time_plays_summary_rebuild,
+     'reads': ['dm_time'], 'writes': ['sm_time_plays']},
+]
@@ -0,0 +1,271 @@
+#!/opt/conda/bin/python
+"""
+table_advisor.py: Recommend column encodings, DISTKEY/SORTKEY and DISTSTYLE
+- Reads every table of create_table_queries (parsed by schema.py)
+- On Redshift: ANALYZE COMPRESSION encodings, svv_table_info rows, skew,
+  unsorted % and encoding, APPROXIMATE COUNT(DISTINCT) per column
+- On a local PostgreSQL: rows, distinct values and null fraction from
+  pg_stats, encodings by column type as ENCODE AUTO picks them. DuckDB has
+  neither catalog and is refused
+- DISTKEY: the column the statements in sql_queries.py join the table on
+  most, if it has enough distinct values; dimensions up to
+  advisor_all_max_rows rows get DISTSTYLE ALL. SORTKEY: the most joined
+  column (merge joins), else the current SORTKEY, else the first TIMESTAMP
+- Prints a report per table and the recommended DDL, --output writes the DDL
+  in create_table_queries order
+"""
+import argparse
+import collections
+import re
+import sys
+import loadconfigs as l
+import instrument
+import sql_queries
+from backends import local_target
+from connection import ConnectionPool, dsn
+from prestage import part_count
+from schema import parse_table, render_table
+from sql_queries import create_table_queries, table_info_select, analyze_compression, \
+    column_cardinality, analyze_table, pg_table_rows, pg_column_stats
+
+# Encodings ENCODE AUTO gives by type, used without ANALYZE COMPRESSION.
+# Anything else (FLOAT, REAL, BOOLEAN) stays RAW.
+TYPE_ENCODINGS = {'SMALLINT': 'AZ64', 'INTEGER': 'AZ64', 'INT': 'AZ64', 'BIGINT': 'AZ64',
+                  'DECIMAL': 'AZ64', 'NUMERIC': 'AZ64', 'DATE': 'AZ64', 'TIMESTAMP': 'AZ64',
+                  'CHAR': 'LZO', 'VARCHAR': 'LZO'}
+
+# A DISTKEY needs this many distinct values per slice and few NULLs, which
+# all land on one slice
+MIN_DISTINCT_PER_SLICE = 4
+MAX_NULL_FRACTION = 0.1
+
+JOIN_PATTERN = re.compile(r'\b(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)')
+FROM_PATTERN = re.compile(r'\b(?:FROM|JOIN|UPDATE)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', re.IGNORECASE)
+KEYWORDS = {'ON', 'WHERE', 'SET', 'JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'CROSS', 'GROUP',
+            'ORDER', 'LIMIT', 'USING', 'UNION', 'EXCEPT', 'AND', 'OR', 'HAVING'}
+
+
+def sql_statements():
+    # Every distinct statement in sql_queries.py, including the variants
+    seen = set()
+    for name, value in vars(sql_queries).items():
+        if name.startswith('_') or not isinstance(value, (str, list)):
+            continue
+        for statement in ([value] if isinstance(value, str) else value):
+            if isinstance(statement, str) and statement not in seen:
+                seen.add(statement)
+                yield statement
+
+
+def join_counts():
+    # (table, column) -> number of statements joining the table on the column
+    counts = collections.Counter()
+    for statement in sql_statements():
+        aliases = {}
+        for table, alias in FROM_PATTERN.findall(statement):
+            aliases[table.lower()] = table.lower()
+            if alias and alias.upper() not in KEYWORDS:
+                aliases[alias.lower()] = table.lower()
+        joined = set()
+        for left, left_column, right, right_column in JOIN_PATTERN.findall(statement):
+            for alias, column in [(left, left_column), (right, right_column)]:
+                if alias.lower() in aliases:
+                    joined.add((aliases[alias.lower()], column.lower()))
+        counts.update(joined)
+    return counts
+
+
+def redshift_stats(cur, table):
+    name = table['name']
+    stats = {'rows': 0, 'skew': None, 'unsorted': None, 'encoded': None,
+             'distinct': {}, 'nulls': {}, 'encodings': {}, 'reduction': {}}
+    instrument.execute(cur, table_info_select, 'advisor', params=(name,))
+    row = cur.fetchone()
+    if row is not None:
+        stats.update(rows=row[0], skew=row[1], unsorted=row[2], encoded=row[3])
+
+    instrument.execute(cur, analyze_compression.format(name), 'advisor')
+    for _, column, encoding, reduction in cur.fetchall():
+        stats['encodings'][column.lower()] = encoding.upper()
+        stats['reduction'][column.lower()] = float(reduction)
+
+    columns = [column['name'].lower() for column in table['columns']]
+    select = ['COUNT(*)'] + ['APPROXIMATE COUNT(DISTINCT "{0}"), COUNT("{0}")'.format(column)
+                             for column in columns]
+    instrument.execute(cur, column_cardinality.format(', '.join(select), name), 'advisor')
+    row = cur.fetchone()
+    rows = row[0]
+    for idx, column in enumerate(columns):
+        distinct, present = row[1 + idx * 2], row[2 + idx * 2]
+        stats['distinct'][column] = distinct
+        stats['nulls'][column] = 1 - present / rows if rows else 0
+    stats['rows'] = rows
+    return stats
+
+
+def pg_stats(cur, table):
+    # n_distinct < 0 is a fraction of the rows
+    name = table['name']
+    stats = {'rows': 0, 'skew': None, 'unsorted': None, 'encoded': None,
+             'distinct': {}, 'nulls': {}, 'encodings': {}, 'reduction': {}}
+    instrument.execute(cur, analyze_table.format(name), 'advisor')
+    instrument.execute(cur, pg_table_rows, 'advisor', params=(name,))
+    row = cur.fetchone()
+    stats['rows'] = max(int(row[0]), 0) if row and row[0] is not None else 0
+    instrument.execute(cur, pg_column_stats, 'advisor', params=(name,))
+    for column, n_distinct, null_frac in cur.fetchall():
+        distinct = -n_distinct * stats['rows'] if n_distinct < 0 else n_distinct
+        stats['distinct'][column.lower()] = int(round(distinct))
+        stats['nulls'][column.lower()] = null_frac
+    return stats
+
+
+def recommend(table, stats, joins, slices=None):
+    # Recommended table dict and the reasons for each change
+    slices = slices or part_count()
+    name = table['name']
+    rows = stats['rows']
+    columns = [column['name'].lower() for column in table['columns']]
+    notes = []
+
+    def spreads(column):
+        distinct = stats['distinct'].get(column)
+        return distinct is not None and \
+            distinct >= min(rows, MIN_DISTINCT_PER_SLICE * slices) and \
+            stats['nulls'].get(column, 0) <= MAX_NULL_FRACTION
+
+    joined = sorted(((joins[(name, column)], stats['distinct'].get(column) or 0, column)
+                     for column in columns if joins[(name, column)]), reverse=True)
+    current = table['distkey'].lower() if table['distkey'] else None
+
+    recommended = dict(table, columns=[dict(column) for column in table['columns']])
+    if rows <= l.ADVISOR_ALL_MAX_ROWS and not name.startswith(('staging_', 'ft_')):
+        recommended.update(diststyle='ALL', distkey=None)
+        notes.append('DISTSTYLE ALL: {} rows, a copy on every node keeps joins local'.format(rows))
+    else:
+        candidates = [column for _, _, column in joined if spreads(column)]
+        if candidates:
+            # The current DISTKEY wins ties, no need to redistribute
+            distkey = candidates[0]
+            if current in candidates and joins[(name, current)] == joins[(name, distkey)]:
+                distkey = current
+            reason = 'joined in {} statement(s), {} distinct values'.format(
+                joins[(name, distkey)], stats['distinct'].get(distkey))
+        elif current and spreads(current) and \
+                (stats['skew'] is None or stats['skew'] <= l.ADVISOR_MAX_SKEW):
+            distkey, reason = current, 'not joined, spreads evenly'
+        else:
+            distkey, reason = None, 'no joined column spreads evenly'
+        recommended.update(diststyle='KEY' if distkey else 'EVEN', distkey=distkey)
+        notes.append('DISTKEY {} -> {}: {}'.format(current or '-', distkey or 'EVEN', reason))
+    if current and stats['skew'] is not None and stats['skew'] > l.ADVISOR_MAX_SKEW:
+        notes.append('DISTKEY {} is skewed: {:.2f}x rows on the fullest slice'.format(
+            current, stats['skew']))
+
+    timestamps = [column['name'] for column in table['columns'] if column['type'] == 'TIMESTAMP']
+    most_joined = [column for count, _, column in joined if count == joined[0][0]]
+    if joined and not (table['sortkey'] and table['sortkey'][0].lower() in most_joined):
+        sortkey, reason = most_joined[:1], 'most joined, allows merge joins'
+    elif table['sortkey']:
+        sortkey, reason = table['sortkey'], 'current'
+    elif timestamps:
+        sortkey, reason = timestamps[:1], 'first TIMESTAMP, for range-restricted scans'
+    else:
+        sortkey, reason = [], 'no joined or TIMESTAMP column'
+    sortkey = [column.lower() for column in sortkey]
+    recommended.update(sortkey=sortkey, sortstyle='COMPOUND' if len(sortkey) > 1 else None)
+    notes.append('SORTKEY {} -> {}: {}'.format(', '.join(table['sortkey']) or '-',
+                                              ', '.join(sortkey) or '-', reason))
+
+    # The first sort key column stays RAW so its zone maps stay selective
+    for column in recommended['columns']:
+        column_name = column['name'].lower()
+        if sortkey and column_name == sortkey[0]:
+            column['encode'] = 'RAW'
+        else:
+            column['encode'] = stats['encodings'].get(column_name) or \
+                TYPE_ENCODINGS.get(column['type'], 'RAW')
+        if recommended['distkey'] == column_name:
+            recommended['distkey'] = column['name']
+    recommended['sortkey'] = [column['name'] for column in recommended['columns']
+                              if column['name'].lower() in sortkey]
+    recommended['sortkey'].sort(key=lambda column: sortkey.index(column.lower()))
+    return recommended, notes
+
+
+def print_table(table, stats, joins, recommended, notes):
+    name = table['name']
+    print('\n{}: {} rows{}{}{}'.format(
+        name, stats['rows'],
+        ', skew {:.2f}'.format(stats['skew']) if stats['skew'] is not None else '',
+        ', {:.1f}% unsorted'.format(stats['unsorted']) if stats['unsorted'] is not None else '',
+        ', encoded {}'.format(stats['encoded']) if stats['encoded'] is not None else ''))
+    print('{:<20} {:<16} {:>12} {:>7} {:>6} {:>8} {:>10}'.format(
+        'COLUMN', 'TYPE', 'DISTINCT', 'NULL%', 'JOINS', 'ENCODE', 'REDUCTION'))
+    for column, advice in zip(table['columns'], recommended['columns']):
+        column_name = column['name'].lower()
+        reduction = stats['reduction'].get(column_name)
+        distinct = stats['distinct'].get(column_name)
+        print('{:<20} {:<16} {:>12} {:>7.1f} {:>6} {:>8} {:>10}'.format(
+            column['name'], column['type'], distinct if distinct is not None else '-',
+            stats['nulls'].get(column_name, 0) * 100, joins[(name, column_name)],
+            advice['encode'], '{:.1f}%'.format(reduction) if reduction is not None else '-'))
+    for note in notes:
+        print(note)
+    print(render_table(recommended))
+
+
+def advise(cur, redshift, tables=None):
+    joins = join_counts()
+    collect = redshift_stats if redshift else pg_stats
+    recommendations = []
+    for create_sql in create_table_queries:
+        table = parse_table(create_sql)
+        if tables and table['name'] not in tables:
+            continue
+        stats = collect(cur, table)
+        recommended, notes = recommend(table, stats, joins)
+        print_table(table, stats, joins, recommended, notes)
+        recommendations.append(recommended)
+    return recommendations
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Recommend encodings and distribution/sort keys')
+    parser.add_argument('--dsn', help='database to inspect (default: the cluster)')
+    parser.add_argument('--local', action='store_true',
+                        help='inspect the local PostgreSQL ([LOCAL] local_dsn)')
+    parser.add_argument('--table', action='append', help='table to inspect (default: all)')
+    parser.add_argument('--output', help='write the recommended DDL to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.local:
+        target, connect = local_target('postgres', args.dsn)
+    elif l.BACKEND == 'redshift':
+        target, connect = args.dsn or dsn(), None
+    elif l.BACKEND == 'postgres':
+        target, connect = local_target(l.BACKEND, args.dsn)
+    else:
+        sys.exit('Table advice needs Redshift (svv_table_info, ANALYZE COMPRESSION) or '
+                 'PostgreSQL (pg_stats), backend is {}'.format(l.BACKEND))
+    # ANALYZE COMPRESSION locks the table, autocommit releases it after each one
+    pool = ConnectionPool(target, maxconn=1, autocommit=True, connect=connect)
+    with pool.connection() as conn:
+        redshift = instrument.is_redshift(conn)
+        if not redshift:
+            print('Not Redshift: using pg_stats, encodings by column type')
+        recommendations = advise(conn.cursor(), redshift, args.table)
+    pool.closeall()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            for table in recommendations:
+                f.write(render_table(table))
+        print('Recommended DDL written to {}'.format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# The scripts are top-level modules and loadconfigs.py reads dwh.cfg from
+# the working directory: run pytest from the repository root
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,79 @@
+"""
+Tests for backends.py: Redshift statements translated for PostgreSQL/DuckDB
+"""
+import re
+import pytest
+from backends import translate
+from sql_queries import create_table_queries, songplay_table_create, time_table_insert, \
+    staging_events_insert, control_insert
+
+REDSHIFT_ONLY = r'\b(DISTKEY|SORTKEY|DISTSTYLE|ENCODE|IDENTITY\(|GETDATE|PRIMARY KEY)'
+
+
+def words(query):
+    return ' '.join(query.split())
+
+
+@pytest.mark.parametrize('query', [songplay_table_create, 'SET query_group TO etl'])
+def test_redshift_is_unchanged(query):
+    assert translate(query, 'redshift') is query
+
+
+@pytest.mark.parametrize('dialect', ['postgres', 'duckdb'])
+def test_create_tables_lose_redshift_syntax(dialect):
+    for query in create_table_queries:
+        translated = translate(query, dialect)
+        assert not re.search(REDSHIFT_ONLY, translated, re.IGNORECASE), translated
+
+
+def test_postgres_table_attributes():
+    query = """
+	CREATE TABLE IF NOT EXISTS t (
+		id INTEGER IDENTITY(0,1) PRIMARY KEY,
+		name VARCHAR ENCODE zstd DISTKEY,
+		hour INTEGER NOT NULL SORTKEY,
+		PRIMARY KEY (id, hour)
+	)
+	DISTSTYLE ALL
+	COMPOUND SORTKEY (hour, name);
+"""
+    assert words(translate(query, 'postgres')) == words("""
+	CREATE TABLE IF NOT EXISTS t (
+		id INTEGER GENERATED BY DEFAULT AS IDENTITY (START WITH 0 MINVALUE 0) ,
+		name VARCHAR  ,
+		hour INTEGER NOT NULL
+	)
+	;
+""")
+
+
+def test_duckdb_identity_becomes_a_sequence():
+    translated = translate(songplay_table_create, 'duckdb')
+    assert translated.startswith('CREATE SEQUENCE IF NOT EXISTS ft_songplays_songplay_id_seq '
+                                 'INCREMENT BY 1 MINVALUE 0 START 0;')
+    assert "songplay_id INTEGER DEFAULT nextval('ft_songplays_songplay_id_seq') NOT NULL" \
+        in translated
+
+
+@pytest.mark.parametrize('dialect, expected', [
+    ('postgres', 'NOW()'), ('duckdb', 'CAST(CURRENT_TIMESTAMP AS TIMESTAMP)')])
+def test_getdate(dialect, expected):
+    assert 'VALUES (%s, %s, {})'.format(expected) in translate(control_insert, dialect)
+
+
+@pytest.mark.parametrize('dialect', ['postgres', 'duckdb'])
+def test_functions(dialect):
+    assert 'EXTRACT(dow FROM ts)' in translate(time_table_insert, dialect)
+    # Redshift replaces every match, PostgreSQL only with 'g'
+    assert "REGEXP_REPLACE(song, '[[:space:]]+', ' ', 'g')" \
+        in translate(staging_events_insert, dialect)
+
+
+@pytest.mark.parametrize('query, postgres, duckdb', [
+    ('SET query_group TO etl', None, None),
+    ('SET statement_timeout TO 60000', 'SET statement_timeout TO 60000', None),
+    ('SELECT 1', 'SELECT 1', 'SELECT 1'),
+])
+def test_session_settings(query, postgres, duckdb):
+    assert translate(query, 'postgres') == postgres
+    assert translate(query, 'duckdb') == duckdb
@@ -0,0 +1,109 @@
+"""
+Tests for migrate.py: a catalog matching sql_queries.py plans no changes
+"""
+import re
+import pytest
+import loadconfigs as l
+import migrate
+from schema import parse_table
+from sql_queries import create_table_queries, table_columns, table_diststyles, \
+    local_table_columns
+
+# sql_queries.py type -> (catalog type name, width and scale when none is given)
+REDSHIFT_TYPES = {'VARCHAR': ('character varying', (256, 0)), 'CHAR': ('character', (1, 0)),
+                  'INTEGER': ('integer', None), 'BIGINT': ('bigint', None),
+                  'DECIMAL': ('numeric', (18, 0)), 'FLOAT': ('double precision', None),
+                  'TIMESTAMP': ('timestamp without time zone', None)}
+DISTSTYLES = {'EVEN': 0, 'KEY': 1, 'ALL': 8, None: 10}
+
+
+class CatalogCursor:
+    # Answers the catalog queries of migrate.py with fixed rows
+    def __init__(self, results):
+        self.results = results
+        self.rowcount = -1
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.rows = self.results[query]
+
+    def fetchall(self):
+        return self.rows
+
+
+def tables():
+    return [(query, parse_table(query)) for query in create_table_queries]
+
+
+def catalog_not_null(query, table, column):
+    # As the catalog reports it: NOT NULL, IDENTITY or part of the PRIMARY KEY
+    line = re.search(r'^\s*{}\s.*$'.format(column['name']), query, re.MULTILINE).group(0)
+    return bool(re.search(r'\b(NOT\s+NULL|PRIMARY\s+KEY|IDENTITY)\b', line, re.IGNORECASE)) \
+        or column['name'] in table['primary_key']
+
+
+def redshift_catalog():
+    columns, diststyles = [], []
+    for query, table in tables():
+        for column in table['columns']:
+            name, default = REDSHIFT_TYPES[column['type']]
+            width, scale = (column['width'], column['scale']) if column['width'] else \
+                default or (None, 0)
+            type_ = name if width is None else '{}({},{})'.format(name, width, scale) \
+                if name == 'numeric' else '{}({})'.format(name, width)
+            sortkey = table['sortkey'].index(column['name']) + 1 \
+                if column['name'] in table['sortkey'] else 0
+            columns.append((table['name'], column['name'], type_,
+                            (column['encode'] or 'lzo').lower(),
+                            table['distkey'] == column['name'], sortkey,
+                            catalog_not_null(query, table, column)))
+        diststyles.append((table['name'], DISTSTYLES[table['diststyle']]))
+    return {table_columns: columns, table_diststyles: diststyles}
+
+
+def postgres_catalog():
+    columns = []
+    for query, table in tables():
+        for column in table['columns']:
+            name, _ = REDSHIFT_TYPES[column['type']]
+            columns.append((table['name'], column['name'], name,
+                            column['width'] if name in ('character varying', 'character') else None,
+                            column['width'] if name == 'numeric' else None,
+                            column['scale'] if name == 'numeric' else None,
+                            'NO' if catalog_not_null(query, table, column) else 'YES'))
+    return {local_table_columns: columns}
+
+
+@pytest.fixture(autouse=True)
+def no_metrics(monkeypatch):
+    monkeypatch.setattr(l, 'METRICS_ENABLED', False)
+
+
+def test_identity_and_primary_key_columns_are_not_null():
+    table = parse_table(create_table_queries[2])
+    assert table['name'] == 'ft_songplays'
+    assert table['columns'][0]['name'] == 'songplay_id'
+    assert table['columns'][0]['not_null']
+    sm_time_plays = parse_table(create_table_queries[-1])
+    assert sm_time_plays['primary_key'] == ['weekday', 'hour']
+    assert all(column['not_null'] for column in sm_time_plays['columns'])
+
+
+@pytest.mark.parametrize('dialect, catalog', [('redshift', redshift_catalog),
+                                              ('postgres', postgres_catalog)])
+def test_unchanged_schema_plans_nothing(dialect, catalog):
+    steps = migrate.plan_migration(CatalogCursor(catalog()), dialect)
+    assert [(table, action, changes, statements) for table, action, changes, statements in steps
+            if action != 'unchanged'] == []
+    assert len(steps) == len(create_table_queries)
+
+
+def test_nullable_primary_key_is_changed():
+    catalog = postgres_catalog()
+    catalog[local_table_columns] = [row[:6] + ('YES',) if row[:2] == ('ft_songplays', 'songplay_id')
+                                    else row for row in catalog[local_table_columns]]
+    steps = {table: (action, statements)
+             for table, action, _, statements in migrate.plan_migration(CatalogCursor(catalog),
+                                                                       'postgres')}
+    assert steps['ft_songplays'] == (
+        'alter', ['ALTER TABLE ft_songplays ALTER COLUMN songplay_id SET NOT NULL'])
@@ -0,0 +1,73 @@
+"""
+Tests for scheduler.py: dependencies, execution order and cycles
+"""
+import pytest
+from scheduler import build_dependencies, execution_waves, critical_path
+from sql_queries import copy_table_graph, insert_table_graph, summary_table_graph
+
+
+def node(name, reads=(), writes=()):
+    return {'name': name, 'query': 'SELECT 1', 'reads': list(reads), 'writes': list(writes)}
+
+
+def test_dependencies_follow_table_conflicts():
+    nodes = [node('load_a', writes=['a']),
+             node('load_b', writes=['b']),
+             node('join', reads=['a', 'b'], writes=['c']),
+             node('rewrite_a', reads=['c'], writes=['a']),
+             node('report', reads=['b'])]
+    assert build_dependencies(nodes) == {
+        'load_a': set(),
+        'load_b': set(),
+        # reads what both loads write
+        'join': {'load_a', 'load_b'},
+        # overwrites what join read, after the write it replaces
+        'rewrite_a': {'load_a', 'join'},
+        # reads only, alongside everything but the load it reads
+        'report': {'load_b'},
+    }
+
+
+def test_waves_run_independent_nodes_together():
+    nodes = [node('load_a', writes=['a']),
+             node('load_b', writes=['b']),
+             node('join', reads=['a', 'b'], writes=['c']),
+             node('report', reads=['b'])]
+    assert execution_waves(nodes, build_dependencies(nodes)) == [
+        ['load_a', 'load_b'], ['join', 'report']]
+
+
+def test_etl_graphs_order():
+    nodes = copy_table_graph + insert_table_graph + summary_table_graph
+    waves = execution_waves(nodes, build_dependencies(nodes))
+    position = {name: idx for idx, wave in enumerate(waves) for name in wave}
+    assert position['staging_events_load'] == position['staging_songs_load'] == 0
+    for name in ['user_table_insert', 'time_table_insert', 'songplay_table_insert']:
+        assert position[name] > position['staging_events_load']
+    assert position['song_plays_summary_rebuild'] > position['songplay_table_insert']
+    assert position['artist_plays_summary_rebuild'] > position['songplay_table_insert']
+    assert position['time_plays_summary_rebuild'] > position['time_table_insert']
+    assert sorted(position) == sorted(n['name'] for n in nodes)
+
+
+def test_duplicate_names_are_refused():
+    nodes = [node('load', writes=['a']),
+             node('insert', reads=['a'], writes=['b']),
+             node('load', reads=['b'], writes=['a'])]
+    with pytest.raises(ValueError, match='Duplicate node names: load'):
+        build_dependencies(nodes)
+
+
+def test_cycle_is_refused():
+    nodes = [node('a'), node('b'), node('c')]
+    deps = {'a': set(), 'b': {'c'}, 'c': {'b'}}
+    with pytest.raises(ValueError, match='cycle between: b, c'):
+        execution_waves(nodes, deps)
+
+
+def test_critical_path_is_longest_chain():
+    nodes = [node('load_a', writes=['a']),
+             node('load_b', writes=['b']),
+             node('join', reads=['a', 'b'], writes=['c'])]
+    deps = build_dependencies(nodes)
+    assert critical_path(nodes, deps, {'load_a': 1.0, 'load_b': 3.0, 'join': 2.0}) == 5.0
@@ -0,0 +1,124 @@
+#!/opt/conda/bin/python
+"""
+verify.py: Verify a load with row counts and data quality checks
+- Counts every table in one statement, or with verify_catalog_counts from
+  catalog stats (stv_tbl_perm on Redshift, pg_class locally) without scanning
+- In one more statement: null keys in ft_songplays, song/artist keys with
+  no dimension row, duplicate dimension keys and the NextSong events
+  matching a song
+- Each check has a limit from [VERIFY] in dwh.cfg; with verify_fail (or
+  --fail) a failed check fails the run, etl.py runs it before stamping
+  the ETL version
+- --report writes the result as JSON
+"""
+import argparse
+import datetime
+import json
+import sys
+import loadconfigs as l
+import instrument
+from connection import get_pool
+from schema import parse_table
+from sql_queries import create_table_queries, table_counts, catalog_table_counts, \
+    pg_catalog_table_counts, quality_checks
+
+MATCH_COLUMNS = ('nextsong_events', 'matched_events')
+
+
+def count_rows(cur, catalog=False):
+    # table -> rows, and where the counts came from
+    if catalog and l.BACKEND != 'duckdb':
+        tables = tuple(parse_table(query)['name'] for query in create_table_queries)
+        redshift = instrument.is_redshift(cur.connection)
+        instrument.execute(cur, catalog_table_counts if redshift else pg_catalog_table_counts,
+                           'verify', 'catalog_table_counts', (tables,))
+        counts = {name: int(rows) for name, rows in cur.fetchall()}
+        return {name: counts[name] for name in tables if name in counts}, \
+            'stv_tbl_perm' if redshift else 'pg_class'
+    instrument.execute(cur, table_counts, 'verify', 'table_counts')
+    return {name: int(rows) for name, rows in cur.fetchall()}, 'COUNT(*)'
+
+
+def check_quality(cur, max_bad_rows=l.VERIFY_MAX_BAD_ROWS, min_match_rate=l.VERIFY_MIN_MATCH_RATE):
+    # [{'name', 'value', 'limit', 'passed'}] of one quality_checks row
+    instrument.execute(cur, quality_checks, 'verify', 'quality_checks')
+    values = dict(zip([column[0] for column in cur.description], cur.fetchone()))
+    checks = [{'name': name, 'value': int(value), 'limit': '<= {}'.format(max_bad_rows),
+               'passed': value <= max_bad_rows}
+              for name, value in values.items() if name not in MATCH_COLUMNS]
+    events, matched = (values[name] for name in MATCH_COLUMNS)
+    if events:
+        rate = matched / events
+        checks.append({'name': 'match_rate', 'value': round(rate, 4),
+                       'limit': '>= {}'.format(min_match_rate),
+                       'passed': rate >= min_match_rate,
+                       'detail': '{} of {} NextSong events'.format(matched, events)})
+    return checks
+
+
+def verify(cur, conn, catalog=l.VERIFY_CATALOG_COUNTS, max_bad_rows=l.VERIFY_MAX_BAD_ROWS,
+           min_match_rate=l.VERIFY_MIN_MATCH_RATE):
+    counts, counted_by = count_rows(cur, catalog)
+    checks = check_quality(cur, max_bad_rows, min_match_rate)
+    conn.commit()
+    return {'timestamp': datetime.datetime.utcnow().isoformat(),
+            'counts': counts, 'counted_by': counted_by, 'checks': checks,
+            'passed': all(check['passed'] for check in checks)}
+
+
+def print_report(report):
+    print('Row counts ({}):'.format(report['counted_by']))
+    for name, rows in report['counts'].items():
+        print('  {:<24} {:>12}'.format(name, rows))
+    print('Quality checks:')
+    for check in report['checks']:
+        value = '{:.1%}'.format(check['value']) if check['name'] == 'match_rate' \
+            else check['value']
+        print('  {:<24} {:>12}  {:<8} {}{}'.format(
+            check['name'], value, check['limit'], 'OK' if check['passed'] else 'FAILED',
+            '  ({})'.format(check['detail']) if check.get('detail') else ''))
+
+
+def run_verify(cur, conn, fail=l.VERIFY_FAIL, report_path=None, **limits):
+    print('\nVerify Load')
+    report = verify(cur, conn, **limits)
+    print_report(report)
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Report written to {}'.format(report_path))
+    failed = [check['name'] for check in report['checks'] if not check['passed']]
+    if failed and fail:
+        raise RuntimeError('VERIFY FAILED: {}'.format(', '.join(failed)))
+    print('VERIFY {}'.format('COMPLETED WITH FAILED CHECKS: ' + ', '.join(failed)
+                             if failed else 'PASSED'))
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Row counts and data quality checks')
+    parser.add_argument('--catalog', action='store_true', default=l.VERIFY_CATALOG_COUNTS,
+                        help='row counts from catalog stats instead of COUNT(*)')
+    parser.add_argument('--max-bad-rows', type=int, default=l.VERIFY_MAX_BAD_ROWS,
+                        help='null, orphan or duplicate keys allowed per check')
+    parser.add_argument('--min-match-rate', type=float, default=l.VERIFY_MIN_MATCH_RATE,
+                        help='share of NextSong events that must match a song')
+    parser.add_argument('--fail', action='store_true', default=l.VERIFY_FAIL,
+                        help='exit with status 1 when a check fails')
+    parser.add_argument('--report', help='write the report as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with get_pool(l.ANALYTICS_QUERY_GROUP).connection() as conn:
+        try:
+            run_verify(conn.cursor(), conn, args.fail, args.report, catalog=args.catalog,
+                       max_bad_rows=args.max_bad_rows, min_match_rate=args.min_match_rate)
+        except RuntimeError as e:
+            print(e)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+#!/opt/conda/bin/python
+"""
+workload_replay.py: Replay a concurrent analyst workload and report latencies
+- --sessions simulated analysts, each on its own pooled connection, run a
+  weighted random mix (--mix name=weight) of the analytical_queries and any
+  --sql files for --duration seconds, with optional --think-time between
+- Every result is fetched in full; the local result cache and, on Redshift,
+  the session result cache are bypassed so each run hits the database
+- Reports per query and overall: runs, errors, queries/sec and p50/p95/p99
+  latency; --report saves it as JSON to compare node types or WLM settings
+- --local runs against the local PostgreSQL, statements translated by backends.py
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import threading
+import time
+import loadconfigs as l
+import instrument
+from backends import local_target
+from benchmark import git_commit
+from connection import ConnectionPool, dsn
+from sql_queries import analytical_queries, analytical_query_names, result_cache_off
+
+
+def workload(sql_files=(), mix=()):
+    # (name, query, weight) of the analytical queries and SQL files, weights
+    # from name=weight pairs, 1 for anything not listed
+    queries = list(zip(analytical_query_names, analytical_queries))
+    for path in sql_files:
+        with open(path) as f:
+            queries.append((os.path.splitext(os.path.basename(path))[0], f.read().strip().rstrip(';')))
+    weights = {}
+    for item in mix:
+        name, _, weight = item.partition('=')
+        weights[name] = float(weight)
+    unknown = set(weights) - {name for name, _ in queries}
+    if unknown:
+        raise ValueError('Unknown queries in --mix: {}'.format(', '.join(sorted(unknown))))
+    return [(name, query, weights.get(name, 1.0)) for name, query in queries
+            if weights.get(name, 1.0) > 0]
+
+
+def session(pool, queries, deadline, think_time, seed, results, stop, active):
+    rng = random.Random(seed)
+    names = [name for name, _, _ in queries]
+    weights = [weight for _, _, weight in queries]
+    statements = {name: query for name, query, _ in queries}
+    with pool.connection() as conn:
+        with active['lock']:
+            active['conns'].add(conn)
+        try:
+            cur = conn.cursor()
+            if instrument.is_redshift(conn):
+                cur.execute(result_cache_off)
+            while not stop.is_set() and time.time() < deadline:
+                name = rng.choices(names, weights)[0]
+                error = None
+                start = time.time()
+                # Timed here rather than through instrument.execute, whose
+                # query id lookup would add a round trip to every run
+                try:
+                    cur.execute(statements[name])
+                    cur.fetchall()
+                except Exception as e:
+                    error = str(e).strip()
+                    if not conn.autocommit:
+                        conn.rollback()
+                results.append((name, time.time() - start, error))
+                if think_time:
+                    stop.wait(rng.expovariate(1 / think_time))
+        finally:
+            with active['lock']:
+                active['conns'].discard(conn)
+
+
+def run_load(pool, queries, sessions, duration, think_time=0, seed=42):
+    # (name, seconds, error) of every run, and the wall time
+    results, stop = [], threading.Event()
+    active = {'lock': threading.Lock(), 'conns': set()}
+    deadline = time.time() + duration
+    threads = [threading.Thread(target=session, daemon=True,
+                                args=(pool, queries, deadline, think_time, seed + idx,
+                                      results, stop, active))
+               for idx in range(sessions)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        print('\nCancelling running queries...')
+        stop.set()
+        with active['lock']:
+            for conn in active['conns']:
+                conn.cancel()
+        for thread in threads:
+            thread.join()
+    return results, time.time() - start
+
+
+def percentile(values, pct):
+    # Nearest rank
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def summarize(results, wall_time, names):
+    report = []
+    for name in names + ['ALL']:
+        runs = [(seconds, error) for query, seconds, error in results if name in (query, 'ALL')]
+        seconds = [s for s, error in runs if error is None]
+        report.append({'name': name, 'runs': len(runs),
+                       'errors': sum(1 for _, error in runs if error is not None),
+                       'qps': round(len(seconds) / wall_time, 3) if wall_time else None,
+                       'p50': round(percentile(seconds, 50), 4) if seconds else None,
+                       'p95': round(percentile(seconds, 95), 4) if seconds else None,
+                       'p99': round(percentile(seconds, 99), 4) if seconds else None,
+                       'max': round(max(seconds), 4) if seconds else None})
+    return report
+
+
+def print_report(report, sessions, wall_time):
+    print('\n{} sessions, {:.1f}s'.format(sessions, wall_time))
+    print('{:<24} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'QUERY', 'RUNS', 'ERRORS', 'QUERIES/S', 'P50', 'P95', 'P99', 'MAX'))
+    for row in report:
+        print('{:<24} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            row['name'], row['runs'], row['errors'],
+            *('-' if row[key] is None else row[key]
+              for key in ['qps', 'p50', 'p95', 'p99', 'max'])))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay a concurrent analyst workload')
+    parser.add_argument('--dsn', help='database to load (default: the cluster)')
+    parser.add_argument('--local', action='store_true',
+                        help='load the local PostgreSQL ([LOCAL] local_dsn)')
+    parser.add_argument('--sessions', type=int, default=l.ANALYTICS_MAX_WORKERS,
+                        help='concurrent simulated analysts')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run')
+    parser.add_argument('--sql', action='append', default=[],
+                        help='SQL file with one more query, named after the file')
+    parser.add_argument('--mix', action='append', default=[],
+                        help='name=weight, e.g. top_songs=4 (default weight 1, 0 leaves it out)')
+    parser.add_argument('--think-time', type=float, default=0,
+                        help='mean seconds a session waits between queries')
+    parser.add_argument('--timeout', type=int, default=l.ANALYTICS_QUERY_TIMEOUT,
+                        help='statement_timeout in ms (0 = none)')
+    parser.add_argument('--query-group', default=l.ANALYTICS_QUERY_GROUP,
+                        help='Redshift query_group, to route the sessions to a WLM queue')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', help='write the report as JSON to this file')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    queries = workload(args.sql, args.mix)
+    if args.local:
+        target, connect = local_target('postgres', args.dsn)
+    elif l.BACKEND == 'redshift':
+        target, connect = args.dsn or dsn(), None
+    else:
+        target, connect = local_target(l.BACKEND, args.dsn)
+    pool = ConnectionPool(target, minconn=args.sessions, maxconn=args.sessions,
+                          autocommit=True, statement_timeout=args.timeout,
+                          query_group=args.query_group, connect=connect)
+    # Connect every session up front so the first queries don't pay for it
+    pool.prefill()
+
+    print('Load test: {} sessions for {}s, mix {}'.format(
+        args.sessions, args.duration,
+        ', '.join('{}={:g}'.format(name, weight) for name, _, weight in queries)))
+    results, wall_time = run_load(pool, queries, args.sessions, args.duration,
+                                  args.think_time, args.seed)
+    pool.closeall()
+
+    report = summarize(results, wall_time, [name for name, _, _ in queries])
+    print_report(report, args.sessions, wall_time)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'commit': git_commit(), 'backend': l.BACKEND if not args.local else 'postgres',
+                       'timestamp': datetime.datetime.utcnow().isoformat(),
+                       'dwh_num_nodes': l.DWH_NUM_NODES, 'dwh_node_type': l.DWH_NODE_TYPE,
+                       'sessions': args.sessions, 'duration': args.duration,
+                       'think_time': args.think_time, 'query_group': args.query_group,
+                       'results': report}, f, indent=2)
+        print('Report written to {}'.format(args.report))
+
+
+if __name__ == "__main__":
+    main()